@@ -0,0 +1 @@
+Added the rpath_proddef.aio module. Its RepositorySession returns event loop futures for loadFromRepository, saveToRepository, rebase and snapshotVersions, running the Conary calls on a bounded thread pool. Operations that have not started yet can be cancelled.
@@ -0,0 +1 @@
+Added ProductDefinition.buildMatrix(), which resolves every build for every stage (label, flavor, image fields, groups, partition scheme) into one immutable table, cached until the definition is modified. invalidateCache() drops cached views after direct changes to the generated objects.
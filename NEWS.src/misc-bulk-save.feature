@@ -0,0 +1 @@
+Added BulkSave, which saves many product and platform definitions with a single lookup of the existing source troves, skips definitions that did not change, signs the source troves once per key and commits them in one or a few size-bounded changesets.
@@ -0,0 +1 @@
+Added python -m rpath_proddef.bulk, which validates all product and platform definition documents in directories or tarballs against the schema for their version. It can optionally migrate them to a target version, uses a pool of worker processes, and reports one JSON line per document with timings.
@@ -0,0 +1 @@
+Added canSerializeAs(version), which tells whether a definition can be written as an older schema version and lists the fields set in it that the older schema has no room for, without migrating it. The answer comes from a table computed once per schema version from the migration registry and the generated classes (MigrationManager.getBackMigrationTable).
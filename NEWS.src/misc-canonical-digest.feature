@@ -0,0 +1 @@
+serialize() can write the canonical form of a definition (Canonical XML, with architectures, flavor sets, container templates, build templates and partition schemes sorted by key), and the new digest() method returns a digest of that form, computed while it is written and kept until the definition changes. Saving to the repository no longer commits definitions whose canonical form did not change.
@@ -0,0 +1 @@
+Changes to the generated objects are now tracked: assigning a member, or changing a list member, marks the object and its parents as modified. The definition and each of its sections cache their exported XML, so serializing a definition again only re-exports the sections that changed, and the new isModified() method tells in constant time whether a definition changed since it was loaded, created or saved. Derived views cached by the definition (build matrix, promote maps) are now also refreshed after direct changes to the generated objects. Objects are only tracked once something can observe their changes (a parent, a generation, cached output), so the objects being initialized and built skip the checks; the attribute hook itself still makes loading a 290 KB definition with 2000 builds about 20% slower than before tracking was added (0.30s instead of 0.25s).
@@ -0,0 +1 @@
+The generated objects are now exported by writers compiled once per class from the member specs (rpath_proddef.exporter), with the element tags computed in advance and the output joined from a list. The XML produced is the same as that of the generated export methods, which remain in use for classes with customized export or formatting methods. `scripts/benchmark.py export` compares the two.
@@ -0,0 +1 @@
+parseStream() (and the fromStream argument of the definition constructors) now accepts gzip, bzip2 and xz compressed definitions, as strings or file objects, and decompresses them in chunks as the parser reads them; xz requires the lzma module. Plain regular files of 1 MiB or more are memory mapped instead of read through the file buffers.
@@ -0,0 +1 @@
+Definitions can be handed to and taken from lxml directly: toElementTree() returns the element tree that serialize() would write, validated the same way, and the fromElementTree() class method builds a definition from an element tree (or its root element) through SAX events, without serializing it to text first.
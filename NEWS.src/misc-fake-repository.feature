@@ -0,0 +1 @@
+Added rpath_proddef.fakerepos, an in-memory stand-in for a Conary repository and client. It supports saving, loading, rebasing and snapshotting definitions, counts calls by method, and can add per-call latency.
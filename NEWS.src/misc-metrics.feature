@@ -0,0 +1 @@
+Added rpath_proddef.metrics, a thread-safe registry of counters and histograms updated by the library: document parses by schema version, migration hops, repository calls by method, bytes downloaded, and load/save/rebase latencies. Metrics can be dumped in the Prometheus text format or as a dictionary.
@@ -0,0 +1 @@
+Repository queries made by snapshotVersions, loadFromRepository and rebase can be spread over a RepositoryQueryExecutor, which groups trove specs by repository host and queries the hosts concurrently, with a configurable worker count and timeout.
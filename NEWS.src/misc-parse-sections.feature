@@ -0,0 +1 @@
+Definitions can be loaded with only some of their sections, for instance ProductDefinition(stream, sections = ['stages', 'searchPaths']): the other elements under the root element are not built, except the ones holding a single value, and the XML is kept until loadAllSections() is called. Until then the definition is read-only: modifying, serializing, converting or pickling it raises ReadOnlyDefinitionError. isFullyLoaded() tells whether a definition was loaded completely.
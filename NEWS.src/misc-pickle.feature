@@ -0,0 +1 @@
+ProductDefinition, PlatformDefinition, Platform and the generated XML binding objects can now be pickled. The pickled form stores field tuples instead of instance dictionaries, so unpickling needs no XML parsing, migration or postinit work.
@@ -0,0 +1 @@
+Products loaded with identical platform search paths, factory sources, architectures, flavor sets, container templates or build templates can now share one read-only copy of each, through the new rpath_proddef.interning module, by setting ProductDefinition.internPlatforms to True. Modifying a shared subtree through the API copies it first; modifying the shared objects directly raises interning.SharedNodeError. interning.platformInterner.report() and the rpath_proddef_interned_bytes_saved_total metric give the estimated memory saved.
@@ -0,0 +1 @@
+Added ProductDefinition.promoteMapMatrix(), which returns the promote maps for every pair of stages. The maps are computed once and cached until the stages, secondary labels or label components change; getPromoteMapsForStages() now reads from the same cache.
@@ -0,0 +1 @@
+Added RebasePipeline, which rebases many product definitions at once: each distinct upstream platform is fetched and snapshotted once, then applied to every product referencing it. Time spent in each stage is reported.
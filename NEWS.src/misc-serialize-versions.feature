@@ -0,0 +1 @@
+Added serializeVersions(), which writes a definition as several schema versions at once, walking the chain of back migrations only once. Trees migrated back to older versions are now cached until the definition changes, so serialize() and toDict() with an explicit version no longer migrate again every time. PlatformDefinition.saveToRepository() accepts extraVersions, to commit platform-definition-<version>.xml files for older schema versions alongside the current one.
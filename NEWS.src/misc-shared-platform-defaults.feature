@@ -0,0 +1 @@
+Definitions that get the default platform content (architectures, flavor sets, container templates and build templates) now share one prebuilt copy per schema version instead of building it again for every document. The add and clear methods replace the shared nodes rather than modifying them.
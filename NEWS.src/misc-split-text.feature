@@ -0,0 +1 @@
+Building text content split into many nodes (by comments or CDATA sections, for instance) now takes linear time: the dispatch table builders collect the text of an element as a list of chunks joined once, where the generated methods appended to the object member for every node. `scripts/benchmark.py text` times parsing a definition with several megabytes of such text.
@@ -0,0 +1 @@
+Label, flavor and trove name strings of search paths, builds, architectures, flavor sets, factory sources and promote maps are now interned as they are set, through a bounded table (rpath_proddef.interning.strings). Loading 2000 synthetic 4.7 documents with 15 search paths, 4 architectures and 20 builds each grows peak resident memory by 128 MB instead of 143 MB. scripts/benchmark.py intern measures this for a given definition.
@@ -0,0 +1 @@
+Added BaseDefinition.toDict() and fromDict(), which convert definitions to and from plain Python structures without going through XML, for any supported schema version. scripts/benchmark.py dict compares them to the XML round trip.
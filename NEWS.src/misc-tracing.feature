@@ -0,0 +1 @@
+Added tracing hooks: callbacks registered with rpath_proddef.api1.tracer receive timed spans for parsing, migration, postinit, validation, serialization and repository operations, with attributes such as schema version, document size, migration hops and repository round trips.
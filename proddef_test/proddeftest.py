@@ -985,6 +985,78 @@ class RepositoryBasedTest(rephelp.RepositoryHelper, BaseTest):
         conts = repos.getFileContents([(fileId, fileVer)])[0]
         self.failUnlessEqual(conts.get().read(), extraFileContents)
 
+    def testBulkSave(self):
+        self.openRepository()
+        client = conaryclient.ConaryClient(self.cfg)
+        repos = client.getRepos()
+        commits = []
+        origCommitChangeSet = repos.commitChangeSet
+        def commitChangeSet(cs):
+            commits.append(len(list(cs.iterNewTroveList())))
+            return origCommitChangeSet(cs)
+        repos.commitChangeSet = commitChangeSet
+
+        labelHost = self.defLabel.getHost()
+        prds = [ self.newProductDefinition(conaryRepositoryHostname=labelHost,
+                productShortname=name) for name in ('one', 'two') ]
+        pld = prds[0].toPlatformDefinition()
+        platLabel = str(self.defLabel)
+
+        bulk = proddef.BulkSave(client, message = "Bulk\n")
+        for prd in prds:
+            bulk.add(prd)
+        bulk.add(pld, label = platLabel)
+        self.failUnless(pld.isModified())
+        self.failUnlessEqual(len(bulk), 3)
+        self.failUnlessRaises(proddef.ProductDefinitionError, bulk.add, pld)
+        committed, skipped = bulk.commit()
+        self.failUnlessEqual(len(bulk), 0)
+        self.failUnlessEqual(sorted(committed), sorted([
+            ('product-definition', prds[0].getProductDefinitionLabel()),
+            ('product-definition', prds[1].getProductDefinitionLabel()),
+            ('platform-definition', platLabel),
+        ]))
+        self.failUnlessEqual(skipped, [])
+        self.failUnlessEqual(commits, [3])
+        self.failIf([ x for x in prds + [ pld ] if x.isModified() ])
+
+        for prd in prds:
+            nprd = proddef.ProductDefinition()
+            nprd.setConaryRepositoryHostname(labelHost)
+            nprd.setConaryNamespace(prd.getConaryNamespace())
+            nprd.setProductShortname(prd.getProductShortname())
+            nprd.setProductVersion(prd.getProductVersion())
+            nprd.loadFromRepository(client)
+            self.failUnlessEqual(nprd, prd)
+
+        # Nothing changed, nothing gets committed
+        del commits[:]
+        for prd in prds:
+            bulk.add(prd)
+        bulk.add(pld, label = platLabel)
+        committed, skipped = bulk.commit()
+        self.failUnlessEqual(committed, [])
+        self.failUnlessEqual(len(skipped), 3)
+        self.failUnlessEqual(commits, [])
+
+        # Only changed definitions are committed, each in its own changeset
+        # if they do not fit together
+        for prd in prds:
+            prd.setProductDescription('changed')
+            bulk.add(prd)
+        bulk.add(pld, label = platLabel)
+        bulk.maxChangeSetSize = 1
+        committed, skipped = bulk.commit()
+        self.failUnlessEqual([ x[0] for x in committed ],
+            [ 'product-definition', 'product-definition' ])
+        self.failUnlessEqual(skipped, [ ('platform-definition', platLabel) ])
+        self.failUnlessEqual(commits, [1, 1])
+        self.failIf([ x for x in prds if x.isModified() ])
+        trvTup = prds[0]._getTroveTupFromRepository(client,
+            prds[0].getProductDefinitionLabel())
+        self.failUnlessEqual(trvTup[1].trailingRevision().getVersion(),
+            proddef.ProductDefinition.version)
+
 class ProductDefinitionTest(BaseTest):
 
     def setUp(self):
@@ -2455,6 +2527,55 @@ CMD ["-X"]
             'extra@repo:zen-qa': 'extra@repo:zen', # promoteMap
             })
 
+    def testPromoteMapMatrix(self):
+        prd = proddef.ProductDefinition()
+        prd.setProductShortname("enormous")
+        prd.setProductVersion("1")
+        prd.setConaryRepositoryHostname("enormous.repo")
+        prd.setConaryNamespace("en")
+        prd.addStage(name='devel', labelSuffix='-devel')
+        prd.addStage(name='qa', labelSuffix='-qa', promoteMaps = [
+            ('zen', 'extra@repo:zen-qa'), ])
+        prd.addStage(name='release', labelSuffix='', promoteMaps=[
+            ('zen', 'extra@repo:zen'), ])
+        prd.addSecondaryLabel('xen', '-xen')
+
+        stages = [ 'devel', 'qa', 'release' ]
+        flatten = [ 'contrib.repo@co:ntrib' ]
+        matrix = prd.promoteMapMatrix(flattenLabels = flatten)
+        self.failUnlessEqual(sorted(matrix),
+            sorted((x, y) for x in stages for y in stages))
+        for (fromStage, toStage), fromTo in matrix.items():
+            self.failUnlessEqual(fromTo, prd.getPromoteMapsForStages(
+                fromStage, toStage, flattenLabels = flatten))
+        self.failUnlessEqual(prd.promoteMapMatrix()[('qa', 'release')], {
+            'enormous.repo@en:enormous-1-qa': '/enormous.repo@en:enormous-1',
+            'enormous.repo@en:enormous-1-xen-qa':
+                '/enormous.repo@en:enormous-1-xen',
+            'extra@repo:zen-qa': 'extra@repo:zen',
+            })
+
+        # Callers get their own copies
+        fromTo = prd.getPromoteMapsForStages('devel', 'qa')
+        fromTo['bogus@label:here'] = '/bogus@label:there'
+        self.failIf('bogus@label:here' in
+            prd.getPromoteMapsForStages('devel', 'qa'))
+
+        # Label components, secondary labels and stages invalidate it
+        prd.setProductVersion("2")
+        self.failUnless('enormous.repo@en:enormous-2-devel' in
+            prd.getPromoteMapsForStages('devel', 'qa'))
+        prd.clearSecondaryLabels()
+        self.failUnlessEqual(prd.getPromoteMapsForStages('devel', 'qa'), {
+            'enormous.repo@en:enormous-2-devel':
+                '/enormous.repo@en:enormous-2-qa' })
+        prd.addStage(name='hotfix', labelSuffix='-hotfix')
+        self.failUnlessEqual(prd.getPromoteMapsForStages('hotfix', 'release'),
+            { 'enormous.repo@en:enormous-2-hotfix':
+                '/enormous.repo@en:enormous-2' })
+        self.failUnlessRaises(proddef.StageNotFoundError,
+            prd.getPromoteMapsForStages, 'devel', 'nosuchstage')
+
     def testArchitectures(self):
         prd = proddef.ProductDefinition()
         arches = prd.getArchitectures()
@@ -3350,6 +3471,8 @@ CMD ["-X"]
                     '_useLatest',
                     '_validate',
                     '_preMigrateVersion',
+                    '_cache',
+                    '_projection',
                     ]))
         self.failIf(attrs, "the following attributes are not being tested, "
                 "please set them in this test before adding them to the "
@@ -3673,6 +3796,1362 @@ version="%(version)s">
         # will verify we correctly query for 1.2-3-4
         prd.rebase(client, label, platformVersion = '1.2-3-4')
 
+    def testRebasePipeline(self):
+        prds = [ self.newProductDefinition(productShortname = x)
+            for x in ('one', 'two', 'three') ]
+        calls = []
+        BaseMockRepos = self.MockClient.MockRepos
+
+        class MockClient(self.MockClient):
+            class MockRepos(BaseMockRepos):
+                PlatformDefinitionXML = """
+                    <platformDefinition>
+                      <baseFlavor>vanilla</baseFlavor>
+                      <searchPaths>
+                        <searchPath isResolveTrove="true" troveName="group-cny"
+                            isGroupSearchPathTrove="true"
+                            label="localhost@cny:3" />
+                      </searchPaths>
+                      <architectures>
+                        <architecture name="x86" displayName="x86"
+                            flavor="is: x86" />
+                      </architectures>
+                    </platformDefinition>
+                """
+                TroveMap = BaseMockRepos.TroveMap.copy()
+                TroveMap[('group-cny', 'localhost@cny:3', None)] = \
+                    ('group-cny', VFS('/localhost@cny:3/3.0-4-5'), None)
+
+                def findTroves(self, label, trvSpecs, allowMissing = False):
+                    calls.append(sorted(trvSpecs))
+                    return BaseMockRepos.findTroves(self, label, trvSpecs,
+                        allowMissing = allowMissing)
+
+        label = 'localhost@platform:1'
+        self.failUnlessRaises(proddef.ProductDefinitionError,
+            proddef.RebasePipeline, MockClient(), useLatest = True,
+            platformVersion = '1')
+        pipeline = proddef.RebasePipeline(MockClient())
+        self.failUnlessRaises(proddef.PlatformLabelMissingError,
+            pipeline.run, prds)
+        platforms = pipeline.run(prds, label = label)
+
+        # The platform was fetched and snapshotted only once
+        self.failUnlessEqual(calls, [
+            [ ('platform-definition:source', label, None) ],
+            [ ('group-cny', 'localhost@cny:3', None) ],
+        ])
+        self.failUnlessEqual(platforms.keys(), [ label ])
+        self.failUnlessEqual(sorted(pipeline.timings),
+            [ 'fetch', 'rebase', 'snapshot', 'total' ])
+
+        for prd in prds:
+            self.failUnlessEqual(prd.getPlatformBaseFlavor(), 'vanilla')
+            self.failUnlessEqual(
+                [ (x.troveName, x.label, x.version)
+                    for x in prd.getPlatformSearchPaths() ],
+                [ ('group-cny', 'localhost@cny:3', '3.0-4-5') ])
+        # Changing the platform of one product leaves the others alone
+        prds[0].addPlatformSearchPath(troveName = 'group-extra',
+            label = 'localhost@cny:3')
+        self.failUnlessEqual(
+            [ x.troveName for x in prds[1].getPlatformSearchPaths() ],
+            [ 'group-cny' ])
+
+    def testQueryExecutorGroupsByHost(self):
+        calls = []
+        class MockRepos(object):
+            def findTroves(self, label, trvSpecs, allowMissing = False):
+                calls.append(sorted(trvSpecs))
+                return dict((x, [ (x[0], VFS('/%s/1-1-1' % x[1]), '') ])
+                    for x in trvSpecs)
+
+        specs = [
+            ('group-a', 'a.example.com@rpl:2', None),
+            ('group-b', 'b.example.com@rpl:2', None),
+            ('group-c', 'a.example.com@rpl:2-devel', None),
+            ('group-d', '/b.example.com@rpl:2/1-1', None),
+        ]
+        executor = proddef.RepositoryQueryExecutor(workers = 2)
+        try:
+            self.failUnlessEqual(
+                [ x[0] for x in executor.groupByHost(specs) ],
+                [ 'a.example.com', 'b.example.com' ])
+            ret = executor.findTroves(MockRepos(), specs)
+        finally:
+            executor.close()
+        self.failUnlessEqual(sorted(ret), sorted(specs))
+        self.failUnlessEqual(sorted(calls), [
+            [ specs[0], specs[2] ],
+            [ specs[1], specs[3] ],
+        ])
+
+    def testQueryExecutorSnapshotVersions(self):
+        pld = self.newPlatformDefinition()
+        pld.addSearchPath(troveName = 'group-cny', label = 'localhost@cny:3')
+        pld.addSearchPath(troveName = 'group-plat',
+            label = 'otherhost@plat:1')
+        pld.addFactorySource(troveName = 'group-factories',
+            label = 'otherhost@plat:1')
+
+        class MockClient(self.MockClient):
+            class MockRepos(self.MockClient.MockRepos):
+                TroveMap = {
+                    ('group-cny', 'localhost@cny:3', None) :
+                        ('group-cny', VFS('/localhost@cny:3/3.0-4-5'), None),
+                    ('group-plat', 'otherhost@plat:1', None) :
+                        ('group-plat', VFS('/otherhost@plat:1/1.2-3-4'),
+                            None),
+                    ('group-factories', 'otherhost@plat:1', None) :
+                        ('group-factories',
+                            VFS('/otherhost@plat:1/1.0-1-1'), None),
+                }
+
+        executor = proddef.RepositoryQueryExecutor(workers = 2, timeout = 10)
+        try:
+            pld.snapshotVersions(MockClient(), queryExecutor = executor)
+        finally:
+            executor.close()
+        self.failUnlessEqual(
+            [ (x.troveName, x.label, x.version)
+                for x in pld.getSearchPaths() + pld.getFactorySources() ],
+            [
+                ('group-cny', 'localhost@cny:3', '3.0-4-5'),
+                ('group-plat', 'otherhost@plat:1', '1.2-3-4'),
+                ('group-factories', 'otherhost@plat:1', '1.0-1-1'),
+            ])
+
+    def testQueryExecutorTimeout(self):
+        import threading
+        event = threading.Event()
+        class MockRepos(object):
+            def findTroves(self, label, trvSpecs, allowMissing = False):
+                if trvSpecs[0][1].startswith('slow'):
+                    event.wait(5)
+                return {}
+
+        specs = [
+            ('group-a', 'fast.example.com@rpl:2', None),
+            ('group-b', 'slow.example.com@rpl:2', None),
+        ]
+        executor = proddef.RepositoryQueryExecutor(workers = 2,
+            timeout = 0.1)
+        try:
+            self.failUnlessRaises(proddef.RepositoryError,
+                executor.findTroves, MockRepos(), specs)
+        finally:
+            event.set()
+            executor.close()
+
+    def testQueryExecutorNested(self):
+        from rpath_proddef import fakerepos
+        repos = fakerepos.FakeRepository(
+            methodLatency = dict(findTroves = 0.01))
+        client = fakerepos.FakeConaryClient(repos)
+        repos.addTrove('group-cny', 'localhost@cny:3', '3.0-4-5')
+        # More platforms than workers: loading each of them queries the
+        # repository through the executor running the load
+        labels = [ 'localhost@plat:%d' % x for x in range(3) ]
+        prds = []
+        for label in labels:
+            pld = self.newPlatformDefinition()
+            pld.addSearchPath(troveName = 'group-cny',
+                label = 'localhost@cny:3')
+            pld.saveToRepository(client, label)
+            prd = self.newProductDefinition()
+            prd.setPlatformSourceTrove('platform-definition=%s' % label)
+            prds.append(prd)
+
+        executor = proddef.RepositoryQueryExecutor(workers = 2,
+            timeout = 30)
+        try:
+            pipeline = proddef.RebasePipeline(client,
+                queryExecutor = executor)
+            platforms = pipeline.run(prds)
+        finally:
+            executor.close()
+        self.failUnlessEqual(sorted(platforms), labels)
+        for prd in prds:
+            self.failUnlessEqual(
+                [ (x.troveName, x.version)
+                    for x in prd.getPlatformSearchPaths() ],
+                [ ('group-cny', '3.0-4-5') ])
+
+    def testFakeRepository(self):
+        from rpath_proddef import fakerepos
+        repos = fakerepos.FakeRepository(
+            methodLatency = dict(findTroves = 0.01))
+        client = fakerepos.FakeConaryClient(repos)
+        repos.addTrove('group-cny', 'localhost@cny:3', '3.0-4-5')
+        repos.addTrove('group-cny', 'localhost@cny:3', '3.0-4-6')
+
+        prd = self.newProductDefinition()
+        prd.saveToRepository(client, message = "Initial\n")
+        self.failUnlessEqual(repos.getCallCount('commitChangeSet'), 1)
+        # Saving the same definition again commits nothing
+        prd.saveToRepository(client)
+        self.failUnlessEqual(repos.getCallCount('commitChangeSet'), 1)
+        prd.setProductDescription('changed')
+        prd.saveToRepository(client)
+        self.failUnlessEqual(repos.getCallCount('commitChangeSet'), 2)
+        trvTup = prd._getTroveTupFromRepository(client,
+            prd.getProductDefinitionLabel())
+        self.failUnlessEqual(trvTup[1].trailingRevision().asString(),
+            '%s-2' % proddef.ProductDefinition.version)
+
+        repos.resetCounters()
+        nprd = proddef.ProductDefinition()
+        nprd.setConaryRepositoryHostname(prd.getConaryRepositoryHostname())
+        nprd.setConaryNamespace(prd.getConaryNamespace())
+        nprd.setProductShortname(prd.getProductShortname())
+        nprd.setProductVersion(prd.getProductVersion())
+        nprd.loadFromRepository(client)
+        self.failUnlessEqual(nprd, prd)
+        self.failUnlessEqual(dict(repos.calls), {
+            'findTroves' : 1, 'getFileContentsFromTrove' : 1 })
+        self.failUnless(repos.bytesDownloaded > 0)
+
+        pld = self.newPlatformDefinition()
+        pld.addSearchPath(troveName = 'group-cny', label = 'localhost@cny:3')
+        pld.snapshotVersions(client)
+        self.failUnlessEqual(pld.getSearchPaths()[0].version, '3.0-4-6')
+
+    def testPickle(self):
+        import cPickle
+        import re
+        prd = proddef.ProductDefinition(fromStream = refSerialize1)
+        prd.addPlatformSearchPath(troveName = 'group-os',
+            label = 'conary.rpath.com@rpl:2', version = '2.0-1-1')
+        pld = prd.toPlatformDefinition()
+        pld.version = '4.0'
+        for protocol in range(cPickle.HIGHEST_PROTOCOL + 1):
+            data = cPickle.dumps(prd, protocol)
+            # Only the module for the current schema version is referenced
+            self.failUnlessEqual(set(re.findall('xml_[0-9_]+', data)),
+                set([ 'xml_' + prd.version.replace('.', '_') ]))
+            nprd = cPickle.loads(data)
+            self.failUnlessEqual(nprd, prd)
+            self.failUnlessEqual(nprd.preMigrateVersion,
+                prd.preMigrateVersion)
+            # The platform wrapper is rebuilt around the unpickled root
+            self.failUnless(nprd.platform._rootObj is
+                nprd._rootObj.get_platform())
+            # Attributes set by _postinit on builds are kept
+            self.failUnlessEqual(
+                [ x.buildFlavor for x in nprd.getBuildDefinitions() ],
+                [ x.buildFlavor for x in prd.getBuildDefinitions() ])
+            self.failUnlessEqual(nprd.getBuildDefinitions()[0].__dict__,
+                prd.getBuildDefinitions()[0].__dict__)
+            sio1 = StringIO.StringIO()
+            prd.serialize(sio1)
+            sio2 = StringIO.StringIO()
+            nprd.serialize(sio2)
+            self.failUnlessEqual(sio2.getvalue(), sio1.getvalue())
+
+            npld = cPickle.loads(cPickle.dumps(pld, protocol))
+            self.failUnlessEqual(npld.version, '4.0')
+            self.failIf('version' in prd.__dict__)
+            self.failUnlessEqual(npld._rootObj, pld._rootObj)
+
+        # Field tuples are smaller than instance dictionaries
+        build = prd.getBuildDefinitions()[0]
+        state = build.__getstate__()
+        self.failUnless(isinstance(state, tuple))
+        self.failUnless(len(cPickle.dumps(state, 2)) <
+            len(cPickle.dumps(build.__dict__, 2)))
+
+    def testToDict(self):
+        import json
+        prd = proddef.ProductDefinition(fromStream = refSerialize1)
+        data = prd.toDict()
+        self.failUnlessEqual(data['version'], prd.version)
+        self.failUnlessEqual(data['productShortname'],
+            prd.getProductShortname())
+        self.failUnlessEqual([ x['name'] for x in data['stages']['stage'] ],
+            [ x.name for x in prd.getStages() ])
+        self.failIf('buildFlavor' in data['buildDefinition']['build_'][0])
+
+        nprd = proddef.ProductDefinition.fromDict(
+            json.loads(json.dumps(data)))
+        self.failUnlessEqual(nprd, prd)
+        self.failUnlessEqual(
+            [ x.buildFlavor for x in nprd.getBuildDefinitions() ],
+            [ x.buildFlavor for x in prd.getBuildDefinitions() ])
+        sio1 = StringIO.StringIO()
+        prd.serialize(sio1)
+        sio2 = StringIO.StringIO()
+        nprd.serialize(sio2)
+        self.assertXMLEquals(sio2.getvalue(), sio1.getvalue())
+
+        # Older schema versions are migrated both ways
+        oldData = prd.toDict(version = '4.0')
+        self.failUnlessEqual(oldData['version'], '4.0')
+        nprd = proddef.ProductDefinition.fromDict(oldData)
+        self.failUnlessEqual(nprd.preMigrateVersion, '4.0')
+        self.failUnlessEqual(nprd.getProductShortname(),
+            prd.getProductShortname())
+
+        pld = prd.toPlatformDefinition()
+        npld = proddef.PlatformDefinition.fromDict(pld.toDict())
+        self.failUnlessEqual(npld._rootObj, pld._rootObj)
+
+        data['bogus'] = 1
+        self.failUnlessRaises(proddef.ProductDefinitionError,
+            proddef.ProductDefinition.fromDict, data)
+
+    def testBuildMatrix(self):
+        prd = proddef.ProductDefinition(fromStream = refSerialize1)
+        matrix = prd.buildMatrix()
+        expected = []
+        for stage in prd.getStages():
+            for build in prd.getBuildsForStage(stage.name):
+                image = build.getBuildImage()
+                fields = build.containerTemplateFields.copy()
+                if build.image is not None:
+                    fields.update(build.image.getFields())
+                expected.append((stage.name,
+                    prd.getLabelForStage(stage.name), build.getBuildName(),
+                    build.architectureRef, image.containerFormat,
+                    build.getBuildBaseFlavor(), tuple(sorted(fields.items())),
+                    build.getBuildImageGroup(), build.getBuildSourceGroup(),
+                    None))
+        self.failUnless(expected)
+        self.failUnlessEqual(list(matrix), expected)
+        self.failUnless(isinstance(matrix, tuple))
+        self.failUnlessEqual(matrix[0].stage, expected[0][0])
+        self.failUnlessEqual(matrix[0].buildName, expected[0][2])
+
+        # Cached until the definition changes
+        self.failUnless(prd.buildMatrix() is matrix)
+        prd.setProductVersion('9.9')
+        nmatrix = prd.buildMatrix()
+        self.failIf(nmatrix is matrix)
+        self.failUnlessEqual(nmatrix[0].label,
+            prd.getLabelForStage(nmatrix[0].stage))
+        prd.clearBuildDefinition()
+        self.failUnlessEqual(prd.buildMatrix(), ())
+        # Not part of the pickled state
+        import cPickle
+        nprd = cPickle.loads(cPickle.dumps(prd, 2))
+        self.failUnlessEqual(nprd._cache, {})
+
+    def testSharedPlatformDefaults(self):
+        prd = self.newProductDefinition()
+        prd.addPlatformSearchPath(troveName = 'group-os',
+            label = 'conary.rpath.com@rpl:2')
+        sio = StringIO.StringIO()
+        prd.serialize(sio)
+        xmlData = sio.getvalue()
+
+        prd1 = proddef.ProductDefinition(fromStream = xmlData)
+        prd2 = proddef.ProductDefinition(fromStream = xmlData)
+        plat1 = prd1.platform._rootObj
+        plat2 = prd2.platform._rootObj
+        # The defaults are attached, not rebuilt
+        self.failUnless(plat1.get_architectures() is not None)
+        for field in [ 'architectures', 'flavorSets', 'containerTemplates',
+                'buildTemplates' ]:
+            self.failUnless(getattr(plat1, field) is getattr(plat2, field))
+        self.failUnlessEqual(prd1.getPlatformBaseFlavor(),
+            prd2.getPlatformBaseFlavor())
+        self.failUnlessEqual(
+            [ x.name for x in prd1.platform.getArchitectures() ],
+            [ 'x86', 'x86_64' ])
+
+        # Same content as building the defaults in place
+        nplat = proddef.Platform()
+        proddef._addPlatformDefaults(nplat)
+        self.failUnlessEqual(plat1.get_buildTemplates(),
+            nplat._rootObj.get_buildTemplates())
+        self.failUnlessEqual(plat1.get_containerTemplates(),
+            nplat._rootObj.get_containerTemplates())
+
+        # Modifying one definition leaves the other one alone
+        prd1.platform.addArchitecture('ppc', 'PowerPC', 'is: ppc')
+        prd1.platform.clearFlavorSets()
+        self.failUnlessEqual(
+            [ x.name for x in prd2.platform.getArchitectures() ],
+            [ 'x86', 'x86_64' ])
+        self.failUnlessEqual(len(prd2.platform.getFlavorSets()), 6)
+        sio1 = StringIO.StringIO()
+        prd2.serialize(sio1)
+        sio2 = StringIO.StringIO()
+        proddef.ProductDefinition(fromStream = xmlData).serialize(sio2)
+        self.failUnlessEqual(sio1.getvalue(), sio2.getvalue())
+
+    def testPlatformInterning(self):
+        from rpath_proddef import interning
+        prd = self.newProductDefinition()
+        prd.addPlatformSearchPath(troveName = 'group-os',
+            label = 'conary.rpath.com@rpl:2', version = '2.0-1-1')
+        sio = StringIO.StringIO()
+        prd.serialize(sio)
+        xmlData = sio.getvalue()
+
+        self.mock(proddef.ProductDefinition, 'internPlatforms', True)
+        interner = interning.platformInterner
+        interner.clear()
+        prd1 = proddef.ProductDefinition(fromStream = xmlData)
+        prd2 = proddef.ProductDefinition(fromStream = xmlData)
+        sp1 = prd1.platform._rootObj.get_searchPaths()
+        self.failUnless(prd2.platform._rootObj.get_searchPaths() is sp1)
+        self.failUnless(interning.isShared(sp1))
+        report = interner.report()
+        self.failUnlessEqual(report['hits'], 1)
+        self.failUnless(report['bytesSaved'] > 0)
+
+        # The shared objects refuse direct writes, down to the list items
+        item = sp1.get_searchPath()[0]
+        self.failUnless(interning.isShared(item))
+        self.failUnlessRaises(interning.SharedNodeError,
+            setattr, item, 'version', '2.0-2-1')
+        self.failUnlessRaises(interning.SharedNodeError,
+            sp1.get_searchPath().append, item.__copy__())
+        self.failUnlessEqual(item.version, '2.0-1-1')
+        self.failUnlessEqual(len(sp1.get_searchPath()), 1)
+        self.failIf(prd2.isModified())
+        # Initializing a definition again leaves the shared objects alone
+        prd1._postinit()
+        self.failIf(prd2.isModified())
+        self.failUnless(prd1.platform._rootObj.get_searchPaths() is sp1)
+
+        # Writes get a private copy
+        prd1.addPlatformSearchPath(troveName = 'group-extra',
+            label = 'conary.rpath.com@rpl:2')
+        self.failIf(prd1.platform._rootObj.get_searchPaths() is sp1)
+        self.failIf(interning.isShared(
+            prd1.platform._rootObj.get_searchPaths().get_searchPath()[0]))
+        self.failUnlessEqual(
+            [ x.troveName for x in prd1.getPlatformSearchPaths() ],
+            [ 'group-os', 'group-extra' ])
+        self.failUnlessEqual(
+            [ x.troveName for x in prd2.getPlatformSearchPaths() ],
+            [ 'group-os' ])
+        self.failUnlessEqual(prd2.platform._rootObj.get_searchPaths(),
+            proddef.ProductDefinition(fromStream = xmlData
+                ).platform._rootObj.get_searchPaths())
+
+        # Entries go away with the definitions using them
+        del prd2, sp1
+        prd3 = proddef.ProductDefinition(fromStream = xmlData)
+        del prd3
+        import gc
+        gc.collect()
+        self.failUnlessEqual(interner.report()['entries'], 0)
+
+        self.mock(proddef.ProductDefinition, 'internPlatforms', False)
+        prd4 = proddef.ProductDefinition(fromStream = xmlData)
+        self.failIf(interning.isShared(
+            prd4.platform._rootObj.get_searchPaths()))
+
+    def testPlatformSearchPathInPlace(self):
+        # Platforms are not interned by default; their objects can be
+        # changed directly
+        prd = self.newProductDefinition()
+        prd.addPlatformSearchPath(troveName = 'group-os',
+            label = 'conary.rpath.com@rpl:2', version = '2.0-1-1')
+        sio = StringIO.StringIO()
+        prd.serialize(sio)
+        prd1 = proddef.ProductDefinition(fromStream = sio.getvalue())
+        prd2 = proddef.ProductDefinition(fromStream = sio.getvalue())
+        prd1.getPlatformSearchPaths()[0].version = '2.0-2-1'
+        searchPaths = prd1.platform._rootObj.get_searchPaths()
+        searchPaths.get_searchPath().append(
+            searchPaths.get_searchPath()[0].__copy__())
+        self.failUnless(prd1.isModified())
+        self.failUnlessEqual(
+            [ x.version for x in prd1.getPlatformSearchPaths() ],
+            [ '2.0-2-1', '2.0-2-1' ])
+        self.failIf(prd2.isModified())
+        self.failUnlessEqual(
+            [ x.version for x in prd2.getPlatformSearchPaths() ],
+            [ '2.0-1-1' ])
+
+    def testStringInterning(self):
+        from rpath_proddef import interning
+        prd1 = proddef.ProductDefinition(fromStream = refSerialize1)
+        prd2 = proddef.ProductDefinition(fromStream = refSerialize1)
+        sp1 = prd1.getSearchPaths()[0]
+        sp2 = prd2.getSearchPaths()[0]
+        self.failUnless(sp1.label is sp2.label)
+        self.failUnless(sp1.troveName is sp2.troveName)
+        self.failUnless(prd1.getArchitectures()[0].flavor is
+            prd2.getArchitectures()[0].flavor)
+        # Other attributes are left alone
+        self.failIf(sp1.version is sp2.version)
+
+        # The type of the value is kept
+        sp = prd1.addSearchPath(troveName = 'group-foo',
+            label = 'localhost@s:1')
+        self.failUnlessEqual(type(sp.label), str)
+        self.failUnlessEqual(type(sp1.label), unicode)
+
+        # The table is bounded
+        table = interning.StringInterner(maxSize = 2)
+        a = table.intern(u'a')
+        self.failUnless(table.intern(u''.join([ 'a' ])) is a)
+        table.intern(u'b')
+        table.intern(u'c')
+        self.failUnlessEqual(table.report()['entries'], 1)
+        self.failUnlessEqual(table.intern(None), None)
+        table = interning.StringInterner(maxSize = 0)
+        b = u''.join([ 'b' ])
+        table.intern(u'b')
+        self.failUnless(table.intern(b) is b)
+
+    def testChangeTracking(self):
+        prd = proddef.ProductDefinition(fromStream = refSerialize1)
+        self.failIf(prd.isModified())
+        sio = StringIO.StringIO()
+        prd.serialize(sio)
+        self.assertXMLEquals(sio.getvalue(), refSerialize1)
+        rootObj = prd._rootObj
+        self.failUnless(rootObj.isExportCached_())
+        self.failUnless(rootObj.stages.isExportCached_())
+
+        # Changing a generated object directly is noticed
+        sp = prd.getSearchPaths()[0]
+        sp.version = '9.9-9-9'
+        self.failUnless(prd.isModified())
+        self.failIf(rootObj.isExportCached_())
+        self.failIf(rootObj.searchPaths.isExportCached_())
+        # Unrelated subtrees keep their cached output
+        self.failUnless(rootObj.stages.isExportCached_())
+        sio = StringIO.StringIO()
+        prd.serialize(sio)
+        self.failUnless('version="9.9-9-9"' in sio.getvalue())
+
+        # So are changes to the lists
+        prd2 = proddef.ProductDefinition(fromStream = refSerialize1)
+        prd2.getBuildDefinitions()
+        prd2._rootObj.buildDefinition.get_build().pop()
+        self.failUnless(prd2.isModified())
+        self.failUnlessEqual(len(prd2.getBuildDefinitions()),
+            len(prd.getBuildDefinitions()) - 1)
+        prd3 = proddef.ProductDefinition(fromStream = refSerialize1)
+        prd3.setProductVersion('2.0')
+        self.failUnless(prd3.isModified())
+
+        # Copies start unmodified
+        import cPickle
+        prd4 = cPickle.loads(cPickle.dumps(prd, 2))
+        self.failIf(prd4.isModified())
+        sio4 = StringIO.StringIO()
+        prd4.serialize(sio4)
+        self.failUnlessEqual(sio4.getvalue(), sio.getvalue())
+        prd5 = copy.deepcopy(prd)
+        self.failIf(prd5.isModified())
+        prd5.getSearchPaths()[0].version = '8.8-8-8'
+        sio5 = StringIO.StringIO()
+        prd.serialize(sio5)
+        self.failUnlessEqual(sio5.getvalue(), sio.getvalue())
+
+        # New objects are only tracked once something observes them
+        sp = prd.xmlFactory().searchPathTypeSub.factory(
+            troveName = 'group-foo', label = 'foo.example.com@rpl:1')
+        self.failIf(sp._observed_)
+        sp.export(StringIO.StringIO(), 0)
+        self.failUnless(sp.isExportCached_())
+        sp.version = '1.0-1-1'
+        self.failIf(sp.isExportCached_())
+        prd6 = proddef.ProductDefinition(fromStream = refSerialize1)
+        prd6._rootObj.searchPaths.searchPath.append(sp)
+        self.failUnless(prd6.isModified())
+        prd6._markUnmodified()
+        sp.version = '2.0-1-1'
+        self.failUnless(prd6.isModified())
+        self.failUnlessEqual(prd6.getSearchPaths()[-1].version, '2.0-1-1')
+
+    def testSerializeVersions(self):
+        from rpath_proddef import fakerepos, metrics
+        prd = proddef.ProductDefinition(fromStream = refSerialize1)
+        versions = [ prd.version, '4.5', '4.3' ]
+        expected = {}
+        for version in versions:
+            sio = StringIO.StringIO()
+            proddef.ProductDefinition(fromStream = refSerialize1).serialize(
+                sio, version = version)
+            expected[version] = sio.getvalue()
+
+        metrics.registry.reset()
+        streams = dict((x, StringIO.StringIO()) for x in versions)
+        prd.serializeVersions(streams)
+        for version in versions:
+            self.failUnlessEqual(streams[version].getvalue(),
+                expected[version])
+        # The chain was walked once, down to the oldest version
+        hops = len(proddef.MigrationManager('4.3').path) - 1
+        self.failUnlessEqual(metrics.migrationHops.get(direction = 'back'),
+            hops)
+
+        # The migrated trees are kept until the definition changes
+        sio = StringIO.StringIO()
+        prd.serialize(sio, version = '4.5')
+        self.failUnlessEqual(sio.getvalue(), expected['4.5'])
+        prd.toDict(version = '4.3')
+        self.failUnlessEqual(metrics.migrationHops.get(direction = 'back'),
+            hops)
+        prd.setProductDescription('changed')
+        sio = StringIO.StringIO()
+        prd.serialize(sio, version = '4.5')
+        self.failUnless('changed' in sio.getvalue())
+        self.failUnlessEqual(metrics.migrationHops.get(direction = 'back'),
+            hops + len(proddef.MigrationManager('4.5').path) - 1)
+        # Older versions continue from the newest tree already migrated
+        prd.serialize(StringIO.StringIO(), version = '4.3')
+        self.failUnlessEqual(metrics.migrationHops.get(direction = 'back'),
+            2 * hops)
+
+        self.failUnlessRaises(RuntimeError, prd.serializeVersions,
+            { '0.1' : StringIO.StringIO() })
+
+        # Several schema versions of a platform in one commit
+        repos = fakerepos.FakeRepository()
+        client = fakerepos.FakeConaryClient(repos)
+        label = 'localhost@rpl:plat'
+        pld = prd.toPlatformDefinition()
+        pld.saveToRepository(client, label, extraVersions = [ '4.5', '4.3' ])
+        self.failUnlessEqual(repos.getCallCount('commitChangeSet'), 1)
+        for version in [ '4.5', '4.3' ]:
+            npld = proddef.PlatformDefinition()
+            npld.loadFromRepository(client, label, schemaVersion = version)
+            self.failUnlessEqual(npld.preMigrateVersion, version)
+            sio1 = StringIO.StringIO()
+            pld.serialize(sio1, version = version)
+            sio2 = StringIO.StringIO()
+            npld.serialize(sio2, version = version)
+            self.failUnlessEqual(sio2.getvalue(), sio1.getvalue())
+
+    def testCanSerializeAs(self):
+        prd = proddef.ProductDefinition(fromStream = refSerialize1)
+        pld = proddef.PlatformDefinition(fromStream = refPlatSerialize1)
+        # Answered without migrating anything
+        def copyFrom(*args, **kwargs):
+            raise AssertionError("tree copied")
+        self.mock(proddef.BaseMigration, 'copyFrom', copyFrom)
+        self.failUnlessEqual(prd.canSerializeAs(prd.version),
+            (prd.version, True, []))
+        self.failUnlessEqual(prd.canSerializeAs('4.0'), ('4.0', True, []))
+        # Migrating back from 2.0 to 1.3 is not possible
+        self.failUnlessEqual(prd.canSerializeAs('1.3'), ('1.3', False, []))
+        self.failUnlessEqual(prd.canSerializeAs('9.9'), ('9.9', False, []))
+
+        ret = pld.canSerializeAs('3.0')
+        self.failUnless(ret.supported)
+        self.failUnless('platformInformation' in ret.droppedFields)
+        self.failUnless('searchPaths.searchPath[1].isPlatformTrove'
+            in ret.droppedFields)
+        self.failIf('searchPaths.searchPath[1].troveName'
+            in ret.droppedFields)
+        table = proddef.MigrationManager.getBackMigrationTable('3.0')
+        self.failUnless(proddef.MigrationManager.getBackMigrationTable('3.0')
+            is table)
+        self.failUnless('partitionSchemeTypeSub' in table.droppedClasses)
+        self.failUnlessEqual(
+            proddef.MigrationManager.getBackMigrationTable('1.3').blockedBy,
+            'Migrate_13_20')
+
+        # The fields reported are the ones the migration drops
+        self.unmock()
+        data = pld.toDict(version = '3.0')
+        self.failIf('platformInformation' in data)
+        self.failIf('isPlatformTrove' in
+            data['searchPaths']['searchPath'][1])
+
+    def testMemberTables(self):
+        from rpath_proddef import gends_member_tables
+        # The tables of the generated classes are up to date with the
+        # schemas
+        for version in proddef.MigrationManager('1.0').path:
+            module = proddef.BaseDefinition.loadModule(version)
+            sio = StringIO.StringIO()
+            gends_member_tables.write(proddef.BaseDefinition.getSchemaFile(
+                self.schemaDir, version), sio)
+            tables = {}
+            exec sio.getvalue() in tables
+            for name, cls in sorted(vars(module.supermod).items()):
+                if not hasattr(cls, 'member_data_items_'):
+                    continue
+                self.failUnlessEqual(cls.getMemberTable_(),
+                    tables['classes'][name],
+                    "%s: %s differs" % (version, name))
+        table = module.supermod.platformClassifierType.getMemberTable_()
+        self.failUnlessEqual(table, ((('name', True), ('version', True),
+            ('tags', False)), ()))
+        table = module.supermod.productDefinition.getMemberTable_()
+        self.failUnless(('baseFlavor', 'restricted') in table[1])
+        self.failUnless(('stages', 'complex') in table[1])
+        # Subclasses have no table of their own
+        self.failUnlessEqual(module.productDefinitionSub.getMemberTable_(),
+            None)
+
+    def testCompiledExport(self):
+        from rpath_proddef import exporter
+        # Every generated class of every schema version gets a writer
+        for version in proddef.MigrationManager('1.0').path:
+            module = proddef.BaseDefinition.loadModule(version)
+            for name, cls in sorted(vars(module).items()):
+                if hasattr(cls, 'member_data_items_'):
+                    self.failIf(exporter.getWriter(cls) is None,
+                        "%s: %s not compiled" % (version, name))
+
+        def serialize(cls, xml, version = None, edit = None):
+            obj = cls(fromStream = xml)
+            if edit:
+                edit(obj)
+            sio = StringIO.StringIO()
+            obj.serialize(sio, version = version)
+            return sio.getvalue()
+
+        def editProduct(prd):
+            # Values that need escaping and quoting
+            prd.setProductDescription('Tom & Jerry <"cartoons">')
+            sp = prd.getSearchPaths()[0]
+            sp.troveName = 'group-"a"'
+            sp.version = "1'2\"3"
+            prd.getBuildDefinitions()[0].name = u'Caf\xe9 & <Bar>'
+
+        # The output is the same as that of the generated methods
+        for cls, xml, edit in [
+                (proddef.ProductDefinition, refSerialize1, None),
+                (proddef.ProductDefinition, refSerialize1, editProduct),
+                (proddef.PlatformDefinition, refPlatSerialize1, None) ]:
+            for version in [ None, '4.3', '3.0', '2.0' ]:
+                self.mock(exporter, 'enabled', False)
+                expected = serialize(cls, xml, version, edit)
+                self.unmock()
+                self.failUnlessEqual(serialize(cls, xml, version, edit),
+                    expected)
+
+        # The output of each object is cached; changed objects are exported
+        # again
+        prd = proddef.ProductDefinition(fromStream = refSerialize1)
+        prd.serialize(StringIO.StringIO())
+        self.failUnless(prd._rootObj.searchPaths.isExportCached_())
+        # Only the root object and the objects under it keep their output
+        self.failIf(prd._rootObj.searchPaths.searchPath[0].isExportCached_())
+        editProduct(prd)
+        sio = StringIO.StringIO()
+        prd.serialize(sio)
+        self.failUnlessEqual(sio.getvalue(),
+            serialize(proddef.ProductDefinition, refSerialize1, None,
+                editProduct))
+
+        # Classes with custom formatting keep their generated method, also
+        # when exported from a compiled parent
+        module = proddef.BaseDefinition.loadModule(prd.version)
+        class UpperStage(module.stageTypeSub):
+            def format_string(self, input_data, input_name = ''):
+                return input_data.upper()
+        self.failUnlessEqual(exporter.getWriter(UpperStage), None)
+        stages = module.stageListTypeSub(stage = [
+            UpperStage(name = 'devel', labelSuffix = '-devel'),
+            module.stageTypeSub(name = 'qa', labelSuffix = '-qa') ])
+        sio = StringIO.StringIO()
+        stages.export(sio, 0, name_ = 'stages')
+        self.failUnlessEqual(sio.getvalue(),
+            '<rpd:stages>\n'
+            '    <rpd:stage labelSuffix="-DEVEL" name="DEVEL"/>\n'
+            '    <rpd:stage labelSuffix="-qa" name="qa"/>\n'
+            '</rpd:stages>\n')
+
+    def testBuildDispatch(self):
+        from rpath_proddef import builder
+        # Every generated class of every schema version gets a builder
+        for version in proddef.MigrationManager('1.0').path:
+            module = proddef.BaseDefinition.loadModule(version)
+            for name, cls in sorted(vars(module).items()):
+                if hasattr(cls, 'member_data_items_'):
+                    self.failIf(builder.getBuilder(cls) is None,
+                        "%s: %s not compiled" % (version, name))
+
+        def load(cls, xml):
+            obj = cls(fromStream = xml)
+            sio = StringIO.StringIO()
+            obj.serialize(sio)
+            return obj, sio.getvalue()
+
+        # Another namespace prefix, and elements the schema does not have
+        prefixed = refSerialize1.replace('<productDefinition',
+            '<p:productDefinition').replace('</productDefinition',
+            '</p:productDefinition').replace('<searchPaths>',
+            '<p:searchPaths><unknown>text</unknown>').replace(
+            '</searchPaths>', '</p:searchPaths>').replace(
+            'xmlns="http://www.rpath.com/permanent/rpd-%s.xsd"' %
+                proddef.ProductDefinition.version,
+            'xmlns="http://www.rpath.com/permanent/rpd-%s.xsd" '
+            'xmlns:p="http://www.rpath.com/permanent/rpd-%s.xsd"' % (
+                (proddef.ProductDefinition.version, ) * 2))
+        self.failUnless('<p:searchPaths><unknown>' in prefixed)
+        # The objects built are the same as with the generated methods
+        for cls, xml in [
+                (proddef.ProductDefinition, refSerialize1),
+                (proddef.ProductDefinition, refSerialize2),
+                (proddef.ProductDefinition, prefixed),
+                (proddef.PlatformDefinition, refPlatSerialize1) ]:
+            self.mock(builder, 'enabled', False)
+            expected, expectedXml = load(cls, xml)
+            self.unmock()
+            obj, objXml = load(cls, xml)
+            self.failUnlessEqual(obj._rootObj, expected._rootObj)
+            self.failUnlessEqual(objXml, expectedXml)
+        self.failUnlessEqual(
+            proddef.ProductDefinition(fromStream = prefixed)._rootObj,
+            proddef.ProductDefinition(fromStream = refSerialize1)._rootObj)
+
+        # Classes with custom build methods keep their generated method
+        module = proddef.BaseDefinition.loadModule(obj.version)
+        class IgnoreSearchPaths(module.searchPathListTypeSub):
+            def buildChildren(self, child_, nodeName_):
+                pass
+        self.failUnlessEqual(builder.getBuilder(IgnoreSearchPaths), None)
+        self.mock(module.supermod.searchPathListType, 'subclass',
+            IgnoreSearchPaths)
+        prd = proddef.ProductDefinition(fromStream = refSerialize1)
+        self.failUnlessEqual(prd.getSearchPaths(), [])
+
+    def testBuildSplitText(self):
+        from rpath_proddef import builder
+        # Comments and CDATA sections split the text into several nodes
+        prd = proddef.ProductDefinition(fromStream = refSerialize1)
+        prd.setProductDescription('@DESCRIPTION@')
+        prd.addSecondaryLabel('split', '@LABEL@')
+        sio = StringIO.StringIO()
+        prd.serialize(sio)
+        xml = sio.getvalue().replace('@DESCRIPTION@',
+            'one<!-- --> two<!--x--><![CDATA[ <three>]]>').replace(
+            '@LABEL@', 'a<!-- -->b<![CDATA[<c>]]>d' * 100)
+
+        self.mock(builder, 'enabled', False)
+        expected = proddef.ProductDefinition(fromStream = xml)
+        self.unmock()
+        prd = proddef.ProductDefinition(fromStream = xml)
+        self.failUnlessEqual(prd._rootObj, expected._rootObj)
+        # Comments are part of the text of simple elements, as with the
+        # generated methods
+        self.failUnlessEqual(prd.getProductDescription(),
+            'one  twox <three>')
+        label = prd.getSecondaryLabels()[-1]
+        self.failUnlessEqual((label.name, label.getLabel()),
+            ('split', 'ab![CDATA[<c>]]d' * 100))
+
+    def testCanonicalDigest(self):
+        from rpath_proddef import fakerepos
+        arches = [ ('x86', 'x86 arch', 'is: x86'),
+            ('x86_64', 'x86_64 arch', 'is: x86 x86_64') ]
+        flavorSets = [ ('xen', 'Xen', '~xen,domU'),
+            ('vmware', 'VMware', '~vmware') ]
+        prd = proddef.ProductDefinition(fromStream = refSerialize1)
+        nprd = proddef.ProductDefinition(fromStream = refSerialize1)
+        for arch in arches:
+            prd.addArchitecture(*arch)
+        for flavorSet in flavorSets:
+            prd.addFlavorSet(*flavorSet)
+        # Same architectures and flavor sets, in a different order
+        for arch in reversed(arches):
+            nprd.addArchitecture(*arch)
+        for flavorSet in reversed(flavorSets):
+            nprd.addFlavorSet(*flavorSet)
+        serialized = []
+        canonical = []
+        for obj in [ prd, nprd ]:
+            sio = StringIO.StringIO()
+            obj.serialize(sio)
+            serialized.append(sio.getvalue())
+            sio = StringIO.StringIO()
+            obj.serialize(sio, canonical = True)
+            canonical.append(sio.getvalue())
+        self.failIf(serialized[0] == serialized[1])
+        self.failUnlessEqual(canonical[0], canonical[1])
+        self.failUnless('</productName><productShortname>' in canonical[0])
+        self.failIf(canonical[0].startswith('<?xml'))
+        self.failUnlessEqual(nprd.digest(), prd.digest())
+        self.failUnlessEqual(len(prd.digest()), 32)
+        self.failUnlessEqual(nprd.digest('4.0'), prd.digest('4.0'))
+        self.failIf(prd.digest('4.0') == prd.digest())
+
+        # The digest is kept until the definition changes
+        digest = prd.digest()
+        created = []
+        digesterClass = proddef.DigesterMd5FLO
+        class Digester(digesterClass):
+            def __init__(self):
+                created.append(self)
+                digesterClass.__init__(self)
+        self.mock(proddef, 'DigesterMd5FLO', Digester)
+        self.failUnlessEqual(prd.digest(), digest)
+        self.failUnlessEqual(created, [])
+        prd.setProductDescription('changed')
+        self.failIf(prd.digest() == digest)
+        self.failUnlessEqual(len(created), 1)
+        self.unmock()
+
+        # Saving a definition with the same canonical form commits nothing
+        repos = fakerepos.FakeRepository()
+        client = fakerepos.FakeConaryClient(repos)
+        prd = proddef.ProductDefinition(fromStream = serialized[0])
+        prd.saveToRepository(client, message = "Initial\n")
+        self.failUnlessEqual(repos.getCallCount('commitChangeSet'), 1)
+        nprd.saveToRepository(client)
+        self.failUnlessEqual(repos.getCallCount('commitChangeSet'), 1)
+        nprd.setProductDescription('changed')
+        nprd.saveToRepository(client)
+        self.failUnlessEqual(repos.getCallCount('commitChangeSet'), 2)
+
+    def testParseCompressed(self):
+        import bz2
+        import gzip
+        import shutil
+        import tempfile
+        from rpath_proddef import xmlinput
+        expected = proddef.ProductDefinition(fromStream = refSerialize1)
+        def gzipCompress(data):
+            sio = StringIO.StringIO()
+            gz = gzip.GzipFile(fileobj = sio, mode = "w")
+            gz.write(data)
+            gz.close()
+            return sio.getvalue()
+        half = len(refSerialize1) / 2
+        head, tail = refSerialize1[:half], refSerialize1[half:]
+        compressed = [ gzipCompress(refSerialize1),
+            bz2.compress(refSerialize1),
+            # Concatenated streams, padded with zeros for gzip
+            gzipCompress(head) + gzipCompress(tail),
+            gzipCompress(head) + gzipCompress(tail) + '\0' * 8,
+            bz2.compress(head) + bz2.compress(tail) ]
+        if xmlinput.lzma is not None:
+            compressed.append(xmlinput.lzma.compress(refSerialize1))
+
+        class Stream(object):
+            # Not seekable, and without a file descriptor
+            def __init__(self, data):
+                self.read = StringIO.StringIO(data).read
+
+        # Small reads cross the boundaries of the decompressed chunks
+        self.mock(xmlinput, 'chunkSize', 7)
+        for data in compressed:
+            for fromStream in [ data, StringIO.StringIO(data),
+                    Stream(data) ]:
+                prd = proddef.ProductDefinition(fromStream = fromStream)
+                self.failUnlessEqual(prd, expected)
+        prd = proddef.ProductDefinition(fromStream = Stream(refSerialize1))
+        self.failUnlessEqual(prd, expected)
+        # A small chunk of highly compressed data is not inflated at once
+        source = xmlinput.openInput(gzipCompress('\0' * 1024 * 1024))
+        self.failUnlessEqual(source.read(1), '\0')
+        self.failUnless(len(source._buffer) < xmlinput.chunkSize)
+        self.unmock()
+
+        self.mock(xmlinput, 'lzma', None)
+        self.failUnlessRaises(RuntimeError, proddef.ProductDefinition,
+            fromStream = '\xfd7zXZ\x00\x00')
+        self.unmock()
+
+        # Plain files are mapped from where they are positioned
+        tmpDir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpDir, 'product-definition.xml')
+            file(path, "w").write('garbage' + refSerialize1)
+            self.mock(xmlinput, 'mmapThreshold', 0)
+            fobj = file(path)
+            fobj.seek(len('garbage'))
+            source = xmlinput.openInput(fobj)
+            self.failUnless(hasattr(source, 'find'))
+            self.failUnlessEqual(source.read(len(refSerialize1) + 1),
+                refSerialize1)
+            source.close()
+            fobj.seek(len('garbage'))
+            prd = proddef.ProductDefinition(fromStream = fobj)
+            self.failUnlessEqual(prd, expected)
+            self.failUnlessEqual(fobj.tell(), os.path.getsize(path))
+            self.unmock()
+            fobj.seek(len('garbage'))
+            source = xmlinput.openInput(fobj)
+            self.failIf(hasattr(source, 'find'))
+        finally:
+            shutil.rmtree(tmpDir)
+
+    def testParseMappedTracing(self):
+        import shutil
+        import tempfile
+        from rpath_proddef import xmlinput
+        # A file large enough to be memory mapped
+        xmlData = refSerialize1 + '<!-- %s -->\n' % (
+            'x' * xmlinput.mmapThreshold)
+        tmpDir = tempfile.mkdtemp()
+        spans = []
+        proddef.tracer.addCallback(spans.append)
+        try:
+            path = os.path.join(tmpDir, 'product-definition.xml')
+            file(path, "w").write(xmlData)
+            prd = proddef.ProductDefinition(fromStream = file(path))
+        finally:
+            proddef.tracer.removeCallback(spans.append)
+            shutil.rmtree(tmpDir)
+        self.failUnlessEqual(prd,
+            proddef.ProductDefinition(fromStream = refSerialize1))
+        parse = [ x for x in spans if x.name == 'parseStream' ][0]
+        self.failUnlessEqual(parse.attributes['size'], len(xmlData))
+
+    def testElementTree(self):
+        prd = proddef.ProductDefinition(fromStream = refSerialize1)
+        tree = prd.toElementTree()
+        sio = StringIO.StringIO()
+        prd.serialize(sio)
+        self.failUnlessEqual(etree.tostring(tree, encoding = 'UTF-8',
+            pretty_print = True, xml_declaration = True), sio.getvalue())
+        root = tree.getroot()
+        self.failUnlessEqual(root.get('version'), prd.version)
+        tree = prd.toElementTree(version = '4.0', validate = False)
+        self.failUnlessEqual(tree.getroot().get('version'), '4.0')
+        # Trees are not shared
+        self.failIf(prd.toElementTree().getroot() is root)
+
+        nprd = proddef.ProductDefinition.fromElementTree(root)
+        self.failUnlessEqual(nprd, prd)
+        self.failUnlessEqual(nprd.preMigrateVersion, prd.version)
+        nprd = proddef.ProductDefinition.fromElementTree(tree,
+            validate = True)
+        self.failUnless(isinstance(nprd, proddef.ProductDefinition))
+        self.failUnlessEqual(nprd.preMigrateVersion, '4.0')
+        self.failUnlessEqual(nprd, prd)
+
+        # Elements of the tree built with a namespace prefix
+        xml = refSerialize1.replace('<productDefinition ',
+            '<rpd:productDefinition xmlns:rpd="%s" ' %
+                proddef.ProductDefinition.defaultNamespace)
+        xml = xml.replace('</productDefinition>',
+            '</rpd:productDefinition>')
+        nprd = proddef.ProductDefinition.fromElementTree(
+            etree.fromstring(xml))
+        self.failUnlessEqual(nprd, prd)
+
+        root = prd.toElementTree().getroot()
+        etree.SubElement(root, 'bogus')
+        self.failUnlessRaises(proddef.SchemaValidationError,
+            proddef.ProductDefinition.fromElementTree, root,
+            validate = True)
+
+        plat = proddef.PlatformDefinition(fromStream = refPlatSerialize1)
+        nplat = proddef.PlatformDefinition.fromElementTree(
+            plat.toElementTree())
+        self.failUnless(isinstance(nplat, proddef.PlatformDefinition))
+        self.failUnlessEqual(nplat._rootObj, plat._rootObj)
+
+    def testParseSections(self):
+        prd = proddef.ProductDefinition(fromStream = refSerialize1)
+        sprd = proddef.ProductDefinition(fromStream = refSerialize1,
+            sections = [ 'stages', 'searchPaths' ])
+        self.failIf(sprd.isFullyLoaded())
+        self.failUnless(prd.isFullyLoaded())
+        # Single values are always loaded
+        self.failUnlessEqual(sprd.getProductShortname(),
+            prd.getProductShortname())
+        self.failUnlessEqual(sprd.getProductDescription(),
+            prd.getProductDescription())
+        self.failUnlessEqual(
+            [ (x.name, x.labelSuffix) for x in sprd.getStages() ],
+            [ (x.name, x.labelSuffix) for x in prd.getStages() ])
+        self.failUnlessEqual(
+            [ (x.troveName, x.label) for x in sprd.getSearchPaths() ],
+            [ (x.troveName, x.label) for x in prd.getSearchPaths() ])
+        self.failIf(sprd.isFullyLoaded())
+        self.failUnlessEqual(sprd._rootObj.buildDefinition, None)
+
+        # Read-only until fully loaded; refused changes are not made
+        self.failUnlessRaises(proddef.ReadOnlyDefinitionError,
+            sprd.setProductDescription, 'changed')
+        self.failUnlessEqual(sprd.getProductDescription(),
+            prd.getProductDescription())
+        stage = sprd.getStages()[0]
+        self.failUnlessRaises(proddef.ReadOnlyDefinitionError,
+            setattr, stage, 'name', 'changed')
+        self.failUnlessEqual(stage.name, prd.getStages()[0].name)
+        self.failUnlessRaises(proddef.ReadOnlyDefinitionError,
+            sprd.addStage, name = 'extra', labelSuffix = '-extra')
+        self.failUnlessEqual(len(sprd.getStages()), len(prd.getStages()))
+        self.failIf(sprd.isModified())
+        self.failUnlessRaises(proddef.ReadOnlyDefinitionError,
+            sprd.serialize, StringIO.StringIO())
+        self.failUnlessRaises(proddef.ReadOnlyDefinitionError,
+            sprd.toDict)
+        self.failUnlessRaises(proddef.ReadOnlyDefinitionError,
+            copy.deepcopy, sprd)
+
+        sprd.loadAllSections()
+        self.failUnless(sprd.isFullyLoaded())
+        self.failUnlessEqual(sprd, prd)
+        sprd.setProductDescription('changed')
+        self.failUnlessEqual(sprd.getProductDescription(), 'changed')
+        # Nothing left to load
+        sprd.loadAllSections()
+        self.failUnlessEqual(sprd.getProductDescription(), 'changed')
+
+        import gzip
+        sio = StringIO.StringIO()
+        gz = gzip.GzipFile(fileobj = sio, mode = "w")
+        gz.write(refSerialize1)
+        gz.close()
+        sio.seek(0)
+        sprd = proddef.ProductDefinition(fromStream = sio,
+            sections = [ 'buildDefinition' ])
+        self.failUnlessEqual(len(sprd.getBuildDefinitions()),
+            len(prd.getBuildDefinitions()))
+        self.failIf(sprd.isFullyLoaded())
+        # Getting a skipped section loads all of them
+        self.failUnlessEqual(
+            [ (x.name, x.labelSuffix) for x in sprd.getStages() ],
+            [ (x.name, x.labelSuffix) for x in prd.getStages() ])
+        self.failUnless(sprd.isFullyLoaded())
+        self.failUnlessEqual(sprd, prd)
+
+        self.failUnlessRaises(proddef.ProductDefinitionError,
+            proddef.ProductDefinition, fromStream = refSerialize1,
+            sections = [ 'stages', 'bogus' ])
+
+    def testParseSectionsPostinit(self):
+        # The selected sections come out as in a full load, although they
+        # are completed from other sections (the platform gets no default
+        # content, since the product has architectures)
+        for sections in [ [ 'platform' ], [ 'buildDefinition' ],
+                [ 'stages', 'searchPaths' ] ]:
+            prd = proddef.ProductDefinition(fromStream = refSerialize3)
+            sprd = proddef.ProductDefinition(fromStream = refSerialize3,
+                sections = sections)
+            for section in sections:
+                self.failUnlessEqual(getattr(sprd._rootObj, section),
+                    getattr(prd._rootObj, section), section)
+            if 'buildDefinition' in sections:
+                self.failUnlessEqual(
+                    [ (x.buildFlavor, x.containerTemplateFields)
+                        for x in sprd.getBuildDefinitions() ],
+                    [ (x.buildFlavor, x.containerTemplateFields)
+                        for x in prd.getBuildDefinitions() ])
+        # Sections nothing selected depends on are skipped
+        sprd = proddef.ProductDefinition(fromStream = refSerialize3,
+            sections = [ 'platform' ])
+        self.failUnlessEqual(sprd._rootObj.buildDefinition, None)
+        self.failUnlessEqual(sprd._rootObj.stages, None)
+        self.failUnlessEqual(sprd.platform.getArchitectures(), [])
+        self.failUnlessEqual(len(sprd.getArchitectures()), 1)
+        self.failIf(sprd.isFullyLoaded())
+        self.failUnlessEqual(len(sprd.getBuildDefinitions()),
+            len(prd.getBuildDefinitions()))
+        self.failUnless(sprd.isFullyLoaded())
+        # The platform is loaded on demand as well
+        sprd = proddef.ProductDefinition(fromStream = refSerialize3,
+            sections = [ 'stages' ])
+        self.failUnlessEqual(sprd._rootObj.platform, None)
+        self.failUnlessEqual(sprd.getPlatformSourceTrove(),
+            prd.getPlatformSourceTrove())
+        self.failUnless(sprd.isFullyLoaded())
+
+    def testBulkSaveSchemaVersion(self):
+        from rpath_proddef import fakerepos
+        client = fakerepos.FakeConaryClient()
+        label = 'localhost@rpl:plat'
+        plat = proddef.PlatformDefinition(fromStream = refPlatSerialize1)
+        sio = StringIO.StringIO()
+        plat.serialize(sio, version = '4.0')
+        # Loaded without migrating, as loadFromRepository does when given a
+        # schema version
+        pld = proddef.PlatformDefinition()
+        pld.version = '4.0'
+        pld.parseStream(sio.getvalue())
+        bulk = proddef.BulkSave(client)
+        bulk.add(pld, label = label)
+        committed, skipped = bulk.commit()
+        self.failUnlessEqual(committed, [ ('platform-definition', label) ])
+
+        nplat = proddef.PlatformDefinition()
+        nplat.loadFromRepository(client, label)
+        self.failUnlessEqual(nplat.preMigrateVersion, '4.0')
+
+    def testBulkSaveUnmodified(self):
+        from rpath_proddef import fakerepos
+        client = fakerepos.FakeConaryClient()
+        label = 'localhost@rpl:plat'
+        prd = proddef.ProductDefinition(fromStream = refSerialize1)
+        prd.setProductDescription('changed')
+        pld = prd.toPlatformDefinition()
+        self.failUnless(prd.isModified())
+        self.failUnless(pld.isModified())
+        bulk = proddef.BulkSave(client)
+        bulk.add(prd)
+        bulk.add(pld, label = label)
+        committed, skipped = bulk.commit()
+        self.failUnlessEqual(len(committed), 2)
+        self.failIf(prd.isModified())
+        self.failIf(pld.isModified())
+
+        # Skipped definitions match the repository as well
+        prd.setProductDescription('changed again')
+        pld.setBaseFlavor(pld.getBaseFlavor())
+        self.failUnless(pld.isModified())
+        bulk.add(prd)
+        bulk.add(pld, label = label)
+        committed, skipped = bulk.commit()
+        self.failUnlessEqual(skipped, [ ('platform-definition', label) ])
+        self.failIf(prd.isModified())
+        self.failIf(pld.isModified())
+
+    def testTracing(self):
+        from rpath_proddef import fakerepos
+        spans = []
+        proddef.tracer.addCallback(spans.append)
+        try:
+            prd = self.newProductDefinition()
+            sio = StringIO.StringIO()
+            prd.serialize(sio, version = '4.0')
+            nprd = proddef.ProductDefinition(fromStream = sio.getvalue())
+
+            client = fakerepos.FakeConaryClient()
+            prd.saveToRepository(client)
+            nprd.loadFromRepository(client)
+        finally:
+            proddef.tracer.removeCallback(spans.append)
+
+        byName = {}
+        for span in spans:
+            byName.setdefault(span.name, []).append(span)
+            self.failUnless(span.duration >= 0)
+            self.failUnlessEqual(span.error, None)
+
+        migrateBack = byName['migrateBack'][0]
+        self.failUnlessEqual(migrateBack.parent.name, 'serialize')
+        self.failUnlessEqual(migrateBack.attributes['toVersion'], '4.0')
+        self.failUnlessEqual(migrateBack.attributes['hops'],
+            len(proddef.MigrationManager('4.0')._path) - 1)
+
+        parse = byName['parseStream'][0]
+        self.failUnlessEqual(parse.parent, None)
+        self.failUnlessEqual(parse.attributes['schemaVersion'], '4.0')
+        self.failUnlessEqual(parse.attributes['size'], len(sio.getvalue()))
+        self.failUnlessEqual(parse.attributes['builds'],
+            len(prd.getBuildDefinitions()))
+        self.failUnlessEqual(
+            sorted(x.name for x in spans if x.parent is parse),
+            ['migrateForward', 'postinit', 'xmlParse'])
+
+        save = byName['saveToRepository'][0]
+        self.failUnlessEqual(save.attributes['committed'], True)
+        self.failUnlessEqual(save.attributes['roundTrips'], 3)
+        fetch = byName['getStreamFromRepository'][0]
+        self.failUnlessEqual(fetch.attributes['roundTrips'], 2)
+        self.failUnlessEqual(
+            client.getRepos().getCallCount(), 3 + 2)
+        self.failUnlessEqual(fetch.parent, None)
+        self.failUnlessEqual(byName['parseStream'][-1].parent, None)
+
+        # Without callbacks, nothing is recorded
+        del spans[:]
+        proddef.ProductDefinition(fromStream = sio.getvalue())
+        self.failUnlessEqual(spans, [])
+        self.failIf(proddef.tracer.current())
+
+    def testMetrics(self):
+        from rpath_proddef import fakerepos, metrics
+        metrics.registry.reset()
+        prd = self.newProductDefinition()
+        sio = StringIO.StringIO()
+        prd.serialize(sio, version = '4.0')
+        proddef.ProductDefinition(fromStream = sio.getvalue())
+        hops = len(proddef.MigrationManager('4.0')._path) - 1
+        self.failUnlessEqual(
+            metrics.documentParses.get(schema_version = '4.0'), 1)
+        self.failUnlessEqual(metrics.migrationHops.get(direction = 'back'),
+            hops)
+        self.failUnlessEqual(
+            metrics.migrationHops.get(direction = 'forward'), hops)
+
+        repos = fakerepos.FakeRepository()
+        client = fakerepos.FakeConaryClient(repos)
+        prd.saveToRepository(client)
+        nprd = proddef.ProductDefinition()
+        nprd.setConaryRepositoryHostname(prd.getConaryRepositoryHostname())
+        nprd.setConaryNamespace(prd.getConaryNamespace())
+        nprd.setProductShortname(prd.getProductShortname())
+        nprd.setProductVersion(prd.getProductVersion())
+        nprd.loadFromRepository(client)
+        for method, count in repos.calls.items():
+            self.failUnlessEqual(
+                metrics.repositoryCalls.get(method = method), count)
+        self.failUnlessEqual(metrics.downloadedBytes.get(),
+            repos.bytesDownloaded)
+
+        snapshot = metrics.registry.snapshot()
+        samples = snapshot['rpath_proddef_operation_seconds']['samples']
+        self.failUnlessEqual(
+            sorted((x['labels']['operation'], x['count']) for x in samples),
+            [ ('load', 1), ('save', 1) ])
+        text = metrics.registry.dumpText()
+        self.failUnless('# TYPE rpath_proddef_operation_seconds histogram\n'
+            in text)
+        self.failUnless('rpath_proddef_operation_seconds_count'
+            '{operation="load"} 1\n' in text)
+        self.failUnless('rpath_proddef_document_parses_total'
+            '{schema_version="4.0"} 1\n' in text)
+
+    def _importAio(self):
+        try:
+            from rpath_proddef import aio
+        except ImportError, e:
+            raise testhelp.SkipTestException("aio not available: %s" % e)
+        return aio
+
+    def testAioSnapshotVersions(self):
+        aio = self._importAio()
+        pld = self.newPlatformDefinition()
+        pld.addSearchPath(troveName = 'group-cny', label = 'localhost@cny:3')
+
+        class MockClient(self.MockClient):
+            class MockRepos(self.MockClient.MockRepos):
+                TroveMap = {
+                    ('group-cny', 'localhost@cny:3', None) :
+                        ('group-cny', VFS('/localhost@cny:3/3.0-4-5'), None),
+                }
+
+        loop = aio.asyncio.new_event_loop()
+        session = aio.RepositorySession(MockClient(), maxWorkers = 2,
+            loop = loop)
+        try:
+            loop.run_until_complete(session.snapshotVersions(pld))
+        finally:
+            session.close()
+            loop.close()
+        self.failUnlessEqual(
+            [ (x.troveName, x.version) for x in pld.getSearchPaths() ],
+            [ ('group-cny', '3.0-4-5') ])
+
+    def testAioCancel(self):
+        import threading
+        aio = self._importAio()
+        event = threading.Event()
+        ran = []
+        def blocking():
+            event.wait(5)
+            ran.append('blocking')
+            return 'done'
+        def queued():
+            ran.append('queued')
+
+        loop = aio.asyncio.new_event_loop()
+        session = aio.RepositorySession(self.MockClient(), maxWorkers = 1,
+            loop = loop)
+        try:
+            fut1 = session.run(blocking)
+            fut2 = session.run(queued)
+            fut2.cancel()
+            loop.call_later(0.1, event.set)
+            self.failUnlessEqual(loop.run_until_complete(fut1), 'done')
+        finally:
+            event.set()
+            session.close()
+            loop.close()
+        self.failUnless(fut2.cancelled())
+        self.failUnlessEqual(ran, ['blocking'])
+        self.failUnlessRaises(RuntimeError, session.run, blocking)
+
     def testSearchPathWithFlavor(self):
         prd = proddef.ProductDefinition(fromStream = refSerialize1)
         prd.addSearchPath(label='localhost@other:label-1',
@@ -4145,6 +5624,108 @@ class MigrationTest(BaseTest):
         pd.serialize(sio, version = '3.0')
         self.assertXMLEquals(sio.getvalue(), file(xmlPath).read())
 
+    def testBulkMigrate(self):
+        import json
+        import tarfile
+        import tempfile
+        from rpath_proddef import bulk
+        srcDir = os.path.join(self.getArchiveDir(), 'migration')
+        fileNames = sorted(x for x in os.listdir(srcDir)
+            if x.startswith('product-definition'))
+        tmpDir = tempfile.mkdtemp()
+        try:
+            badDir = os.path.join(tmpDir, 'bad')
+            os.mkdir(badDir)
+            file(os.path.join(badDir, 'platform-definition-bad.xml'),
+                "w").write('<platformDefinition version="4.7"><bogus/>'
+                    '</platformDefinition>')
+            tarPath = os.path.join(tmpDir, 'defs.tar')
+            tarball = tarfile.open(tarPath, "w")
+            for fileName in fileNames:
+                tarball.add(os.path.join(srcDir, fileName),
+                    'defs/' + fileName)
+            tarball.close()
+
+            outDir = os.path.join(tmpDir, 'out')
+            options = bulk.BulkOptions(schemaDir = self.schemaDir,
+                migrate = True, outputDir = outDir)
+            for jobs in [ 1, 2 ]:
+                out = StringIO.StringIO()
+                count, failed = bulk.run([ srcDir, badDir ], options,
+                    jobs = jobs, out = out)
+                self.failUnlessEqual((count, failed), (len(fileNames) + 1, 1))
+                results = dict((x['file'], x)
+                    for x in map(json.loads, out.getvalue().splitlines()))
+                self.failUnlessEqual(sorted(results),
+                    sorted(fileNames + [ 'platform-definition-bad.xml' ]))
+                bad = results.pop('platform-definition-bad.xml')
+                self.failIf(bad['ok'])
+                self.failUnless(bad['error'].startswith(
+                    'SchemaValidationError'))
+                for fileName, result in results.items():
+                    self.failUnless(result['ok'], result['error'])
+                    self.failUnlessEqual(result['version'],
+                        fileName.split('-')[2])
+                    self.failUnlessEqual(result['migratedVersion'],
+                        proddef.ProductDefinition.version)
+                    self.failUnless(result['timings']['total'] > 0)
+                    pd = proddef.ProductDefinition(
+                        fromStream = file(result['output']))
+                    self.failUnlessEqual(pd.preMigrateVersion,
+                        proddef.ProductDefinition.version)
+
+            out = StringIO.StringIO()
+            options = bulk.BulkOptions(schemaDir = self.schemaDir)
+            self.failUnlessEqual(bulk.run([ tarPath ], options, out = out),
+                (len(fileNames), 0))
+            self.failUnlessEqual(
+                sorted(json.loads(x)['file']
+                    for x in out.getvalue().splitlines()),
+                [ 'defs/' + x for x in fileNames ])
+            self.failUnlessRaises(proddef.ProductDefinitionError,
+                bulk.run, [ os.path.join(tmpDir, 'out', fileNames[0]) ],
+                options, out = out)
+        finally:
+            util.rmtree(tmpDir)
+
+    def testBulkOutputPath(self):
+        import tempfile
+        from rpath_proddef import bulk
+        self.failUnlessEqual(bulk.getOutputPath('/out', 'defs/./a.xml'),
+            '/out/defs/a.xml')
+        for name in [ '../x/product-definition.xml',
+                '/etc/product-definition.xml',
+                'defs/../../product-definition.xml',
+                'defs/../product-definition.xml' ]:
+            self.failUnlessRaises(proddef.ProductDefinitionError,
+                bulk.getOutputPath, '/out', name)
+
+        xmlPath = os.path.join(self.getArchiveDir(), 'migration',
+            'product-definition-3.1-1.xml')
+        data = file(xmlPath).read()
+        tmpDir = tempfile.mkdtemp()
+        try:
+            outDir = os.path.join(tmpDir, 'out')
+            options = bulk.BulkOptions(schemaDir = self.schemaDir,
+                migrate = True, outputDir = outDir)
+            result = bulk.processDocument(
+                ('../product-definition.xml', None, data), options)
+            self.failIf(result['ok'])
+            self.failUnless(result['error'].startswith(
+                'ProductDefinitionError'), result['error'])
+            self.failIf(os.path.exists(
+                os.path.join(tmpDir, 'product-definition.xml')))
+
+            result = bulk.processDocument(
+                ('defs/product-definition.xml', None, data), options)
+            self.failUnless(result['ok'], result['error'])
+            self.failUnlessEqual(result['version'], '3.1')
+            pd = proddef.ProductDefinition(fromStream = file(result['output']))
+            self.failUnlessEqual(pd, proddef.ProductDefinition(
+                fromStream = data))
+        finally:
+            util.rmtree(tmpDir)
+
     def testMigrationTo4_5(self):
         # RCE-1915 Make sure label gets dropped
         xmlPath = os.path.join(self.getArchiveDir(), 'migration',
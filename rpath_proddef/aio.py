@@ -0,0 +1,164 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Event loop interface for the repository-backed operations.
+
+The methods of L{RepositorySession} return futures bound to an event loop,
+which can be awaited from C{asyncio} coroutines (or yielded from C{trollius}
+coroutines). The blocking Conary calls run on a thread pool owned by the
+session, which bounds the number of concurrent repository operations.
+
+Example::
+    session = RepositorySession(client, maxWorkers = 4)
+    nvf = yield From(session.loadFromRepository(prodDef))
+    yield From(session.rebase(prodDef))
+    session.close()
+
+The Conary client is only used through its C{getRepos()} method and its
+C{cfg} attribute, so a fake client can be passed in for testing. The
+client must allow concurrent calls when C{maxWorkers} is larger than 1.
+Operations on the same definition object must not overlap.
+
+This module requires C{asyncio} (or C{trollius}) and C{concurrent.futures}
+(or the C{futures} backport); it is not imported by C{rpath_proddef}.
+"""
+
+import functools
+import threading
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+from concurrent import futures
+
+
+class RepositorySession(object):
+    """
+    Run repository-backed operations on a managed thread pool.
+    @ivar client: The Conary client used for all operations
+    @ivar maxWorkers: Maximum number of concurrent repository operations
+    @type maxWorkers: C{int}
+    """
+    def __init__(self, client, maxWorkers = 4, loop = None):
+        """
+        @param client: A Conary client object, or a fake client with the
+        same interface
+        @type client: C{conaryclient.ConaryClient}
+        @param maxWorkers: Maximum number of concurrent repository
+        operations
+        @type maxWorkers: C{int}
+        @param loop: The event loop the returned futures are bound to.
+        Defaults to the current event loop at call time.
+        """
+        self.client = client
+        self.maxWorkers = maxWorkers
+        self._loop = loop
+        self._executor = futures.ThreadPoolExecutor(max_workers = maxWorkers)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def close(self, cancel = False, wait = True):
+        """
+        Shut the thread pool down. The session cannot be used afterwards.
+        @param cancel: Cancel the operations that did not start yet
+        @type cancel: C{bool}
+        @param wait: Wait for the running operations to finish
+        @type wait: C{bool}
+        """
+        with self._lock:
+            self._closed = True
+            pending = list(self._pending)
+        if cancel:
+            for fut in pending:
+                fut.cancel()
+        self._executor.shutdown(wait = wait)
+
+    def cancelAll(self):
+        """
+        Cancel all operations that did not start yet. Operations already
+        running are not interrupted.
+        @return: the number of operations cancelled
+        @rtype: C{int}
+        """
+        with self._lock:
+            pending = list(self._pending)
+        return len([ x for x in pending if x.cancel() ])
+
+    def _submit(self, func, *args, **kwargs):
+        loop = self._loop
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Session is closed")
+            cfut = self._executor.submit(functools.partial(func, *args,
+                **kwargs))
+            self._pending.add(cfut)
+        cfut.add_done_callback(self._done)
+        # Cancelling the returned future cancels cfut if it did not start
+        return asyncio.wrap_future(cfut, loop = loop)
+
+    def _done(self, cfut):
+        with self._lock:
+            self._pending.discard(cfut)
+
+    def loadFromRepository(self, definition, *args, **kwargs):
+        """
+        Future version of C{loadFromRepository}; the remaining arguments
+        are passed to the definition's method, after the client.
+        @param definition: The definition to load into
+        @type definition: C{ProductDefinition} or C{PlatformDefinition}
+        """
+        return self._submit(definition.loadFromRepository, self.client,
+            *args, **kwargs)
+
+    def saveToRepository(self, definition, *args, **kwargs):
+        """
+        Future version of C{saveToRepository}; the remaining arguments
+        are passed to the definition's method, after the client.
+        @param definition: The definition to save
+        @type definition: C{ProductDefinition} or C{PlatformDefinition}
+        """
+        return self._submit(definition.saveToRepository, self.client,
+            *args, **kwargs)
+
+    def rebase(self, productDefinition, *args, **kwargs):
+        """
+        Future version of C{ProductDefinition.rebase}.
+        @param productDefinition: The product definition to rebase
+        @type productDefinition: C{ProductDefinition}
+        """
+        return self._submit(productDefinition.rebase, self.client,
+            *args, **kwargs)
+
+    def snapshotVersions(self, platformDefinition, *args, **kwargs):
+        """
+        Future version of C{PlatformDefinition.snapshotVersions}.
+        @param platformDefinition: The platform definition to snapshot
+        @type platformDefinition: C{PlatformDefinition}
+        """
+        return self._submit(platformDefinition.snapshotVersions, self.client,
+            *args, **kwargs)
+
+    def run(self, func, *args, **kwargs):
+        """
+        Run any other blocking callable on the session's thread pool.
+        """
+        return self._submit(func, *args, **kwargs)
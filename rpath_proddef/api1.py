@@ -25,9 +25,13 @@ character are public interfaces.
 
 import itertools
 import collections
+import copy
+import functools
 import os
 import StringIO
 import sys
+import threading
+import time
 from lxml import etree
 
 from conary import changelog
@@ -43,6 +47,9 @@ from conary.repository import errors as repositoryErrors
 from conary.repository import changeset
 
 from rpath_proddef import _xmlConstants
+from rpath_proddef import interning
+from rpath_proddef import metrics
+from rpath_proddef import xmlinput
 
 Stage = collections.namedtuple("Stage", "name labelSuffix")
 DefaultStages = [
@@ -105,6 +112,9 @@ class InvalidSchemaVersionError(ProductDefinitionError):
 class SchemaValidationError(ProductDefinitionError):
     "XML document does not validate against the XML schema"
 
+class ReadOnlyDefinitionError(ProductDefinitionError):
+    "Raised when modifying or writing a partially loaded definition"
+
 #}
 
 def generateId(*components):
@@ -115,6 +125,168 @@ def generateId(*components):
         dig.update(str(component))
     return 'a-' + dig.hexdigest()[:10]
 
+class TraceSpan(object):
+    """
+    A timed operation. Spans are passed to the tracer's callbacks when they
+    end.
+    @ivar name: The name of the operation
+    @type name: C{str}
+    @ivar attributes: Attributes describing the operation
+    @type attributes: C{dict}
+    @ivar parent: The enclosing span in the same thread, or None
+    @type parent: C{TraceSpan}
+    @ivar start: Start time, in seconds since the epoch
+    @type start: C{float}
+    @ivar duration: Duration, in seconds
+    @type duration: C{float}
+    @ivar error: Name of the exception class, if the operation failed
+    @type error: C{str}
+    """
+    __slots__ = [ 'name', 'attributes', 'parent', 'start', 'duration',
+        'error', '_tracer' ]
+
+    def __init__(self, tracer, name, attributes):
+        self._tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.parent = None
+        self.start = self.duration = self.error = None
+
+    def setAttribute(self, name, value):
+        self.attributes[name] = value
+
+    def increment(self, name, value = 1):
+        self.attributes[name] = self.attributes.get(name, 0) + value
+
+    def __enter__(self):
+        stack = self._tracer._getStack()
+        if stack:
+            self.parent = stack[-1]
+        stack.append(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, excType, excValue, excTb):
+        self.duration = time.time() - self.start
+        self._tracer._getStack().pop()
+        if excType is not None:
+            self.error = excType.__name__
+        self._tracer._emit(self)
+        return False
+
+class _NullSpan(object):
+    """
+    Span returned while tracing is disabled; evaluates to False, so
+    expensive attributes can be skipped with C{if span:}.
+    """
+    __slots__ = []
+
+    def __nonzero__(self):
+        return False
+
+    def setAttribute(self, name, value):
+        pass
+
+    def increment(self, name, value = 1):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, excTb):
+        return False
+
+_nullSpan = _NullSpan()
+
+class Tracer(object):
+    """
+    Emit timed spans for parsing, migration, serialization and repository
+    operations to registered callbacks. Tracing is disabled while no
+    callbacks are registered.
+
+    Callbacks are called with a C{TraceSpan} when the span ends, in the
+    thread that ran the operation, and must not raise exceptions.
+    """
+    def __init__(self):
+        # Replaced, not modified, so emitting needs no lock
+        self._callbacks = ()
+        self._local = threading.local()
+
+    def addCallback(self, callback):
+        self._callbacks = self._callbacks + (callback, )
+
+    def removeCallback(self, callback):
+        self._callbacks = tuple(x for x in self._callbacks
+            if x != callback)
+
+    @property
+    def enabled(self):
+        return bool(self._callbacks)
+
+    def span(self, name, **attributes):
+        """
+        @return: a context manager timing the operation C{name}
+        """
+        if not self._callbacks:
+            return _nullSpan
+        return TraceSpan(self, name, attributes)
+
+    def current(self):
+        """
+        @return: the innermost active span in this thread, or a no-op span
+        """
+        stack = getattr(self._local, 'stack', None)
+        if not stack:
+            return _nullSpan
+        return stack[-1]
+
+    def _getStack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _emit(self, span):
+        for callback in self._callbacks:
+            callback(span)
+
+tracer = Tracer()
+
+def _traced(name):
+    """
+    Decorator running the function in a span named C{name}. The function
+    can add attributes to C{tracer.current()}.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer._callbacks:
+                return func(*args, **kwargs)
+            with TraceSpan(tracer, name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _invalidatesCache(func):
+    """
+    Decorator for definition methods that modify data the derived views
+    (such as L{ProductDefinition.buildMatrix}) are computed from.
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return func(self, *args, **kwargs)
+        finally:
+            self.invalidateCache()
+    return wrapper
+
+SchemaCompatibility = collections.namedtuple('SchemaCompatibility',
+    'version supported droppedFields')
+
+BuildMatrixRow = collections.namedtuple('BuildMatrixRow', [
+    'stage', 'label', 'buildName', 'architectureRef', 'containerFormat',
+    'flavor', 'imageFields', 'imageGroup', 'sourceGroup', 'partitionScheme'])
+
 class BaseDefinition(object):
     version = _xmlConstants.version
     Versioned = True
@@ -123,7 +295,12 @@ class BaseDefinition(object):
 
     schemaDir = "/usr/share/rpath_proddef"
 
-    def __init__(self, fromStream = None, validate = False, schemaDir = None):
+    # Section -> sections that _postinit completes it from, which are
+    # loaded along with it (see parseStream)
+    _sectionDependencies = {}
+
+    def __init__(self, fromStream = None, validate = False, schemaDir = None,
+            sections = None):
         """
         Initialize a ProductDefinition object, getting data from the optional
         XML stream.
@@ -133,6 +310,9 @@ class BaseDefinition(object):
         @type validate: C{bool}
         @param schemaDir: A directory where schema files are stored
         @type schemaDir: C{str}
+        @param sections: Only load these sections of the stream (see
+        L{parseStream})
+        @type sections: C{list}
         """
 
         self._initFields()
@@ -143,44 +323,201 @@ class BaseDefinition(object):
 
         if fromStream:
             self.parseStream(fromStream, validate = validate,
-                             schemaDir = self.schemaDir)
+                             schemaDir = self.schemaDir, sections = sections)
 
-    def parseStream(self, fromStream, validate = False, schemaDir = None):
+    @_traced('parseStream')
+    def parseStream(self, fromStream, validate = False, schemaDir = None,
+            sections = None):
         """
         Initialize the current object from an XML stream.
-        @param stream: An XML stream
+        @param stream: An XML stream, possibly compressed with gzip, bzip2
+        or xz (see L{xmlinput.openInput})
         @type stream: C{file}
         @param validate: Validate before parsing (off by default)
         @type validate: C{bool}
         @param schemaDir: A directory where schema files are stored
         @type schemaDir: C{str}
+        @param sections: Names of the elements under the root element to
+        load, such as C{stages} or C{searchPaths}. The elements holding a
+        single value are always loaded, and so are the sections the
+        selected ones are completed from when loaded (the architectures
+        of the product for its platform, for instance, as the default
+        platform content is only added to products without any). The
+        other elements are skipped, and
+        the XML is kept until L{loadAllSections} is called, which getting
+        a skipped section does. Until then, the definition is read-only:
+        modifying it or writing it raises L{ReadOnlyDefinitionError}. All
+        sections are loaded by default.
+        @type sections: C{list}
         """
         self._initFields()
 
         from xml.dom import minidom
-        if isinstance(fromStream, (str, unicode)):
+        source = xmlinput.openInput(fromStream)
+        if sections is not None and not isinstance(source, (str, unicode)):
+            # Keep the (decompressed) XML for loadAllSections
+            fobj = source
+            try:
+                source = ''.join(iter(
+                    functools.partial(fobj.read, 64 * 1024), ''))
+            finally:
+                fobj.close()
+        if isinstance(source, (str, unicode)):
             func = minidom.parseString
         else:
             func = minidom.parse
-        doc = func(fromStream)
-        rootNode = doc.documentElement
+        span = tracer.current()
+        with tracer.span('xmlParse'):
+            try:
+                doc = func(source)
+                if span:
+                    # Memory maps cannot tell their position once closed
+                    size = self._getStreamSize(source)
+            finally:
+                if hasattr(source, 'close') and source is not fromStream:
+                    source.close()
+            version, rootObj, skipped = self._buildRootObj(
+                doc.documentElement, sections)
+            doc.unlink()
+        if span:
+            span.setAttribute('size', size)
+        self._setParsedRootObj(version, rootObj)
+        if sections is not None:
+            self._projection = (source, validate, schemaDir, skipped)
+            self._rootObj._writeHook_ = self._rejectModification
+
+    def _buildRootObj(self, rootNode, sections = None):
+        """
+        Build the generated objects from the root node of a DOM document.
+        @param sections: Names of the elements under the root element to
+        build, besides the ones holding a single value; all of them by
+        default
+        @return: the schema version of the document, the root object, and
+        the names of the sections that were skipped
+        """
         if rootNode.attributes.has_key('version'):
             version = rootNode.attributes['version'].value.encode('ascii')
         else:
             # XXX default to the current version, hope for the best
             version = self.version
         self._preMigrateVersion = version
+        metrics.documentParses.inc(schema_version = version)
 
         module = self.loadModule(version)
 
-        rootObj = getattr(module, self.ClassFactoryName).factory()
+        factory = getattr(module, self.ClassFactoryName)
+        skipped = frozenset()
+        if sections is not None:
+            skipped = self._skipSections(rootNode, factory, sections)
+        rootObj = factory.factory()
         rootObj.build(rootNode)
-        doc.unlink()
+        return version, rootObj, skipped
+
+    @classmethod
+    def _skipSections(cls, rootNode, factory, sections):
+        """
+        Remove the elements of the sections not in C{sections} from
+        C{rootNode}.
+        @return: the names of the removed sections
+        """
+        # Member names get an underscore appended if they are keywords
+        known = set(x.name.rstrip('_') for x in factory.member_data_items_)
+        sections = set(sections)
+        unknown = sections - known
+        if unknown:
+            raise ProductDefinitionError("Unknown sections: %s" %
+                ', '.join(sorted(unknown)))
+        # Skipping what _postinit needs for the selected sections would
+        # make them differ from a full load
+        pending = list(sections)
+        while pending:
+            for dep in cls._sectionDependencies.get(pending.pop(), ()):
+                if dep in known and dep not in sections:
+                    sections.add(dep)
+                    pending.append(dep)
+        skipped = set()
+        for node in list(rootNode.childNodes):
+            if node.nodeType != node.ELEMENT_NODE:
+                continue
+            name = node.nodeName.split(':')[-1]
+            if name in sections:
+                continue
+            if not [ x for x in node.childNodes
+                    if x.nodeType == x.ELEMENT_NODE ]:
+                # A single value
+                continue
+            skipped.add(name)
+            rootNode.removeChild(node)
+            node.unlink()
+        return frozenset(skipped)
+
+    _readOnlyMessage = ("Only some sections were loaded, "
+        "call loadAllSections first")
+
+    @classmethod
+    def _rejectModification(cls, rootObj):
+        raise ReadOnlyDefinitionError(cls._readOnlyMessage)
+
+    def isFullyLoaded(self):
+        """
+        @return: False if only some sections of the definition were loaded
+        (see L{parseStream})
+        @rtype: C{bool}
+        """
+        return self._projection is None
+
+    def loadAllSections(self):
+        """
+        Load the sections of the definition that were skipped when parsing
+        it, which makes the definition writable again.
+        """
+        if self._projection is None:
+            return
+        source, validate, schemaDir, _ = self._projection
+        sourceTrove = self._sourceTrove
+        self.parseStream(source, validate = validate, schemaDir = schemaDir)
+        self._sourceTrove = sourceTrove
+
+    def _checkFullyLoaded(self):
+        if self._projection is not None:
+            raise ReadOnlyDefinitionError(self._readOnlyMessage)
+
+    def _loadSection(self, name):
+        # Load the skipped sections if section name is one of them
+        if self._projection is not None and name in self._projection[3]:
+            self.loadAllSections()
+
+    def _getSection(self, name):
+        """
+        @return: the node of section C{name} of the root object, loading
+        the skipped sections first if it is one of them
+        """
+        self._loadSection(name)
+        return getattr(self._rootObj, 'get_' + name)()
+
+    def _setParsedRootObj(self, version, rootObj):
+        span = tracer.current()
+        if span:
+            span.setAttribute('schemaVersion', version)
         if version != self.version:
             migr = MigrationManager(version)
             rootObj = migr.migrateForward(rootObj)
         self._rootObj = rootObj
-        self._postinit()
+        with tracer.span('postinit'):
+            self._postinit()
+        self._markUnmodified()
+        if span and hasattr(self, 'getBuildDefinitions'):
+            span.setAttribute('builds', len(self.getBuildDefinitions()))
+
+    @classmethod
+    def _getStreamSize(cls, stream):
+        if isinstance(stream, (str, unicode)):
+            return len(stream)
+        try:
+            # The stream was read to the end
+            return stream.tell()
+        except (AttributeError, IOError, ValueError):
+            return None
 
     @classmethod
     def loadModule(cls, version):
@@ -201,46 +538,255 @@ class BaseDefinition(object):
         return schemaFile
 
     @classmethod
+    @_traced('validate')
     def validate(cls, stream, schemaDir, version):
+        tree = etree.parse(stream)
+        cls.validateTree(tree, schemaDir, version)
+        return tree
+
+    @classmethod
+    def validateTree(cls, tree, schemaDir, version):
+        """
+        Validate an lxml element tree (or element) against the schema of
+        C{version}.
+        @raises C{SchemaValidationError}:
+        """
+        tracer.current().setAttribute('schemaVersion', version)
         schemaFile = cls.getSchemaFile(schemaDir, version)
         schema = etree.XMLSchema(file = schemaFile)
-        tree = etree.parse(stream)
         if not schema.validate(tree):
             raise SchemaValidationError(str(schema.error_log))
-        return tree
 
     @property
     def preMigrateVersion(self):
         return self._preMigrateVersion
 
-    def serialize(self, stream, validate = True, version = None):
+    @_traced('serialize')
+    def serialize(self, stream, validate = True, version = None,
+            canonical = False):
         """
         Serialize the current object as an XML stream.
         @param stream: stream to write the serialized object
         @type stream: C{file}
+        @param canonical: Write the canonical form (Canonical XML, with the
+        items of the collections keyed by L{_keyedCollections} sorted by
+        key and no whitespace between elements) instead of the indented
+        document. Definitions that only differ in the order of those items
+        or in the formatting of the XML have the same canonical form.
+        @type canonical: C{bool}
+        """
+        rootObj = self._getMigratedBack([ version ])[version]
+        self._serializeRoot(stream, rootObj, validate, canonical = canonical)
+
+    def digest(self, version = None):
+        """
+        Compute a digest of the canonical form of this definition (see
+        L{serialize}), usable as a cache key. The digest is computed while
+        the canonical form is written, and is kept until the definition is
+        modified.
+        @param version: An optional schema version to serialize as
+        @type version: C{str}
+        @return: the MD5 hex digest of the canonical form
+        @rtype: C{str}
+        """
+        digests = self._getCached('digests', dict)
+        ret = digests.get(version)
+        if ret is None:
+            digester = DigesterMd5FLO()
+            self.serialize(digester, validate = False, version = version,
+                canonical = True)
+            ret = digests[version] = digester.hexdigest()
+        return ret
+
+    @_traced('serializeVersions')
+    def serializeVersions(self, streamsByVersion, validate = True):
+        """
+        Serialize the current object as several schema versions at once.
+        The chain of back migrations is only walked once, down to the
+        oldest version requested.
+        @param streamsByVersion: dictionary mapping schema versions to the
+        stream to write each of them to
+        @type streamsByVersion: C{dict}
+        """
+        rootObjs = self._getMigratedBack(streamsByVersion)
+        for version, stream in streamsByVersion.items():
+            self._serializeRoot(stream, rootObjs[version], validate)
+
+    @_traced('toElementTree')
+    def toElementTree(self, validate = True, version = None):
+        """
+        Convert the current object to an lxml element tree: the tree
+        L{serialize} writes, without writing it. The tree is not shared, it
+        can be modified.
+        @param validate: Validate the tree against the schema
+        @type validate: C{bool}
+        @param version: An optional schema version to convert to
+        @type version: C{str}
+        @rtype: C{lxml.etree._ElementTree}
+        """
+        rootObj = self._getMigratedBack([ version ])[version]
+        return self._getElementTree(rootObj, validate)
+
+    @classmethod
+    @_traced('fromElementTree')
+    def fromElementTree(cls, tree, validate = False, schemaDir = None):
+        """
+        Create an object from an lxml element tree (or its root element),
+        such as the one returned by L{toElementTree}, without serializing
+        it. The data is migrated from the version it declares to the
+        current schema version.
+        @param validate: Validate the tree against the schema of its
+        version first (off by default)
+        @type validate: C{bool}
+        @param schemaDir: A directory where schema files are stored
+        @type schemaDir: C{str}
+        @rtype: same class as C{cls}
         """
+        from lxml import sax
+        from xml.dom import pulldom
+        obj = cls()
+        if schemaDir:
+            obj.schemaDir = schemaDir
+        if hasattr(tree, 'getroot'):
+            tree = tree.getroot()
+        if validate:
+            cls.validateTree(tree, obj.schemaDir,
+                tree.get('version', obj.version))
+        with tracer.span('xmlParse'):
+            # The DOM document is made from the SAX events of the tree
+            handler = pulldom.SAX2DOM()
+            sax.saxify(tree, handler)
+            doc = handler.document
+            version, rootObj, _ = obj._buildRootObj(doc.documentElement)
+            doc.unlink()
+        obj._setParsedRootObj(version, rootObj)
+        return obj
+
+    def canSerializeAs(self, version):
+        """
+        Check whether this definition can be serialized as schema version
+        C{version}, without migrating it.
+        @return: whether a back migration to C{version} exists, and the
+        paths of the fields set in this definition that have no
+        counterpart in that version (such as C{stages.stage[1].name}),
+        which serializing would drop
+        @rtype: L{SchemaCompatibility}
+        """
+        rootObj = self._rootObj
+        if version == rootObj.get_version():
+            return SchemaCompatibility(version, True, [])
+        try:
+            table = MigrationManager.getBackMigrationTable(version)
+        except (RuntimeError, InvalidSchemaVersionError):
+            return SchemaCompatibility(version, False, [])
+        if table.blockedBy is not None:
+            return SchemaCompatibility(version, False, [])
+        dropped = []
+        self._findDroppedFields(table, rootObj, '', dropped)
+        return SchemaCompatibility(version, True, dropped)
+
+    @classmethod
+    def _findDroppedFields(cls, table, obj, prefix, dropped):
+        droppedFields = table.droppedFields.get(obj.__class__.__name__, ())
+        for spec in obj.member_data_items_:
+            val = getattr(obj, spec.name)
+            if val is None or val == [] or (
+                    spec.name == 'valueOf_' and val == ''):
+                continue
+            path = prefix + spec.name
+            if spec.name in droppedFields:
+                dropped.append(path)
+                continue
+            if not spec.container:
+                val = [ val ]
+            for i, item in enumerate(val):
+                if not hasattr(item, 'member_data_items_'):
+                    continue
+                itemPath = path
+                if spec.container:
+                    itemPath = '%s[%d]' % (path, i)
+                if item.__class__.__name__ in table.droppedClasses:
+                    dropped.append(itemPath)
+                else:
+                    cls._findDroppedFields(table, item, itemPath + '.',
+                        dropped)
+
+    def _getMigratedBack(self, versions):
+        """
+        @return: dictionary mapping each of C{versions} to the root object
+        migrated back to that schema version (None being the current
+        version). The migrated trees are cached until the definition is
+        modified.
+        """
+        self._checkFullyLoaded()
+        current = self._rootObj.get_version()
+        ret = {}
+        for version in versions:
+            if version is None or version == current:
+                ret[version] = self._rootObj
+        if len(ret) == len(versions):
+            return ret
+        cache = self._getCached('backMigrations', dict)
+        missing = set()
+        for version in versions:
+            if version in ret:
+                continue
+            if version in cache:
+                ret[version] = cache[version]
+            else:
+                missing.add(version)
+        if not missing:
+            return ret
+        # The chain is linear, so the path from the oldest version goes
+        # through all the others
+        migr = max((MigrationManager(x) for x in missing),
+            key = lambda x: len(x.path))
+        # Start from the oldest migrated tree that is still newer than all
+        # the missing versions
+        fromVersion = current
+        for version in reversed(migr.path):
+            if version in missing:
+                break
+            if version in cache:
+                fromVersion = version
+        trees = migr.migrateBackVersions(cache.get(fromVersion, self._rootObj),
+            missing, fromVersion = fromVersion)
+        cache.update(trees)
+        ret.update(trees)
+        return ret
+
+    def _serializeRoot(self, stream, rootObj, validate, canonical = False):
+        tree = self._getElementTree(rootObj, validate)
+        if canonical:
+            self._canonicalize(tree)
+            tree.write_c14n(stream)
+            return
+        tree.write(stream, encoding = 'UTF-8', pretty_print = True,
+            xml_declaration = True)
+
+    def _getElementTree(self, rootObj, validate):
         attrs = [
             ('xmlns', self.defaultNamespace),
             ('xmlns:xsi', _xmlConstants.xmlSchemaNamespace),
             ("xsi:schemaLocation", self.xmlSchemaLocation),
         ]
         namespacedef = ' '.join('%s="%s"' % a for a in attrs)
-
-        if version is None or version == self._rootObj.get_version():
-            rootObj = self._rootObj
-        else:
-            migr = MigrationManager(version)
-            rootObj = migr.migrateBack(self._rootObj)
+        version = rootObj.get_version()
+        if version != BaseDefinition.version:
             # We should probably do a smarter job than simple string
             # replacement here
             namespacedef = namespacedef.replace(
-                "rpd-%s" % self.version, "rpd-%s" % version)
+                "rpd-%s" % BaseDefinition.version, "rpd-%s" % version)
 
         # Write to a temporary file. We are paranoid and want to verify that
         # the output we produce doesn't break lxml
         bsio = util.BoundedStringIO()
         rootObj.export(bsio, 0, namespace_ = '', name_ = self.RootNode,
             namespacedef_ = namespacedef)
+        span = tracer.current()
+        if span:
+            span.setAttribute('schemaVersion', rootObj.get_version())
+            span.setAttribute('size', bsio.tell())
         bsio.seek(0)
         if validate and os.path.exists(self.schemaDir):
             tree = self.validate(bsio, self.schemaDir, rootObj.get_version())
@@ -250,8 +796,168 @@ class BaseDefinition(object):
             tree = etree.parse(bsio)
         else:
             tree = etree.parse(bsio)
-        tree.write(stream, encoding = 'UTF-8', pretty_print = True,
-            xml_declaration = True)
+        return tree
+
+    # Collections whose items are de-duplicated on these keys when they are
+    # added (see _addCollection); the order of their items does not matter.
+    # container element -> (item element, key attributes)
+    _keyedCollections = {
+        'architectures' : ('architecture', ('name', )),
+        'flavorSets' : ('flavorSet', ('name', )),
+        'containerTemplates' : ('image', ('containerFormat', )),
+        'buildTemplates' : ('buildTemplate',
+            ('architectureRef', 'containerTemplateRef', 'flavorSetRef')),
+        'partitionSchemes' : ('partitionScheme', ('id', )),
+    }
+
+    @classmethod
+    def _canonicalize(cls, tree):
+        """
+        Remove the whitespace between elements of an lxml tree, and sort the
+        items of the keyed collections, in place.
+        """
+        containers = []
+        for node in tree.getroot().iter(tag = etree.Element):
+            if len(node):
+                if node.text is not None and not node.text.strip():
+                    node.text = None
+                if etree.QName(node).localname in cls._keyedCollections:
+                    containers.append(node)
+            if node.tail is not None and not node.tail.strip():
+                node.tail = None
+        for node in containers:
+            itemName, keys = cls._keyedCollections[etree.QName(node).localname]
+            items = list(node)
+            if len(items) < 2 or [ x for x in items
+                    if etree.QName(x).localname != itemName ]:
+                continue
+            # Items with the same key (in definitions not built through the
+            # add methods) are ordered by their contents
+            items.sort(key = lambda x: (tuple(x.get(k, '') for k in keys),
+                etree.tostring(x, method = 'c14n')))
+            node[:] = items
+
+    @classmethod
+    def _canonicalDigest(cls, data):
+        """
+        @return: the digest of the canonical form of the serialized
+        definition C{data}, or C{None} if it is not well-formed XML
+        """
+        try:
+            tree = etree.parse(StringIO.StringIO(data))
+        except etree.XMLSyntaxError:
+            return None
+        cls._canonicalize(tree)
+        digester = DigesterMd5FLO()
+        tree.write_c14n(digester)
+        return digester.hexdigest()
+
+    def toDict(self, version = None):
+        """
+        Convert the current object to plain Python structures, without
+        going through XML. Objects become dictionaries keyed by the names
+        of the generated fields; fields that are not set are omitted.
+        @param version: An optional schema version to convert to
+        @type version: C{str}
+        @return: the definition as a dictionary
+        @rtype: C{dict}
+        """
+        self._checkFullyLoaded()
+        rootObj = self._rootObj
+        if self.Versioned:
+            rootObj = self._getMigratedBack([ version ])[version]
+        return self._objectToDict(rootObj)
+
+    @classmethod
+    def fromDict(cls, data, version = None):
+        """
+        Create an object from the output of C{toDict}. The data is migrated
+        from the version it declares to the current schema version.
+        @param data: The definition as a dictionary
+        @type data: C{dict}
+        @param version: Schema version of the data, if it does not declare
+        one
+        @type version: C{str}
+        @rtype: same class as C{cls}
+        """
+        obj = cls()
+        if cls.Versioned:
+            version = data.get('version', version) or obj.version
+        else:
+            version = version or obj.version
+        obj._preMigrateVersion = version
+        module = cls.loadModule(version)
+        factory = getattr(module, obj.ClassFactoryName)
+        rootObj = cls._objectFromDict(factory, data, module.supermod)
+        if version != obj.version:
+            rootObj = MigrationManager(version).migrateForward(rootObj)
+        obj._rootObj = rootObj
+        obj._postinit()
+        obj._markUnmodified()
+        return obj
+
+    @classmethod
+    def _objectToDict(cls, obj):
+        ret = {}
+        for spec in obj.member_data_items_:
+            val = getattr(obj, spec.name)
+            if val is None or val == [] or (
+                    spec.name == 'valueOf_' and val == ''):
+                continue
+            if spec.container:
+                val = [ cls._valueToDict(x) for x in val ]
+            else:
+                val = cls._valueToDict(val)
+            ret[spec.name] = val
+        return ret
+
+    @classmethod
+    def _valueToDict(cls, val):
+        if hasattr(val, 'member_data_items_'):
+            return cls._objectToDict(val)
+        return val
+
+    # Maps generated classes to {field name: (member spec, field class)}
+    _memberSpecCache = {}
+
+    @classmethod
+    def _getMemberSpecs(cls, objClass, supermod):
+        specs = cls._memberSpecCache.get(objClass)
+        if specs is not None:
+            return specs
+        specs = {}
+        for spec in objClass.member_data_items_:
+            # Simple types are not classes in the generated module
+            fieldClass = getattr(supermod, spec.get_data_type(), None)
+            if not (isinstance(fieldClass, type) and
+                    hasattr(fieldClass, 'member_data_items_')):
+                fieldClass = None
+            specs[spec.name] = (spec, fieldClass)
+        cls._memberSpecCache[objClass] = specs
+        return specs
+
+    @classmethod
+    def _objectFromDict(cls, objClass, data, supermod):
+        if not isinstance(data, dict):
+            raise ProductDefinitionError("Expected a dictionary for %s" %
+                objClass.__name__)
+        specs = cls._getMemberSpecs(objClass, supermod)
+        obj = objClass.factory()
+        for name, val in data.iteritems():
+            if name not in specs:
+                raise ProductDefinitionError("Unknown field %s for %s" %
+                    (name, objClass.__name__))
+            spec, fieldClass = specs[name]
+            if fieldClass is not None:
+                if spec.container:
+                    val = [ cls._objectFromDict(fieldClass, x, supermod)
+                        for x in val ]
+                else:
+                    val = cls._objectFromDict(fieldClass, val, supermod)
+            elif spec.container:
+                val = list(val)
+            setattr(obj, name, val)
+        return obj
 
     def getBaseFlavor(self):
         """
@@ -276,7 +982,7 @@ class BaseDefinition(object):
         @rtype: C{list} of C{_SearchPath} objects
         """
 
-        sp = self._rootObj.get_searchPaths()
+        sp = self._getSection('searchPaths')
         if sp is None:
             return []
         return sp.get_searchPath()
@@ -329,7 +1035,7 @@ class BaseDefinition(object):
         @return: Information about the originating platform.
         @rtype: C{platformInformationType}
         """
-        return self._rootObj.platformInformation
+        return self._getSection('platformInformation')
 
     def setPlatformInformation(self, info):
         """
@@ -343,7 +1049,7 @@ class BaseDefinition(object):
         @return: the factory sources from this product definition
         @rtype: C{list} of C{_FactorySource} objects
         """
-        fs = self._rootObj.get_factorySources()
+        fs = self._getSection('factorySources')
         if fs is None:
             return []
         return fs.get_factorySource()
@@ -416,7 +1122,7 @@ class BaseDefinition(object):
         @param version: Version for the factory source
         @param version: C{str} or C{None}
         """
-        sp = self._rootObj.get_factorySources()
+        sp = self._getWritableNode('factorySources')
         xmlsubs = self.xmlFactory()
         if sp is None:
             sp = xmlsubs.factorySourceListTypeSub.factory()
@@ -429,7 +1135,7 @@ class BaseDefinition(object):
         @return: all defined architectures for both proddef and platform
         @rtype: C{list}
         """
-        vals = self._rootObj.get_architectures()
+        vals = self._getSection('architectures')
         if vals is None:
             return []
         return vals.get_architecture()
@@ -506,7 +1212,7 @@ class BaseDefinition(object):
         @return: all defined flavor sets
         @rtype: C{list} of FlavorSet objects
         """
-        fsets = self._rootObj.get_flavorSets()
+        fsets = self._getSection('flavorSets')
         if fsets is None:
             return []
         return fsets.get_flavorSet()
@@ -577,7 +1283,7 @@ class BaseDefinition(object):
         @return: all defined container templates
         @rtype: C{list} of ContainerTemplate objects
         """
-        vals = self._rootObj.get_containerTemplates()
+        vals = self._getSection('containerTemplates')
         if vals is None:
             return []
         return vals.get_image()
@@ -646,12 +1352,13 @@ class BaseDefinition(object):
         return self.getPartitionSchemes()
 
     def getPartitionSchemes(self):
-        container = self._rootObj.get_partitionSchemes()
+        container = self._getSection('partitionSchemes')
         if container:
             return container.get_partitionScheme() or []
         else:
             return []
 
+    @_invalidatesCache
     def addPartitionSchemes(self, schemes):
         return self._extendCollection(schemes, 'partitionScheme', ['id'])
 
@@ -660,7 +1367,7 @@ class BaseDefinition(object):
         @return: all defined build templates
         @rtype: C{list} of BuildTemplate objects
         """
-        vals = self._rootObj.get_buildTemplates()
+        vals = self._getSection('buildTemplates')
         if vals is None:
             return []
         return vals.get_buildTemplate()
@@ -738,7 +1445,7 @@ class BaseDefinition(object):
         @return: the stages from this product definition
         @rtype: C{list} of C{_Stage} objects
         """
-        stages = self._rootObj.get_stages()
+        stages = self._getSection('stages')
         if stages is None:
             return []
         return stages.get_stage()
@@ -758,6 +1465,7 @@ class BaseDefinition(object):
                 return stage
         raise StageNotFoundError(stageName)
 
+    @_invalidatesCache
     def addStage(self, name = None, labelSuffix = None, promoteMaps = None):
         """
         Add a stage.
@@ -783,6 +1491,7 @@ class BaseDefinition(object):
             name = name, labelSuffix = labelSuffix,
             promoteMaps = nvals))
 
+    @_invalidatesCache
     def clearStages(self):
         """
         Delete all stages.
@@ -791,6 +1500,7 @@ class BaseDefinition(object):
         """
         self._rootObj.set_stages(None)
 
+    @_invalidatesCache
     def addDefaultStages(self):
         # Starting with schema 4.5, we may have older platforms present,
         # so stages may be missing
@@ -863,12 +1573,24 @@ class BaseDefinition(object):
         return verstr.split('/', 1)[0]
 
     def _getSearchPathsNode(self):
-        sp = self._rootObj.get_searchPaths()
+        sp = self._getWritableNode('searchPaths')
         if sp is None:
             sp = self.xmlFactory().searchPathListTypeSub.factory()
             self._rootObj.set_searchPaths(sp)
         return sp
 
+    def _getWritableNode(self, field):
+        """
+        @return: the node for C{field}, replaced with a private copy first
+        if it is shared with other definitions
+        """
+        node = getattr(self._rootObj, 'get_' + field)()
+        if node is not None and interning.isShared(node):
+            # A deep copy: the items of the lists are shared as well
+            node = copy.deepcopy(node)
+            getattr(self._rootObj, 'set_' + field)(node)
+        return node
+
     def _addSource(self, troveName, label, version, factory, addMethod, **kwargs):
         "Internal function for adding a Source"
         if label is not None:
@@ -880,97 +1602,212 @@ class BaseDefinition(object):
         return obj
 
     def _getTroveContents(self, repos, trvTup):
-        pathDict = {}
-        csSpec = [ (trvTup[0], (None, None), (trvTup[1], trvTup[2]), True) ]
+        contents = self._getTrovesContents(repos, [ trvTup ])
+        return contents.get((trvTup[0], trvTup[1]), {})
+
+    @classmethod
+    def _getTrovesContents(cls, repos, trvTups):
+        """
+        Fetch the regular files from several troves, with one changeset.
+        @return: dictionary mapping (name, version) to path dictionaries
+        @rtype: C{dict}
+        """
+        ret = {}
+        if not trvTups:
+            return ret
+        csSpec = [ (x[0], (None, None), (x[1], x[2]), True) for x in trvTups ]
+        metrics.repositoryCalls.inc(method = 'createChangeSet')
         cs = repos.createChangeSet(csSpec, withFileContents = True)
         fileSpecs = []
         for trvCs in cs.iterNewTroveList():
-            fileSpecs.extend(f for f in trvCs.getNewFileList())
+            n, v, _ = trvCs.getNewNameVersionFlavor()
+            ret[(n, v)] = {}
+            fileSpecs.extend(x + ((n, v), ) for x in trvCs.getNewFileList())
         # Sort by path id, otherwise grabbing file contents may break
-        fileSpecs.sort(key = lambda x: x[0])
+        fileSpecs.sort(key = lambda x: (x[0], x[2]))
         fileContents =  [ cs.getFileContents(f[0], f[2])[1].get()
             for f in fileSpecs ]
-        for (pathId, path, fileId, fileVersion), fileConts in zip(
+        for (pathId, path, fileId, fileVersion, key), fileConts in zip(
                 fileSpecs, fileContents):
             fileStream = cs.getFileChange(None, fileId)
             fileObj = changeset.files.ThawFile(fileStream, pathId)
             # Only preserve regular files for now
             if not isinstance(fileObj, changeset.files.RegularFile):
                 continue
-            pathDict[path] = filetypes.RegularFile(
+            ret[key][path] = filetypes.RegularFile(
                 contents = fileConts, config = fileObj.flags.isConfig())
-        return pathDict
+        return ret
 
+    @classmethod
+    def _getTrovesFileIds(cls, repos, trvTups):
+        """
+        Fetch the file ids from several troves, without the file contents.
+        @return: dictionary mapping (name, version) to dictionaries of
+        path to file id
+        @rtype: C{dict}
+        """
+        ret = {}
+        if not trvTups:
+            return ret
+        csSpec = [ (x[0], (None, None), (x[1], x[2]), True) for x in trvTups ]
+        metrics.repositoryCalls.inc(method = 'createChangeSet')
+        cs = repos.createChangeSet(csSpec, withFiles = True,
+            withFileContents = False)
+        for trvCs in cs.iterNewTroveList():
+            n, v, _ = trvCs.getNewNameVersionFlavor()
+            ret[(n, v)] = dict((x[1], x[2]) for x in trvCs.getNewFileList())
+        return ret
+
+    def _getSourceFileContents(self, version, extraVersions = ()):
+        """
+        @param extraVersions: Other schema versions to write, each to
+        C{<trove name>-<version>.xml}
+        @type extraVersions: C{list}
+        @return: dictionary mapping the paths this object manages in its
+        source trove to their contents
+        @rtype: C{dict}
+        """
+        recipe = self._recipe.replace('@NAME@', self._troveName)
+        recipe = recipe.replace('@VERSION@', version)
+
+        streams = dict((x, StringIO.StringIO())
+            for x in [ version ] + list(extraVersions))
+        self.serializeVersions(streams)
+        ret = {
+            "%s.recipe" % self._troveName : recipe,
+        }
+        for schemaVersion in extraVersions:
+            ret["%s-%s.xml" % (self._troveName, schemaVersion)] = \
+                streams[schemaVersion].getvalue()
+        ret[self._troveFileNames[0]] = streams[version].getvalue()
+        return ret
+
+    @classmethod
+    def _createSourceChangeSet(cls, conaryClient, troveName, label, version,
+            pathDict, message):
+        cLog = changelog.ChangeLog(name = conaryClient.cfg.name,
+                                   contact = conaryClient.cfg.contact,
+                                   message = message)
+        metrics.repositoryCalls.inc(method = 'createSourceTrove')
+        return conaryClient.createSourceTrove('%s:source' % troveName,
+            str(label), version, pathDict, cLog)
+
+    @classmethod
+    def _signSourceTroves(cls, cfg, cs):
+        """
+        If there is a key for the label of a trove in the conary
+        configuration, sign the source trove (RPCL-68). Troves are grouped
+        by fingerprint, so each key is only selected once.
+        """
+        byFingerprint = {}
+        for trvCs in [ x for x in cs.iterNewTroveList() ]:
+            label = trvCs.getNewVersion().trailingLabel()
+            fingerprint = conarycfg.selectSignatureKey(cfg, str(label))
+            if fingerprint:
+                byFingerprint.setdefault(fingerprint, []).append(trvCs)
+        for fingerprint, trvCsList in sorted(byFingerprint.items()):
+            for trvCs in trvCsList:
+                trv = trove.Trove(trvCs)
+                trv.addDigitalSignature(fingerprint)
+                newTrvCs = trv.diff(None, absolute = 1)[0]
+                cs.newTrove(newTrvCs)
+
+    @metrics.operationSeconds.time(operation = 'save')
+    @_traced('saveToRepository')
     def _saveToRepository(self, conaryClient, label, message = None,
-                          version = None):
+                          version = None, extraVersions = ()):
         if message is None:
             message = "Automatic checkin\n"
         if version is None:
-            version = self.__class__.version
+            version = self.version
+        generation = self._rootObj.getGeneration_()
 
         repos = conaryClient.getRepos()
+        span = tracer.current()
+        span.setAttribute('label', str(label))
+        span.setAttribute('schemaVersion', version)
+        span.setAttribute('committed', False)
 
         # Get the previous version of the trove
         oldPaths = {}
         trvTup = self._getTroveTupFromRepository(conaryClient, str(label),
             allowMissing = True)
+        span.increment('roundTrips')
         if trvTup:
             oldPaths.update(self._getTroveContents(repos, trvTup))
+            span.increment('roundTrips')
 
-        recipe = self._recipe.replace('@NAME@', self._troveName)
-        recipe = recipe.replace('@VERSION@', version)
-
-        stream = StringIO.StringIO()
-        self.serialize(stream, version = version)
         newPaths = oldPaths.copy()
-        newPaths.update({
-            "%s.recipe" % self._troveName : filetypes.RegularFile(
-                contents = recipe, config=True),
-            self._troveFileNames[0] : filetypes.RegularFile(
-                contents = stream.getvalue(), config=True),
-        })
+        newContents = self._getSourceFileContents(version, extraVersions)
+        for path, contents in newContents.items():
+            newPaths[path] = filetypes.RegularFile(contents = contents,
+                config = True)
         oldIds = dict((path, helper.get(None).fileId())
                 for (path, helper) in oldPaths.items())
         newIds = dict((path, helper.get(None).fileId())
                 for (path, helper) in newPaths.items())
-        if oldIds == newIds:
+        if oldIds == newIds or self._sameCanonicalContents(oldPaths,
+                newContents, oldIds, newIds):
             # No files changed
+            self._markUnmodified(generation)
             return
 
-        cLog = changelog.ChangeLog(name = conaryClient.cfg.name,
-                                   contact = conaryClient.cfg.contact,
-                                   message = message)
-        troveName = '%s:source' % self._troveName
-        cs = conaryClient.createSourceTrove(troveName, str(label),
-            version, newPaths, cLog)
-
-        # If there is a key for this label in the conary configuration, sign
-        # the source trove (RPCL-68)
-        fingerprint = conarycfg.selectSignatureKey(conaryClient.cfg, label)
-        if fingerprint:
-            for trvCs in [ x for x in cs.iterNewTroveList() ]:
-                trv = trove.Trove(trvCs)
-                trv.addDigitalSignature(fingerprint)
-                newTrvCs = trv.diff(None, absolute = 1)[0]
-                cs.newTrove(newTrvCs)
-
+        cs = self._createSourceChangeSet(conaryClient, self._troveName,
+            label, version, newPaths, message)
+        self._signSourceTroves(conaryClient.cfg, cs)
+        metrics.repositoryCalls.inc(method = 'commitChangeSet')
         repos.commitChangeSet(cs)
+        # Creating the source trove queries the repository as well
+        span.increment('roundTrips', 2)
+        span.setAttribute('committed', True)
+        self._markUnmodified(generation)
+
+    @classmethod
+    def _sameCanonicalContents(cls, oldPaths, newContents, oldIds, newIds):
+        """
+        Check whether the files that changed are all serialized definitions
+        with the same canonical form as their previous contents; they were
+        written with a different formatting, or order of collection items.
+        """
+        if set(oldIds) != set(newIds):
+            return False
+        changed = [ x for x in newIds if newIds[x] != oldIds[x] ]
+        for path in changed:
+            if not path.endswith('.xml'):
+                return False
+            fobj = oldPaths[path].getContents().get()
+            if hasattr(fobj, 'seek'):
+                fobj.seek(0)
+            oldContents = fobj.read()
+            newDigest = cls._canonicalDigest(newContents[path])
+            if newDigest is None or (
+                    newDigest != cls._canonicalDigest(oldContents)):
+                return False
+        return True
 
     def _getTroveTupFromRepository(self, conaryClient, label,
-            allowMissing = True):
+            allowMissing = True, queryExecutor = None):
         repos = conaryClient.getRepos()
         troveName = '%s:source' % self._troveName
         troveSpec = (troveName, label, None)
-        ret = repos.findTroves(None, [ troveSpec ], allowMissing = True)
+        if queryExecutor is None:
+            metrics.repositoryCalls.inc(method = 'findTroves')
+            ret = repos.findTroves(None, [ troveSpec ], allowMissing = True)
+        else:
+            ret = queryExecutor.findTroves(repos, [ troveSpec ],
+                allowMissing = True)
         if troveSpec not in ret:
             if allowMissing:
                 return None
             raise ProductDefinitionTroveNotFoundError("%s=%s" % (troveName, label))
         return ret[troveSpec][0]
 
+    @_traced('getStreamFromRepository')
     def _getStreamFromRepository(self, conaryClient, label, schemaVersion,
-            sourceTrove):
+            sourceTrove, queryExecutor = None):
         repos = conaryClient.getRepos()
+        span = tracer.current()
+        span.setAttribute('label', label)
         if sourceTrove:
             name = '%s:source' % self._troveName
             version = conaryVersions.VersionFromString(
@@ -979,9 +1816,11 @@ class BaseDefinition(object):
         else:
             try:
                 trvTup = self._getTroveTupFromRepository(conaryClient, label,
-                    allowMissing = False)
+                    allowMissing = False, queryExecutor = queryExecutor)
             except conaryErrors.RepositoryError, e:
                 raise RepositoryError(str(e)), None, sys.exc_info()[2]
+            finally:
+                span.increment('roundTrips')
 
         troveFileNames = self._troveFileNames
         if schemaVersion:
@@ -993,10 +1832,31 @@ class BaseDefinition(object):
                 troveFileNames = troveFileNames[i:]
                 break
         n,v,f = trvTup
+        if hasattr(repos, 'getFileContentsFromTrove') and \
+                queryExecutor is not None and len(troveFileNames) > 1:
+            # Probe all candidate file names at once, and keep the highest
+            # ranked one that exists in the trove
+            def probe(troveFileName):
+                try:
+                    metrics.repositoryCalls.inc(
+                        method = 'getFileContentsFromTrove')
+                    return repos.getFileContentsFromTrove(n, v, f,
+                        [troveFileName])[0]
+                except repositoryErrors.PathsNotFound:
+                    return None
+            results = queryExecutor.map(probe, troveFileNames)
+            span.increment('roundTrips', len(troveFileNames))
+            for contents in results:
+                if contents is not None:
+                    return contents.get(), (n,v,f)
+            raise ProductDefinitionFileNotFoundError()
         if hasattr(repos, 'getFileContentsFromTrove'):
             contents = None
             for troveFileName in troveFileNames:
+                span.increment('roundTrips')
                 try:
+                    metrics.repositoryCalls.inc(
+                        method = 'getFileContentsFromTrove')
                     contents = repos.getFileContentsFromTrove(n,v,f,
                                                   [troveFileName])[0]
                     break
@@ -1007,8 +1867,10 @@ class BaseDefinition(object):
             return contents.get(), (n,v,f)
 
         trvCsSpec = (n, (None, None), (v, f), True)
+        metrics.repositoryCalls.inc(method = 'createChangeSet')
         cs = conaryClient.createChangeSet([ trvCsSpec ], withFiles = True,
                                           withFileContents = True)
+        span.increment('roundTrips')
         troveFileNameMap = dict((x, i)
             for (i, x) in enumerate(troveFileNames))
         for thawTrvCs in cs.iterNewTroveList():
@@ -1022,7 +1884,9 @@ class BaseDefinition(object):
 
             # Fetch file from changeset
             fileSpecs = [ (fileId, fileVer) ]
+            metrics.repositoryCalls.inc(method = 'getFileContents')
             fileContents = repos.getFileContents(fileSpecs)
+            span.increment('roundTrips')
             return fileContents[0].get(), thawTrvCs.getNewNameVersionFlavor()
 
         # Couldn't find the file we expected; die
@@ -1041,10 +1905,77 @@ class BaseDefinition(object):
             self._rootObj.set_version(self.version)
         self._preMigrateVersion = None
         self._sourceTrove = None
+        self._cache = {}
+        # XML and parse options, if only some sections were loaded
+        self._projection = None
+        self._markUnmodified()
 
     def _postinit(self):
         pass
 
+    def isModified(self):
+        """
+        @return: True if the definition was modified since it was loaded,
+        created or last saved to a repository
+        @rtype: C{bool}
+        """
+        return self._rootObj.isModified_()
+
+    def _markUnmodified(self, generation = None):
+        self._rootObj.markUnmodified_(generation)
+
+    def invalidateCache(self):
+        """
+        Drop the cached views derived from this definition. Changes to the
+        generated objects are detected, but not changes to the attributes
+        set on them by C{_postinit}.
+        """
+        self._cache.clear()
+
+    def _getCached(self, key, compute):
+        generation = self._rootObj.getGeneration_()
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] == generation:
+            metrics.cacheRequests.inc(cache = key, result = 'hit')
+            return entry[1]
+        metrics.cacheRequests.inc(cache = key, result = 'miss')
+        val = compute()
+        self._cache[key] = (generation, val)
+        return val
+
+    # Attributes saved when pickling
+    _pickleFields = ('_rootObj', '_preMigrateVersion', '_sourceTrove',
+        '_validate')
+    # Attributes saved when pickling, only if set on the instance
+    _pickleOverrides = ('version', 'schemaDir')
+
+    def __getstate__(self):
+        self._checkFullyLoaded()
+        state = tuple(getattr(self, x, None) for x in self._pickleFields)
+        overrides = dict((x, self.__dict__[x]) for x in self._pickleOverrides
+            if x in self.__dict__)
+        if overrides:
+            state += (overrides, )
+        return state
+
+    def __setstate__(self, state):
+        for name, val in zip(self._pickleFields, state):
+            setattr(self, name, val)
+        if len(state) > len(self._pickleFields):
+            self.__dict__.update(state[-1])
+        self._cache = {}
+        self._projection = None
+        self._postsetstate()
+        self._markUnmodified()
+
+    def _postsetstate(self):
+        """
+        Rebuild the attributes derived from the root object after
+        unpickling. Unlike C{_postinit}, this must not modify the root
+        object.
+        """
+        pass
+
     def _setDefault(self, field, factory):
         getter = getattr(self._rootObj, 'get_%s' % field)
         vals = getter()
@@ -1122,10 +2053,31 @@ class ProductDefinition(BaseDefinition):
     @type xmlSchemaLocation: C{str}
     @cvar schemaDir: Directory where schema definitions are stored
     @type schemaDir: C{str}
+    @cvar internPlatforms: Share identical platform subtrees between the
+    loaded definitions, through C{interning.platformInterner}. The shared
+    objects cannot be modified directly, only through the methods of the
+    definitions; off by default.
+    @type internPlatforms: C{bool}
     """
     ClassFactoryName = 'productDefinitionSub'
     RootNode = 'productDefinition'
 
+    # The platform gets the default platform content only if the product
+    # has no architectures, flavor sets, container or build templates, and
+    # loses the partition schemes the product overrides; the flavors and
+    # container template fields of the builds come from the product and
+    # its platform
+    _sectionDependencies = {
+        'platform' : [ 'architectures', 'flavorSets', 'containerTemplates',
+            'buildTemplates', 'partitionSchemes' ],
+        'buildDefinition' : [ 'architectures', 'flavorSets',
+            'containerTemplates', 'platform' ],
+    }
+
+    internPlatforms = False
+    _internedPlatformFields = [ 'searchPaths', 'factorySources',
+        'architectures', 'flavorSets', 'containerTemplates', 'buildTemplates' ]
+
     _troveName = 'product-definition'
     _troveFileNames = [
         'product-definition.xml',
@@ -1188,7 +2140,9 @@ class ProductDefinitionRecipe(PackageRecipe):
         return self._saveToRepository(client, label, message = message,
             version = version)
 
-    def loadFromRepository(self, client, sourceTrove=None):
+    @metrics.operationSeconds.time(operation = 'load')
+    def loadFromRepository(self, client, sourceTrove=None,
+            queryExecutor=None):
         """
         Load a C{ProductDefinition} object from a Conary repository.
         Prior to calling this method, the C{ProductDefinition} object should
@@ -1199,15 +2153,19 @@ class ProductDefinitionRecipe(PackageRecipe):
         @type client: C{conaryclient.ConaryClient}
         @param sourceTrove: An optional 'name=version' to load
         @type  sourceTrove: str
+        @param queryExecutor: An optional executor used to run the
+        repository queries concurrently
+        @type queryExecutor: C{RepositoryQueryExecutor}
         @raises C{RepositoryError}:
         @raises C{ProductDefinitionTroveNotFoundError}:
         @raises C{ProductDefinitionFileNotFoundError}:
         """
         label = self.getProductDefinitionLabel()
         stream, nvf = self._getStreamFromRepository(client, label, None,
-                sourceTrove)
+                sourceTrove, queryExecutor = queryExecutor)
         stream.seek(0)
         self.parseStream(stream)
+        metrics.downloadedBytes.inc(self._getStreamSize(stream) or 0)
         self._sourceTrove = "%s=%s" % (self._troveName, nvf[1])
         return nvf
 
@@ -1248,6 +2206,7 @@ class ProductDefinitionRecipe(PackageRecipe):
         """
         return self._rootObj.get_productShortname()
 
+    @_invalidatesCache
     def setProductShortname(self, productShortname):
         """
         @param productShortname: the product's shortname
@@ -1262,6 +2221,7 @@ class ProductDefinitionRecipe(PackageRecipe):
         """
         return self._rootObj.get_productVersion()
 
+    @_invalidatesCache
     def setProductVersion(self, productVersion):
         """
         Set the product version
@@ -1292,6 +2252,7 @@ class ProductDefinitionRecipe(PackageRecipe):
         """
         return self._rootObj.get_conaryRepositoryHostname()
 
+    @_invalidatesCache
     def setConaryRepositoryHostname(self, conaryRepositoryHostname):
         """
         Set the Conary repository hostname
@@ -1308,6 +2269,7 @@ class ProductDefinitionRecipe(PackageRecipe):
         """
         return self._rootObj.get_conaryNamespace()
 
+    @_invalidatesCache
     def setConaryNamespace(self, conaryNamespace):
         """
         Set the Conary namespace
@@ -1323,6 +2285,7 @@ class ProductDefinitionRecipe(PackageRecipe):
         """
         return self._rootObj.get_sourceGroup()
 
+    @_invalidatesCache
     def setSourceGroup(self, sourceGroup):
         """
         Set the source group name
@@ -1339,6 +2302,7 @@ class ProductDefinitionRecipe(PackageRecipe):
         # XXX Old code relied on the image group being None, not empty string
         return self._rootObj.get_imageGroup() or None
 
+    @_invalidatesCache
     def setImageGroup(self, imageGroup):
         """
         Set the image group name
@@ -1440,38 +2404,71 @@ class ProductDefinitionRecipe(PackageRecipe):
             on C{toStage}
         @rtype: C{dict}
         """
-        fromStageObj = self.getStage(fromStage)
-        toStageObj = self.getStage(toStage)
-        toStageBranch = '/' + self._getLabelForStage(toStageObj)
+        # Raise StageNotFoundError for unknown stages
+        self.getStage(fromStage)
+        self.getStage(toStage)
+        entry = self._getCached('promoteMapMatrix',
+            self._computePromoteMapMatrix)[(fromStage, toStage)]
+        return self._flattenPromoteMap(entry, flattenLabels)
+
+    def promoteMapMatrix(self, flattenLabels=()):
+        """
+        Construct the promote maps for all pairs of stages, as
+        L{getPromoteMapsForStages} does for one pair. The maps are computed
+        once and cached until the stages, secondary labels or label
+        components change.
 
-        # Flattened labels - these come first so proddef-supplied maps 
-        # will override them.
-        fromTo = dict.fromkeys(flattenLabels, toStageBranch)
+        @param flattenLabels: Extra labels to "flatten" by promoting to the
+                              target label.
+        @type  flattenLabels: C{sequence or set}
+        @return: dictionary mapping C{(fromStage, toStage)} stage name
+            pairs to promote maps
+        @rtype: C{dict}
+        """
+        matrix = self._getCached('promoteMapMatrix',
+            self._computePromoteMapMatrix)
+        return dict((key, self._flattenPromoteMap(entry, flattenLabels))
+            for (key, entry) in matrix.iteritems())
 
-        # Primary label
-        fromTo[self._getLabelForStage(fromStageObj)] = toStageBranch
+    @classmethod
+    def _flattenPromoteMap(cls, entry, flattenLabels):
+        toStageBranch, fromTo = entry
+        # Flattened labels come first so proddef-supplied maps will
+        # override them
+        ret = dict.fromkeys(flattenLabels, toStageBranch)
+        ret.update(fromTo)
+        return ret
 
-        # Secondary labels
-        secondaryLabels = self.getSecondaryLabels()
-        if secondaryLabels:
-            fromSuffix = fromStageObj.labelSuffix
-            toSuffix = toStageObj.labelSuffix
-            for secondaryLabel in secondaryLabels:
-                label = secondaryLabel.getLabel()
-                fromLabel = self._getSecondaryLabel(label, fromSuffix)
-                toLabel = self._getSecondaryLabel(label, toSuffix)
-                fromTo[fromLabel] = '/' + toLabel
-
-        # Promote maps
-        promoteMapsDest = dict((x.getMapName(), x.getMapLabel())
-            for x in toStageObj.getPromoteMaps())
-        for pm in fromStageObj.getPromoteMaps():
-            mapName = pm.getMapName()
-            if mapName not in promoteMapsDest:
+    def _computePromoteMapMatrix(self):
+        secondaryLabels = [ x.getLabel()
+            for x in (self.getSecondaryLabels() or []) ]
+        stages = []
+        seen = set()
+        for stageObj in self.getStages():
+            # getStage returns the first stage with a given name
+            if stageObj.name in seen:
                 continue
-            fromTo[pm.getMapLabel()] = promoteMapsDest[mapName]
-
-        return fromTo
+            seen.add(stageObj.name)
+            suffix = stageObj.labelSuffix or ''
+            labels = [ self._getLabelForStage(stageObj) ] + [
+                self._getSecondaryLabel(x, suffix) for x in secondaryLabels ]
+            promoteMaps = [ (x.getMapName(), x.getMapLabel())
+                for x in stageObj.getPromoteMaps() ]
+            stages.append((stageObj.name, labels, promoteMaps))
+
+        matrix = {}
+        for fromName, fromLabels, fromMaps in stages:
+            for toName, toLabels, toMaps in stages:
+                # Primary label, then secondary labels
+                fromTo = dict((x, '/' + y)
+                    for (x, y) in zip(fromLabels, toLabels))
+                # Promote maps
+                promoteMapsDest = dict(toMaps)
+                for mapName, mapLabel in fromMaps:
+                    if mapName in promoteMapsDest:
+                        fromTo[mapLabel] = promoteMapsDest[mapName]
+                matrix[(fromName, toName)] = ('/' + toLabels[0], fromTo)
+        return matrix
 
     def getSearchPaths(self):
         """
@@ -1558,8 +2555,9 @@ class ProductDefinitionRecipe(PackageRecipe):
         @return: Information about the originating platform.
         @rtype: C{platformInformationType}
         """
-        if self._rootObj.platformInformation:
-            return self._rootObj.platformInformation
+        info = self._getSection('platformInformation')
+        if info:
+            return info
         elif self.platform:
             return self.platform.getPlatformInformation()
 
@@ -1568,13 +2566,14 @@ class ProductDefinitionRecipe(PackageRecipe):
         @return: The build definitions from this product definition
         @rtype: C{list} of C{Build} objects
         """
-        bd = self._rootObj.get_buildDefinition()
+        bd = self._getSection('buildDefinition')
         if bd is None:
             return []
         return bd.get_build()
 
     buildDefinition = property(getBuildDefinitions)
 
+    @_invalidatesCache
     def addBuildDefinition(self, name = None, image = None, stages = None,
                            imageGroup = None, systemModelItems=None,
                            sourceGroup = None,
@@ -1663,6 +2662,7 @@ class ProductDefinitionRecipe(PackageRecipe):
         bdef.add_build(obj)
         return obj
 
+    @_invalidatesCache
     def clearBuildDefinition(self):
         """
         Delete all buildDefinition.
@@ -2003,6 +3003,7 @@ class ProductDefinitionRecipe(PackageRecipe):
         return itertools.chain(self.getBuildTemplates(),
                                self.getPlatformBuildTemplates())
 
+    @_invalidatesCache
     def addSecondaryLabel(self, name, label):
         """
         Add a secondary label to the product definition.
@@ -2023,11 +3024,12 @@ class ProductDefinitionRecipe(PackageRecipe):
         @return: the seconary labels for this product definition.
         @rtype: C{list}
         """
-        vals = self._rootObj.get_secondaryLabels()
+        vals = self._getSection('secondaryLabels')
         if vals is None:
             return []
         return vals.get_secondaryLabel()
 
+    @_invalidatesCache
     def clearSecondaryLabels(self):
         """
         Reset secondary label list.
@@ -2053,6 +3055,40 @@ class ProductDefinitionRecipe(PackageRecipe):
                 ret.append(build)
         return ret
 
+    def buildMatrix(self):
+        """
+        Resolve every build for every stage in one pass. The result is
+        cached until the definition is modified.
+        @return: one row per (stage, build) pair, in stage order and then
+        in build order
+        @rtype: C{tuple} of L{BuildMatrixRow}
+        @raises MissingInformationError: if there isn't enough information
+            in the product definition to generate the stage labels
+        """
+        return self._getCached('buildMatrix', self._computeBuildMatrix)
+
+    def _computeBuildMatrix(self):
+        builds = []
+        for build in self.getBuildDefinitions():
+            fields = dict(build.containerTemplateFields)
+            if build.image is not None:
+                fields.update(build.image.getFields())
+            partitionScheme = getattr(build, 'partitionScheme', None)
+            if partitionScheme is not None:
+                partitionScheme = partitionScheme.ref
+            builds.append((set(build.getBuildStages()), (build.name,
+                build.architectureRef, fields.get('containerFormat'),
+                build.getBuildBaseFlavor(), tuple(sorted(fields.items())),
+                build.getBuildImageGroup(), build.getBuildSourceGroup(),
+                partitionScheme)))
+        rows = []
+        for stage in self.getStages():
+            label = self._getLabelForStage(stage)
+            rows.extend(BuildMatrixRow(stage.name, label, *row)
+                for (stages, row) in builds if stage.name in stages)
+        return tuple(rows)
+
+    @_invalidatesCache
     def setBaseLabel(self, label):
         """
         Set the base label for this product definition.
@@ -2269,8 +3305,11 @@ class ProductDefinitionRecipe(PackageRecipe):
         label = self.getProductDefinitionLabel()
         nplat.saveToRepository(client, label, message = message)
 
+    @metrics.operationSeconds.time(operation = 'rebase')
+    @_traced('rebase')
     def rebase(self, client, label = None, useLatest = None,
-            platformVersion = None, overwriteStages=False, schemaVersion=None):
+            platformVersion = None, overwriteStages=False, schemaVersion=None,
+            queryExecutor=None):
         """
         @param label: A label string pointing to the new platform to be used
         as a base for this product definition.
@@ -2287,6 +3326,9 @@ class ProductDefinitionRecipe(PackageRecipe):
         @type overwriteStages: C{bool}
         @param schemaVersion: Schema version to rebase to
         @type schemaVersion: C{str}
+        @param queryExecutor: An optional executor used to run the
+        repository queries concurrently
+        @type queryExecutor: C{RepositoryQueryExecutor}
         """
         if useLatest and platformVersion:
             raise ProductDefinitionError("Conflicting arguments useLatest and "
@@ -2295,10 +3337,15 @@ class ProductDefinitionRecipe(PackageRecipe):
             label = self.getPlatformSourceLabel()
         if label is None:
             raise PlatformLabelMissingError()
+        span = tracer.current()
+        span.setAttribute('label', str(label))
+        span.setAttribute('useLatest', bool(useLatest))
         nplat = self.toPlatformDefinition()
-        nplat.loadFromRepository(client, label, schemaVersion=schemaVersion)
+        nplat.loadFromRepository(client, label, schemaVersion=schemaVersion,
+            queryExecutor=queryExecutor)
         if not useLatest:
-            nplat.snapshotVersions(client, platformVersion = platformVersion)
+            nplat.snapshotVersions(client, platformVersion = platformVersion,
+                queryExecutor = queryExecutor)
         self._rebase(label, nplat, useLatest = useLatest, schemaVersion=schemaVersion)
         if overwriteStages:
             self.clearStages()
@@ -2337,7 +3384,8 @@ class ProductDefinitionRecipe(PackageRecipe):
                 setattr(platobj, elem, getattr(uroot, elem))
         self._rootObj.set_platform(platobj)
         self.platform._rootObj = platobj
-        self._postinit()
+        with tracer.span('postinit'):
+            self._postinit()
 
     def _getSecondaryLabel(self, label, suffix):
         """
@@ -2410,15 +3458,37 @@ class ProductDefinitionRecipe(PackageRecipe):
         BaseDefinition._initFields(self)
         self.platform = None
 
+    def _getPlatform(self):
+        self._loadSection('platform')
+        return self._platform
+
+    def _setPlatform(self, platform):
+        self._platform = platform
+
+    platform = property(_getPlatform, _setPlatform)
+
+    def _postsetstate(self):
+        platform = self._rootObj.get_platform()
+        if platform is None:
+            self.platform = None
+        else:
+            self.platform = Platform()
+            self.platform._rootObj = platform
+
     def _postinit(self):
+        self.invalidateCache()
         platform = self._rootObj.get_platform()
         if platform is None:
             self.platform = None
         else:
             self.platform = Platform()
             self.platform._rootObj = platform
-            if self.platform._rootObj.searchPaths:
-                self.platform._rootObj.searchPaths.id = PlatformDefinition.SearchPathsId
+            searchPaths = platform.searchPaths
+            # The node may already be interned (and shared) if the
+            # definition was initialized before
+            if searchPaths and (
+                    searchPaths.id != PlatformDefinition.SearchPathsId):
+                searchPaths.id = PlatformDefinition.SearchPathsId
         # Pass some parent information into the build objects
         for build in self.getBuildDefinitions():
             build.parentImageGroup = self.getImageGroup()
@@ -2457,6 +3527,9 @@ class ProductDefinitionRecipe(PackageRecipe):
             if getattr(obj, listObjMethodName)():
                 continue
             setattr(self._rootObj, listObj, None)
+        if self.platform and self.internPlatforms:
+            interning.platformInterner.internFields(self.platform._rootObj,
+                self._internedPlatformFields)
 
     @classmethod
     def _fixupBuildImage(cls, image):
@@ -2481,7 +3554,7 @@ class ProductDefinitionRecipe(PackageRecipe):
             if getattr(self, field) or getattr(self.platform, field):
                 return
         # the fields were not set in the platform or product
-        _addPlatformDefaults(self.platform)
+        _attachPlatformDefaults(self.platform)
 
     class SearchPathItem(object):
         __slots__ = [ 'troveName', 'label', 'attributes' ]
@@ -2614,7 +3687,7 @@ class BasePlatform(BaseDefinition):
         @return: auto load recipes.
         @rtype: C{list} of C{AutoLoadRecipe}
         """
-        vals = self._rootObj.get_autoLoadRecipes()
+        vals = self._getSection('autoLoadRecipes')
         if vals is None:
             return []
         return vals.get_autoLoadRecipe()
@@ -2635,7 +3708,7 @@ class BasePlatform(BaseDefinition):
         self._rootObj.contentProvider = cprov
 
     def getContentProvider(self):
-        return self._rootObj.contentProvider
+        return self._getSection('contentProvider')
 
     def newDataSource(self, name, description):
         return self.xmlFactory().dataSourceTypeSub.factory(
@@ -2723,7 +3796,8 @@ class PlatformDefinitionRecipe(PackageRecipe):
         """
 '''
 
-    def saveToRepository(self, client, label, message = None, version = None):
+    def saveToRepository(self, client, label, message = None, version = None,
+            extraVersions = ()):
         """
         Save a C{PlatformDefinition} object to a Conary repository.
         @param client: A Conary client object
@@ -2734,32 +3808,44 @@ class PlatformDefinitionRecipe(PackageRecipe):
         @type label: C{str}
         @param version: An optional version of product definition XML to write
         @type version: C{str}
+        @param extraVersions: Other schema versions to write in the same
+        commit, each to C{platform-definition-<version>.xml}, so that
+        clients only supporting older versions can load the platform
+        @type extraVersions: C{list}
         """
         return self._saveToRepository(client, label, message = message,
-            version = version)
+            version = version, extraVersions = extraVersions)
 
-    def loadFromRepository(self, client, label, schemaVersion=None, sourceTrove=None):
+    @metrics.operationSeconds.time(operation = 'load')
+    def loadFromRepository(self, client, label, schemaVersion=None,
+            sourceTrove=None, queryExecutor=None):
         """
         Load a C{PlatformDefinition} object from a Conary repository.
         @param client: A Conary client object
         @type client: C{conaryclient.ConaryClient}
         @param sourceTrove: An optional 'name=version' to load
         @type  sourceTrove: str
+        @param queryExecutor: An optional executor used to run the
+        repository queries concurrently
+        @type queryExecutor: C{RepositoryQueryExecutor}
         @raises C{RepositoryError}:
         @raises C{ProductDefinitionTroveNotFoundError}:
         @raises C{ProductDefinitionFileNotFoundError}:
         """
         stream, nvf = self._getStreamFromRepository(client, label,
-                schemaVersion, sourceTrove)
+                schemaVersion, sourceTrove, queryExecutor = queryExecutor)
         stream.seek(0)
         if schemaVersion:
             self.version = schemaVersion
         self.parseStream(stream)
+        metrics.downloadedBytes.inc(self._getStreamSize(stream) or 0)
         # Set the source trove version we used
         self._sourceTrove = "%s=%s" % (self._troveName, nvf[1])
         return nvf
 
-    def snapshotVersions(self, conaryClient, platformVersion = None):
+    @_traced('snapshotVersions')
+    def snapshotVersions(self, conaryClient, platformVersion = None,
+            queryExecutor = None):
         """
         For each search path or factory source from this platform definition,
         query the repositories for the latest versions and record them.
@@ -2768,8 +3854,13 @@ class PlatformDefinitionRecipe(PackageRecipe):
         @param platformVersion: A version string (like 1.2-3) to be used for
         platform trove search path elements.
         @type platformVersion: C{str}
+        @param queryExecutor: An optional executor; if specified, the trove
+        specs are grouped by repository host and the hosts are queried
+        concurrently.
+        @type queryExecutor: C{RepositoryQueryExecutor}
         """
         repos = conaryClient.getRepos()
+        span = tracer.current()
         troveSpecs = set()
         # XXX We are ignoring the flavors for now.
         for sp in itertools.chain(self.getSearchPaths(),
@@ -2778,11 +3869,26 @@ class PlatformDefinitionRecipe(PackageRecipe):
                 # Only snapshot if a previous version was not found
                 troveSpecs.add(self._getTroveTup(sp, platformVersion))
         troveSpecs = sorted(troveSpecs)
+        span.setAttribute('troves', len(troveSpecs))
         try:
-            troves = repos.findTroves(None, troveSpecs, allowMissing = True)
+            if queryExecutor is None:
+                metrics.repositoryCalls.inc(method = 'findTroves')
+                troves = repos.findTroves(None, troveSpecs,
+                    allowMissing = True)
+                span.increment('roundTrips')
+            else:
+                troves = queryExecutor.findTroves(repos, troveSpecs,
+                    allowMissing = True)
+                if span:
+                    span.increment('roundTrips',
+                        len(queryExecutor.groupByHost(troveSpecs)))
         except conaryErrors.RepositoryError, e:
             raise RepositoryError(str(e))
 
+        if troveSpecs:
+            # The search paths are modified in place below
+            self._getWritableNode('searchPaths')
+            self._getWritableNode('factorySources')
         for sp in itertools.chain(self.getSearchPaths(),
                                   self.getFactorySources()):
             if sp.version is not None:
@@ -2816,6 +3922,43 @@ class PlatformDefinitionRecipe(PackageRecipe):
     sourceTrove = property(getPlatformSourceTrove, setPlatformSourceTrove)
 
 
+_platformDefaultFields = [ 'architectures', 'flavorSets',
+    'containerTemplates', 'buildTemplates' ]
+
+# Schema version to (base flavor, {field : node}) for the default platform
+# content, built once by _getPlatformDefaults
+_platformDefaults = {}
+
+def _getPlatformDefaults(version):
+    defaults = _platformDefaults.get(version)
+    if defaults is not None:
+        return defaults
+    platform = Platform()
+    if version != platform.version:
+        platform.version = version
+        platform._initFields()
+    _addPlatformDefaults(platform)
+    nodes = dict((x, interning.markShared(
+            getattr(platform._rootObj, 'get_' + x)()))
+        for x in _platformDefaultFields)
+    defaults = (platform.getBaseFlavor(), nodes)
+    # Racing threads build the same content; keep whichever comes first
+    return _platformDefaults.setdefault(version, defaults)
+
+def _attachPlatformDefaults(platform):
+    """
+    Give C{platform} the default platform content. The nodes are shared
+    between all the platforms they are attached to; the methods that
+    modify architectures, flavor sets, container templates and build
+    templates build new nodes instead of changing them in place, so this
+    is copy-on-write as long as the shared objects are not modified
+    directly. See L{interning.isShared}.
+    """
+    baseFlavor, nodes = _getPlatformDefaults(platform.version)
+    platform.setBaseFlavor(baseFlavor)
+    for field in _platformDefaultFields:
+        getattr(platform._rootObj, 'set_' + field)(nodes[field])
+
 def _addPlatformDefaults(platform):
     platform.setBaseFlavor('~X, ~!alternatives, !bootstrap, ~builddocs, ~buildtests, !cross, ~desktop, ~!dom0, ~!domU, ~emacs, ~!gcj, ~gnome, ~gtk, ~ipv6, ~krb, ~ldap, ~nptl, pam, ~pcre, ~perl, ~!pie, ~python, ~readline, ~!sasl, ~!selinux, ~ssl, ~tcl, ~tk, ~!vmware, ~!xen, ~!xfce')
 
@@ -3142,6 +4285,409 @@ def _convertBuildTemplates(fromObj, proddef, newModule):
         nbuild.flavorSetRef = flavorSetRef
         nbuild.containerTemplateRef = containerTemplateRef
 
+class RepositoryQueryExecutor(object):
+    """
+    Run repository queries concurrently.
+
+    Trove specs are grouped by the host of their label, and each host is
+    queried from its own worker thread, so that a slow repository does not
+    delay the queries sent to the other ones. The repository object passed
+    in has to allow concurrent calls.
+
+    The executor can be shared between operations; call C{close} (or use it
+    as a context manager) to stop the worker threads. Functions run by the
+    executor may use it as well: their own calls to L{map} run in the
+    calling worker thread, since waiting for other workers from a worker
+    could block all of them.
+    @ivar workers: Maximum number of concurrent queries
+    @type workers: C{int}
+    @ivar timeout: Maximum number of seconds to wait for a batch of queries,
+    or C{None} to wait forever
+    @type timeout: C{float}
+    """
+    def __init__(self, workers = 4, timeout = None):
+        if workers < 1:
+            raise ValueError("workers must be a positive integer")
+        self.workers = workers
+        self.timeout = timeout
+        self._pool = None
+        # Set in the worker threads of the pool
+        self._workerState = threading.local()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, tb):
+        self.close()
+
+    def close(self):
+        if self._pool is None:
+            return
+        self._pool.close()
+        self._pool.join()
+        self._pool = None
+
+    def _getPool(self):
+        if self._pool is None:
+            from multiprocessing.pool import ThreadPool
+            self._pool = ThreadPool(self.workers,
+                initializer = self._initWorker)
+        return self._pool
+
+    def _initWorker(self):
+        self._workerState.isWorker = True
+
+    def map(self, func, items):
+        """
+        Call C{func} for every item, using the worker threads.
+        @return: the results, in the order of C{items}
+        @rtype: C{list}
+        @raises C{RepositoryError}: if the results are not available before
+        the timeout expires. Calls that timed out are not interrupted.
+        """
+        items = list(items)
+        if (self.workers == 1 or len(items) < 2
+                or getattr(self._workerState, 'isWorker', False)):
+            return [ func(x) for x in items ]
+        pool = self._getPool()
+        pending = [ pool.apply_async(func, (x, )) for x in items ]
+        if self.timeout is None:
+            return [ x.get() for x in pending ]
+        deadline = time.time() + self.timeout
+        ret = []
+        for res in pending:
+            res.wait(max(deadline - time.time(), 0))
+            if not res.ready():
+                raise RepositoryError("Timed out after %s seconds waiting "
+                    "for the repository" % self.timeout)
+            ret.append(res.get())
+        return ret
+
+    @classmethod
+    def getTroveSpecHost(cls, troveSpec):
+        """
+        @return: the host name of the label or version in C{troveSpec}, or
+        C{None} if the spec does not name one.
+        @rtype: C{str}
+        """
+        version = troveSpec[1]
+        if not version:
+            return None
+        label = BaseDefinition.labelFromString(str(version))
+        if '@' not in label:
+            return None
+        return label.split('@', 1)[0]
+
+    def groupByHost(self, troveSpecs):
+        """
+        @return: the trove specs, split by repository host
+        @rtype: C{list} of (host, C{list} of trove specs) tuples
+        """
+        byHost = {}
+        for troveSpec in troveSpecs:
+            host = self.getTroveSpecHost(troveSpec)
+            byHost.setdefault(host, []).append(troveSpec)
+        return sorted(byHost.items())
+
+    def findTroves(self, repos, troveSpecs, allowMissing = True):
+        """
+        Equivalent to C{repos.findTroves(None, troveSpecs, allowMissing)},
+        with one concurrent query per repository host.
+        @return: dictionary mapping trove specs to lists of trove tuples,
+        merged from all hosts
+        @rtype: C{dict}
+        """
+        def query(specs):
+            metrics.repositoryCalls.inc(method = 'findTroves')
+            return repos.findTroves(None, specs, allowMissing = allowMissing)
+        ret = {}
+        batches = [ x[1] for x in self.groupByHost(troveSpecs) ]
+        for result in self.map(query, batches):
+            ret.update(result)
+        return ret
+
+class BulkSave(object):
+    """
+    Save many product and platform definitions to a Conary repository,
+    with as few commits as possible.
+
+    All existing source troves are looked up with a single query, and
+    definitions whose serialized form did not change are skipped before
+    any file contents are downloaded. The remaining source troves are
+    signed one key at a time, and committed in changesets whose file
+    contents do not exceed C{maxChangeSetSize} bytes (a single definition
+    larger than that is committed on its own).
+
+    Example::
+        bulk = BulkSave(client, message = "Re-versioned\n")
+        for prodDef in productDefinitions:
+            bulk.add(prodDef)
+        bulk.add(platDef, label = "example.com@corp:platform-1")
+        committed, skipped = bulk.commit()
+    """
+    DefaultMaxChangeSetSize = 16 * 1024 * 1024
+
+    def __init__(self, conaryClient, message = None,
+            maxChangeSetSize = DefaultMaxChangeSetSize, queryExecutor = None):
+        """
+        @param conaryClient: A Conary client object
+        @type conaryClient: C{conaryclient.ConaryClient}
+        @param message: An optional commit message
+        @type message: C{str}
+        @param maxChangeSetSize: Maximum size of the file contents in a
+        changeset, or C{None} to commit everything as one changeset
+        @type maxChangeSetSize: C{int}
+        @param queryExecutor: An optional executor used for looking up the
+        existing source troves
+        @type queryExecutor: C{RepositoryQueryExecutor}
+        """
+        self.conaryClient = conaryClient
+        if message is None:
+            message = "Automatic checkin\n"
+        self.message = message
+        self.maxChangeSetSize = maxChangeSetSize
+        self.queryExecutor = queryExecutor
+        self._items = []
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, definition, label = None, version = None):
+        """
+        Schedule a definition to be saved.
+        @param definition: The definition to save
+        @type definition: C{ProductDefinition} or C{PlatformDefinition}
+        @param label: Label where the definition will be saved. Defaults to
+        the product definition label for C{ProductDefinition} objects, and
+        is required for platform definitions.
+        @type label: C{str}
+        @param version: An optional version of XML to write; defaults to
+        the schema version of the definition
+        @type version: C{str}
+        """
+        if label is None:
+            if not hasattr(definition, 'getProductDefinitionLabel'):
+                raise ProductDefinitionError(
+                    "A label is required for saving %s" % definition)
+            label = definition.getProductDefinitionLabel()
+        if version is None:
+            # Set on the instance when loaded at another schema version
+            version = definition.version
+        self._items.append((definition, str(label), version))
+
+    def commit(self):
+        """
+        Commit all scheduled definitions.
+        @return: the C{(troveName, label)} tuples of the source troves that
+        were committed, and of the ones that were skipped because nothing
+        changed
+        @rtype: C{tuple} of two C{list}s
+        """
+        client = self.conaryClient
+        repos = client.getRepos()
+
+        # The last definition added for a trove wins
+        items = {}
+        for definition, label, version in self._items:
+            troveSpec = ('%s:source' % definition._troveName, label, None)
+            items[troveSpec] = (definition, label, version)
+        self._items = []
+        troveSpecs = sorted(items)
+
+        try:
+            if self.queryExecutor is None:
+                metrics.repositoryCalls.inc(method = 'findTroves')
+                found = repos.findTroves(None, troveSpecs,
+                    allowMissing = True)
+            else:
+                found = self.queryExecutor.findTroves(repos, troveSpecs,
+                    allowMissing = True)
+        except conaryErrors.RepositoryError, e:
+            raise RepositoryError(str(e)), None, sys.exc_info()[2]
+        oldTroves = dict((x, found[x][0]) for x in troveSpecs if x in found)
+        oldFileIds = BaseDefinition._getTrovesFileIds(repos,
+            oldTroves.values())
+
+        committed = []
+        skipped = []
+        changed = []
+        for troveSpec in troveSpecs:
+            definition, label, version = items[troveSpec]
+            # The state being saved, even if the definition is modified
+            # before the commit is done
+            generation = definition._rootObj.getGeneration_()
+            newContents = definition._getSourceFileContents(version)
+            newFiles = dict((path, filetypes.RegularFile(contents = contents,
+                    config = True))
+                for (path, contents) in newContents.items())
+            trvTup = oldTroves.get(troveSpec)
+            if trvTup is not None:
+                fileIds = oldFileIds.get((trvTup[0], trvTup[1]), {})
+                if all(fileIds.get(path) == helper.get(None).fileId()
+                        for (path, helper) in newFiles.items()):
+                    skipped.append((definition._troveName, label))
+                    definition._markUnmodified(generation)
+                    continue
+            size = sum(len(x) for x in newContents.values())
+            changed.append((definition, generation, label, version, trvTup,
+                newFiles, size))
+
+        # Preserve the other files found in the troves we are replacing
+        oldContents = BaseDefinition._getTrovesContents(repos,
+            [ x[4] for x in changed if x[4] is not None ])
+
+        batch = []
+        batchSize = 0
+        for (definition, generation, label, version, trvTup, newFiles,
+                size) in changed:
+            if batch and self.maxChangeSetSize is not None and \
+                    batchSize + size > self.maxChangeSetSize:
+                self._commitBatch(batch)
+                batch = []
+                batchSize = 0
+            newPaths = {}
+            if trvTup is not None:
+                newPaths.update(oldContents.get((trvTup[0], trvTup[1]), {}))
+            newPaths.update(newFiles)
+            cs = BaseDefinition._createSourceChangeSet(client,
+                definition._troveName, label, version, newPaths, self.message)
+            batch.append((cs, definition, generation))
+            batchSize += size
+            committed.append((definition._troveName, label))
+        if batch:
+            self._commitBatch(batch)
+        return committed, skipped
+
+    def _commitBatch(self, batch):
+        cs = batch[0][0]
+        for other, _, _ in batch[1:]:
+            cs.merge(other)
+        BaseDefinition._signSourceTroves(self.conaryClient.cfg, cs)
+        metrics.repositoryCalls.inc(method = 'commitChangeSet')
+        self.conaryClient.getRepos().commitChangeSet(cs)
+        for _, definition, generation in batch:
+            definition._markUnmodified(generation)
+
+class RebasePipeline(object):
+    """
+    Rebase many product definitions at once.
+
+    The work is done in stages: each distinct upstream platform is fetched
+    from the repository once, its versions are snapshotted once, and then
+    every product referencing it is rebased from a copy of the result.
+    With a C{queryExecutor}, the fetch and snapshot of the different
+    platforms run concurrently, so the snapshot of one platform overlaps
+    with the fetch of another.
+
+    Unlike C{ProductDefinition.rebase}, no platform definition is
+    synthesized from the products before the upstream one is loaded.
+
+    @ivar timings: cumulative number of seconds spent in each stage
+    (C{fetch}, C{snapshot} and C{rebase}) by the last C{run}, as well as
+    the elapsed wall clock time (C{total})
+    @type timings: C{dict}
+    @ivar platforms: the upstream platform definitions loaded by the
+    last C{run}, keyed by label
+    @type platforms: C{dict}
+    """
+    Stages = ('fetch', 'snapshot', 'rebase')
+
+    def __init__(self, conaryClient, useLatest = None, platformVersion = None,
+            overwriteStages = False, schemaVersion = None,
+            queryExecutor = None):
+        """
+        The arguments have the same meaning as for
+        C{ProductDefinition.rebase}.
+        """
+        if useLatest and platformVersion:
+            raise ProductDefinitionError("Conflicting arguments useLatest and "
+                "platformVersion specified")
+        self.conaryClient = conaryClient
+        self.useLatest = useLatest
+        self.platformVersion = platformVersion
+        self.overwriteStages = overwriteStages
+        self.schemaVersion = schemaVersion
+        self.queryExecutor = queryExecutor
+        self.timings = {}
+        self.platforms = {}
+
+    def run(self, products, label = None):
+        """
+        Rebase the products.
+        @param products: the product definitions to rebase
+        @type products: C{list} of C{ProductDefinition}
+        @param label: A label string pointing to the new platform to be
+        used for all products. Defaults to each product's platform source
+        label.
+        @type label: C{str}
+        @raises PlatformLabelMissingError: if no label was specified and a
+        product has no platform source label; no product is modified.
+        """
+        start = time.time()
+        self.timings = dict.fromkeys(self.Stages, 0.0)
+        byLabel = {}
+        for prd in products:
+            platLabel = label
+            if platLabel is None:
+                platLabel = prd.getPlatformSourceLabel()
+            if platLabel is None:
+                raise PlatformLabelMissingError()
+            byLabel.setdefault(platLabel, []).append(prd)
+
+        labels = sorted(byLabel)
+        if self.queryExecutor is None:
+            results = [ self._loadPlatform(x) for x in labels ]
+        else:
+            results = self.queryExecutor.map(self._loadPlatform, labels)
+        self.platforms = {}
+        for platLabel, (nplat, fetchTime, snapshotTime) in zip(labels,
+                results):
+            self.platforms[platLabel] = nplat
+            self.timings['fetch'] += fetchTime
+            self.timings['snapshot'] += snapshotTime
+
+        stageStart = time.time()
+        for platLabel in labels:
+            nplat = self.platforms[platLabel]
+            prds = byLabel[platLabel]
+            for i, prd in enumerate(prds):
+                # Products must not share the platform's objects
+                if i < len(prds) - 1:
+                    plat = self._copyPlatform(nplat)
+                else:
+                    plat = nplat
+                prd._rebase(platLabel, plat, useLatest = self.useLatest,
+                    schemaVersion = self.schemaVersion)
+                if self.overwriteStages:
+                    prd.clearStages()
+                    prd.copyStages(plat)
+        self.timings['rebase'] = time.time() - stageStart
+        self.timings['total'] = time.time() - start
+        return self.platforms
+
+    def _loadPlatform(self, label):
+        fetchStart = time.time()
+        nplat = PlatformDefinition()
+        nplat.loadFromRepository(self.conaryClient, label,
+            schemaVersion = self.schemaVersion,
+            queryExecutor = self.queryExecutor)
+        snapshotStart = time.time()
+        if not self.useLatest:
+            nplat.snapshotVersions(self.conaryClient,
+                platformVersion = self.platformVersion,
+                queryExecutor = self.queryExecutor)
+        end = time.time()
+        return nplat, snapshotStart - fetchStart, end - snapshotStart
+
+    @classmethod
+    def _copyPlatform(cls, nplat):
+        plat = PlatformDefinition()
+        plat.version = nplat.version
+        plat._rootObj = copy.deepcopy(nplat._rootObj)
+        plat._preMigrateVersion = nplat._preMigrateVersion
+        plat._sourceTrove = nplat._sourceTrove
+        return plat
+
 class DigesterMd5FLO(object):
     """ file-like object that produces a MD5 hexdigest from content that is written to it """
     def __init__(self):
@@ -3150,9 +4696,70 @@ class DigesterMd5FLO(object):
     def write(self, data):
         self._digest.update(data)
 
+class _BackMigrationTable(object):
+    """
+    What migrating a definition back to C{version} keeps, derived from the
+    migration registry and the fields of the generated classes.
+    @ivar blockedBy: Name of the first migration on the way that cannot
+    migrate back, or None
+    @ivar droppedFields: Maps names of generated classes of the current
+    schema version to the fields that have no counterpart in C{version}
+    @ivar droppedClasses: Names of the generated classes of the current
+    schema version that do not exist in C{version}
+    """
+    __slots__ = [ 'version', 'blockedBy', 'droppedFields', 'droppedClasses' ]
+
+    def __init__(self, version, blockedBy = None, droppedFields = None,
+            droppedClasses = ()):
+        self.version = version
+        self.blockedBy = blockedBy
+        self.droppedFields = droppedFields or {}
+        self.droppedClasses = frozenset(droppedClasses)
+
+    @classmethod
+    def _getClassFields(cls, module):
+        return dict((name, set(x.name for x in obj.member_data_items_))
+            for (name, obj) in vars(module).items()
+            if name.endswith('Sub') and hasattr(obj, 'member_data_items_'))
+
+    @classmethod
+    def build(cls, version, path, transitions):
+        """
+        Walk C{path}, from the current version back to C{version}, the way
+        L{BaseMigration.copyFrom} does.
+        """
+        path = path[:]
+        nv = path.pop()
+        alive = cls._getClassFields(BaseDefinition.loadModule(nv))
+        dropped = dict((x, set()) for x in alive)
+        droppedClasses = set()
+        while path:
+            cv = path.pop()
+            for MigrateClass in transitions[cv][nv]:
+                if not MigrateClass.CanMigrateBack:
+                    return cls(version, blockedBy = MigrateClass.__name__)
+            skipFields = set()
+            for MigrateClass in transitions[cv][nv]:
+                skipFields.update(MigrateClass.skipFields)
+            oldFields = cls._getClassFields(BaseDefinition.loadModule(cv))
+            for name, fields in alive.items():
+                if name not in oldFields:
+                    droppedClasses.add(name)
+                    del alive[name]
+                    continue
+                kept = oldFields[name] - skipFields
+                dropped[name].update(fields - kept)
+                fields.intersection_update(kept)
+            nv = cv
+        return cls(version, droppedClasses = droppedClasses,
+            droppedFields = dict((x, frozenset(y))
+                for (x, y) in dropped.items() if y))
+
+
 class MigrationManager(object):
     __slots__ = [ '_version', '_path' ]
     _transitions = {}
+    _backMigrationTables = {}
     CurrentVersion = BaseDefinition.version
 
     @classmethod
@@ -3174,7 +4781,16 @@ class MigrationManager(object):
         self._version = version
         self._path = path
 
+    @_traced('migrateForward')
     def migrateForward(self, rootObj):
+        if len(self._path) > 1:
+            metrics.migrationHops.inc(len(self._path) - 1,
+                direction = 'forward')
+        span = tracer.current()
+        if span:
+            span.setAttribute('fromVersion', self._version)
+            span.setAttribute('toVersion', self.CurrentVersion)
+            span.setAttribute('hops', len(self._path) - 1)
         if self._version == self.CurrentVersion:
             return rootObj
         transPath = self._path[:]
@@ -3189,21 +4805,95 @@ class MigrationManager(object):
             v = nv
         return rootObj
 
+    @_traced('migrateBack')
     def migrateBack(self, rootObj):
+        if len(self._path) > 1:
+            metrics.migrationHops.inc(len(self._path) - 1,
+                direction = 'back')
+        span = tracer.current()
+        if span:
+            span.setAttribute('fromVersion', self.CurrentVersion)
+            span.setAttribute('toVersion', self._version)
+            span.setAttribute('hops', len(self._path) - 1)
         if self._version == self.CurrentVersion:
             return rootObj
         transPath = self._path[:]
         nv = transPath.pop()
         while transPath:
             cv = transPath.pop()
-            transitions = self._transitions[cv][nv]
-            for MigrateClass in transitions:
-                module = BaseDefinition.loadModule(cv)
-                rootObj = MigrateClass().migrateBack(rootObj, module)
-                if rootObj is None:
-                    raise RuntimeError("Unable to migrate")
-            rootObj.version = cv
+            rootObj = self.migrateBackStep(rootObj, nv, cv)
+            nv = cv
+        return rootObj
+
+    @_traced('migrateBack')
+    def migrateBackVersions(self, rootObj, versions, fromVersion = None):
+        """
+        Migrate C{rootObj}, at schema version C{fromVersion} (the current
+        version by default), back to the version this migration starts
+        from, keeping the intermediate trees for C{versions}.
+        @return: dictionary mapping each of C{versions} to its tree
+        @rtype: C{dict}
+        """
+        if fromVersion is None:
+            fromVersion = self.CurrentVersion
+        if fromVersion not in self._path or \
+                not set(versions).issubset(self._path):
+            raise RuntimeError("Unable to migrate")
+        transPath = self._path[:self._path.index(fromVersion) + 1]
+        hops = len(transPath) - 1
+        if hops:
+            metrics.migrationHops.inc(hops, direction = 'back')
+        span = tracer.current()
+        if span:
+            span.setAttribute('fromVersion', fromVersion)
+            span.setAttribute('toVersion', self._version)
+            span.setAttribute('hops', hops)
+        ret = {}
+        if fromVersion in versions:
+            ret[fromVersion] = rootObj
+        nv = transPath.pop()
+        while transPath:
+            cv = transPath.pop()
+            rootObj = self.migrateBackStep(rootObj, nv, cv)
+            if cv in versions:
+                ret[cv] = rootObj
             nv = cv
+        return ret
+
+    @classmethod
+    def getBackMigrationTable(cls, version):
+        """
+        @return: the table describing what migrating back to C{version}
+        keeps; tables are computed once per version
+        @rtype: L{_BackMigrationTable}
+        @raises RuntimeError: if there is no migration path from C{version}
+        """
+        table = cls._backMigrationTables.get(version)
+        if table is None:
+            table = _BackMigrationTable.build(version, cls(version).path,
+                cls._transitions)
+            table = cls._backMigrationTables.setdefault(version, table)
+        return table
+
+    @property
+    def path(self):
+        """
+        The schema versions from the one this migration starts from to the
+        current one
+        """
+        return list(self._path)
+
+    @classmethod
+    def migrateBackStep(cls, rootObj, fromVersion, toVersion):
+        """
+        Migrate C{rootObj} back by one step of the migration chain.
+        """
+        module = BaseDefinition.loadModule(toVersion)
+        for MigrateClass in cls._transitions[toVersion][fromVersion]:
+            rootObj = MigrateClass().migrateBack(rootObj, module)
+            if rootObj is None:
+                raise RuntimeError("Unable to migrate")
+        rootObj.version = toVersion
         return rootObj
 
 class BaseMigration(object):
@@ -0,0 +1,235 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Building of the generated objects from DOM nodes through dispatch tables.
+
+The generated C{buildChildren} methods compare the name of every child
+node with each element of the class in turn, after C{build} removed its
+namespace prefix. L{getBuilder} turns the C{member_data_items_} of a
+generated class, and its member table (written by C{gends_member_tables}
+when the classes are generated), into a table mapping each element name
+to a (factory, setter) pair: the factory makes the value of the member
+out of the child node, and the setter stores it in the object, the way the
+generated code does. Tables are made once per class, so once per schema
+version, and are also indexed by the prefixed names found in the
+documents.
+
+Classes whose build methods were customized, that have no member table, or
+that use a construct this module does not know about, have no builder and
+keep using their generated C{build} method. Setting L{enabled} to C{False} makes all
+classes use their generated method.
+"""
+
+import sys
+import threading
+from xml.dom import Node
+
+enabled = True
+
+
+class _NoValue(object):
+    """
+    Value of a boolean element with no content, which the generated code
+    skips.
+    """
+_noValue = _NoValue()
+
+
+# Factories: child node -> member value
+def _complexFactory(childClass):
+    factory = childClass.factory
+    def makeObject(node):
+        obj = factory()
+        obj.build(node)
+        return obj
+    return makeObject
+
+def _text(node):
+    # Joined once, the text may be split into many nodes
+    return ''.join([ x.nodeValue for x in node.childNodes ])
+
+def _boolean(node):
+    if not node.firstChild:
+        return _noValue
+    value = node.firstChild.nodeValue
+    if value in ('true', '1'):
+        return True
+    if value in ('false', '0'):
+        return False
+    raise ValueError('requires boolean -- %s' % node.toxml())
+
+# Setters: (object, value)
+def _attributeSetter(name, validator):
+    def setter(obj, value):
+        setattr(obj, name, value)
+        if validator is not None:
+            validator(obj, getattr(obj, name))
+    return setter
+
+def _listSetter(name, validator):
+    def setter(obj, value):
+        getattr(obj, name).append(value)
+        if validator is not None:
+            validator(obj, getattr(obj, name))
+    return setter
+
+
+class _ClassBuilder(object):
+    """
+    Builder for the objects of one generated class.
+    """
+    def __init__(self, handlers, hasText):
+        # element name, with or without a namespace prefix ->
+        #   (factory, setter), or None for elements the class ignores
+        self.handlers = handlers
+        self._lock = threading.Lock()
+        self.hasText = hasText
+
+    def _addNodeName(self, nodeName):
+        handler = self.handlers.get(nodeName.split(':')[-1])
+        with self._lock:
+            # Copy on write, other threads may be reading the table
+            handlers = self.handlers.copy()
+            handlers[nodeName] = handler
+            self.handlers = handlers
+        return handler
+
+    def __call__(self, obj, node):
+        obj.buildAttributes(node.attributes)
+        if self.hasText:
+            # The text is collected in a list of chunks and set once;
+            # appending to valueOf_ would copy the text for every node
+            chunks = []
+            for child in node.childNodes:
+                if child.nodeType == Node.TEXT_NODE:
+                    chunks.append(child.nodeValue)
+                elif child.nodeType == Node.CDATA_SECTION_NODE:
+                    chunks.extend(('![CDATA[', child.nodeValue, ']]'))
+            obj.valueOf_ = ''.join(chunks)
+            return
+        handlers = self.handlers
+        for child in node.childNodes:
+            if child.nodeType != Node.ELEMENT_NODE:
+                continue
+            nodeName = child.nodeName
+            if nodeName in handlers:
+                handler = handlers[nodeName]
+            else:
+                handler = self._addNodeName(nodeName)
+                handlers = self.handlers
+            if handler is None:
+                continue
+            factory, setter = handler
+            value = factory(child)
+            if value is not _noValue:
+                setter(obj, value)
+
+
+def _owner(cls, attr):
+    for base in cls.__mro__:
+        if attr in base.__dict__:
+            return base
+    return None
+
+def _compile(cls):
+    """
+    @return: a builder for the objects of C{cls}, or C{None} if their
+    generated build method has to be used
+    @rtype: C{_ClassBuilder}
+    """
+    genClass = _owner(cls, 'build')
+    if genClass is None:
+        return None
+    build = getattr(genClass.__dict__['build'], '__wrapped__', None)
+    if build is None:
+        return None
+    if _owner(cls, 'buildChildren') is not genClass:
+        return None
+    table = genClass.getMemberTable_()
+    if table is None:
+        return None
+    elementKinds = dict(table[1])
+
+    module = sys.modules[genClass.__module__]
+    handlers = {}
+    hasText = False
+    for spec in genClass.member_data_items_:
+        name = spec.name
+        if name == 'valueOf_':
+            hasText = True
+            continue
+        tag = name.endswith('_') and name[:-1] or name
+        kind = elementKinds.get(tag)
+        if kind is None:
+            # An attribute
+            continue
+        if kind == 'complex':
+            childClass = None
+            if isinstance(spec.data_type, str):
+                childClass = getattr(module, spec.data_type, None)
+            if not isinstance(childClass, type):
+                childClass = getattr(module, tag, None)
+            if not isinstance(childClass, type):
+                return None
+            factory = _complexFactory(childClass)
+            validator = None
+        elif spec.get_data_type() == 'xsd:boolean':
+            factory = _boolean
+            validator = None
+        elif spec.get_data_type() == 'xsd:string':
+            factory = _text
+            validator = None
+            if kind == 'restricted':
+                # Values of the simple types of the schema go through the
+                # generated validate_ method
+                validator = getattr(cls, 'validate_' + name, None)
+        else:
+            return None
+        if spec.container:
+            setter = _listSetter(name, validator)
+        elif factory is _text or factory is _boolean:
+            setter = _attributeSetter(name, validator)
+        else:
+            setter = getattr(cls, 'set_' + name, None)
+            if setter is None:
+                return None
+        handlers[tag] = (factory, setter)
+    if hasText and handlers:
+        # Mixed content
+        return None
+    return _ClassBuilder(handlers, hasText)
+
+
+_builders = {}
+_buildersLock = threading.Lock()
+
+def getBuilder(cls):
+    """
+    @return: the builder compiled for the generated class C{cls}, or
+    C{None} if its objects have to be built by their generated build
+    method. The builder is called with the object and the DOM node.
+    """
+    if not enabled:
+        return None
+    try:
+        return _builders[cls]
+    except KeyError:
+        pass
+    builder = _compile(cls)
+    with _buildersLock:
+        return _builders.setdefault(cls, builder)
@@ -0,0 +1,247 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Validate, and optionally migrate, many definition documents at once.
+
+Usage::
+    python -m rpath_proddef.bulk [options] DIRECTORY|TARBALL...
+
+Every C{product-definition*.xml} and C{platform-definition*.xml} file
+found is validated against the schema for the version it declares. With
+C{--migrate}, the document is also loaded and serialized to the target
+schema version, optionally writing the result under C{--output-dir}.
+Documents are processed by a pool of worker processes, and one JSON
+object per document is written to standard output as soon as it is done.
+The exit status is 1 if any document failed.
+"""
+
+import fnmatch
+import json
+import multiprocessing
+import optparse
+import os
+import StringIO
+import sys
+import tarfile
+import time
+from lxml import etree
+
+from rpath_proddef import api1 as proddef
+
+FilePatterns = [ 'product-definition*.xml', 'platform-definition*.xml' ]
+
+# Root element name to definition class
+DefinitionClasses = dict((x.RootNode, x)
+    for x in [ proddef.ProductDefinition, proddef.PlatformDefinition ])
+
+
+class BulkOptions(object):
+    """
+    Settings shared by all documents in a run.
+    """
+    def __init__(self, schemaDir = None, migrate = False,
+            targetVersion = None, outputDir = None):
+        self.schemaDir = schemaDir or proddef.BaseDefinition.schemaDir
+        self.migrate = migrate
+        self.targetVersion = targetVersion or proddef.BaseDefinition.version
+        self.outputDir = outputDir
+
+
+def isDefinitionFile(path):
+    fileName = os.path.basename(path)
+    return any(fnmatch.fnmatch(fileName, x) for x in FilePatterns)
+
+def iterDocuments(path):
+    """
+    Yield (name, path, data) for each definition document in a directory
+    or tarball. Documents from a directory are read by the workers, so
+    C{data} is None for them.
+    """
+    checkPath(path)
+    if os.path.isdir(path):
+        for dirPath, dirNames, fileNames in os.walk(path):
+            dirNames.sort()
+            for fileName in sorted(fileNames):
+                filePath = os.path.join(dirPath, fileName)
+                if isDefinitionFile(fileName):
+                    yield (os.path.relpath(filePath, path), filePath, None)
+    elif tarfile.is_tarfile(path):
+        tarball = tarfile.open(path)
+        try:
+            for member in tarball:
+                if member.isfile() and isDefinitionFile(member.name):
+                    yield (member.name, None,
+                        tarball.extractfile(member).read())
+        finally:
+            tarball.close()
+
+def checkPath(path):
+    if not (os.path.isdir(path) or
+            (os.path.isfile(path) and tarfile.is_tarfile(path))):
+        raise proddef.ProductDefinitionError(
+            "%s is not a directory or a tarball" % path)
+
+def getOutputPath(outputDir, name):
+    """
+    @return: the path under C{outputDir} to write the document C{name} to
+    @raises C{ProductDefinitionError}: if C{name} is absolute or goes up
+    the directory tree, which could make it point outside C{outputDir}
+    """
+    normName = os.path.normpath(name)
+    if os.path.isabs(normName) or normName.split(os.sep)[0] == os.pardir \
+            or os.pardir in name.split('/'):
+        raise proddef.ProductDefinitionError(
+            "Refusing to write %s outside of the output directory" % name)
+    return os.path.join(outputDir, normName)
+
+def processDocument(item, options):
+    """
+    Validate, and optionally migrate, one document.
+    @return: the result record for the document
+    @rtype: C{dict}
+    """
+    name, path, data = item
+    timings = {}
+    result = dict(file = name, ok = False, error = None, timings = timings)
+    start = time.time()
+    marks = [ start ]
+    def lap(stage):
+        now = time.time()
+        timings[stage] = round(now - marks[-1], 6)
+        marks.append(now)
+    try:
+        if data is None:
+            data = file(path).read()
+        result['size'] = len(data)
+        lap('read')
+        # Parsed once, for validating and for loading
+        tree = etree.parse(StringIO.StringIO(data))
+        root = tree.getroot()
+        rootNode = etree.QName(root.tag).localname
+        version = root.get('version', proddef.BaseDefinition.version)
+        result['version'] = version
+        if rootNode not in DefinitionClasses:
+            raise proddef.ProductDefinitionError(
+                "Unknown root element %s" % rootNode)
+        defClass = DefinitionClasses[rootNode]
+        result['kind'] = rootNode
+        proddef.BaseDefinition.validateTree(tree, options.schemaDir, version)
+        lap('validate')
+        if options.migrate:
+            obj = defClass.fromElementTree(tree,
+                schemaDir = options.schemaDir)
+            lap('load')
+            sio = StringIO.StringIO()
+            obj.serialize(sio, version = options.targetVersion)
+            result['migratedVersion'] = options.targetVersion
+            result['migratedSize'] = len(sio.getvalue())
+            lap('serialize')
+            if options.outputDir:
+                outPath = getOutputPath(options.outputDir, name)
+                outDir = os.path.dirname(outPath)
+                if not os.path.isdir(outDir):
+                    try:
+                        os.makedirs(outDir)
+                    except OSError:
+                        # Another worker created it
+                        if not os.path.isdir(outDir):
+                            raise
+                file(outPath, "w").write(sio.getvalue())
+                result['output'] = outPath
+                lap('write')
+        result['ok'] = True
+    except Exception, e:
+        result['error'] = "%s: %s" % (e.__class__.__name__, e)
+    timings['total'] = round(time.time() - start, 6)
+    return result
+
+_workerOptions = None
+
+def _initWorker(options):
+    global _workerOptions
+    _workerOptions = options
+
+def _processInWorker(item):
+    return processDocument(item, _workerOptions)
+
+def run(paths, options, jobs = None, out = None):
+    """
+    Process the documents under C{paths}, writing one JSON line per
+    document to C{out} (standard output by default), in completion order.
+    @return: (number of documents, number of failures)
+    @rtype: C{tuple}
+    """
+    if out is None:
+        out = sys.stdout
+    # Fail before starting the pool, which feeds the items from a thread
+    for path in paths:
+        checkPath(path)
+    items = (x for path in paths for x in iterDocuments(path))
+    if jobs == 1:
+        results = (processDocument(x, options) for x in items)
+        pool = None
+    else:
+        pool = multiprocessing.Pool(jobs, _initWorker, (options, ))
+        results = pool.imap_unordered(_processInWorker, items)
+    count = failed = 0
+    try:
+        for result in results:
+            count += 1
+            if not result['ok']:
+                failed += 1
+            out.write(json.dumps(result, sort_keys = True) + '\n')
+            out.flush()
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    return count, failed
+
+def main(argv = None):
+    if argv is None:
+        argv = sys.argv
+    parser = optparse.OptionParser(
+        usage = "%prog [options] DIRECTORY|TARBALL...")
+    parser.add_option('--schema-dir', dest = 'schemaDir',
+        help = "Directory with the rpd-*.xsd schema files (default: %s)"
+            % proddef.BaseDefinition.schemaDir)
+    parser.add_option('--migrate', action = 'store_true', default = False,
+        help = "Load each document and serialize it to the target version")
+    parser.add_option('--to-version', dest = 'targetVersion',
+        help = "Target schema version for --migrate (default: %s)"
+            % proddef.BaseDefinition.version)
+    parser.add_option('--output-dir', dest = 'outputDir',
+        help = "Write migrated documents under this directory")
+    parser.add_option('-j', '--jobs', type = 'int', default = None,
+        help = "Number of worker processes (default: number of CPUs)")
+    opts, args = parser.parse_args(argv[1:])
+    if not args:
+        parser.error("No directory or tarball specified")
+    if opts.outputDir and not opts.migrate:
+        parser.error("--output-dir requires --migrate")
+    options = BulkOptions(schemaDir = opts.schemaDir, migrate = opts.migrate,
+        targetVersion = opts.targetVersion, outputDir = opts.outputDir)
+    try:
+        count, failed = run(args, options, jobs = opts.jobs)
+    except proddef.ProductDefinitionError, e:
+        sys.stderr.write("error: %s\n" % e)
+        return 2
+    return int(failed > 0)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,362 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Export of the generated objects through writers compiled from their
+member specs.
+
+The generated C{export} methods format every attribute and element through
+a chain of helper calls (C{showIndent}, C{quote_attrib}, C{format_string}
+and the like). L{getWriter} turns the C{member_data_items_} of a generated
+class, and its member table (the attributes and elements declared by the
+schema, written by C{gends_member_tables} when the classes are generated),
+into a writer that produces the same bytes: the class is compiled once,
+the tags of its elements are computed once per namespace prefix, and the
+output is appended to a list that is joined once per object.
+
+The objects that cache their output (see C{GeneratedsSuper.cachesExport_})
+get it stored in their C{_fragment_} export cache, in the format used by
+C{generatedssuper._cachedExport}, and cached fragments are reused as they
+are. Classes whose export was customized (an overridden C{exportChildren}
+or C{format_string}, for instance), that have no member table, or that use
+a construct this module does not know about have no writer, and keep using
+their generated C{export} method. Setting L{enabled} to C{False}
+makes all classes use their generated method.
+"""
+
+import inspect
+import re
+import threading
+
+ExternalEncoding = 'utf-8'
+
+enabled = True
+
+_entities = { '&' : '&amp;', '<' : '&lt;', '>' : '&gt;' }
+_specialChars = re.compile('[&<>]')
+
+def _entity(match):
+    return _entities[match.group()]
+
+def quoteXml(value):
+    """
+    Escape C{value} for use as element text, like the C{quote_xml}
+    function of the generated modules, in a single pass.
+    """
+    if not isinstance(value, basestring):
+        value = '%s' % value
+    if _specialChars.search(value) is None:
+        return value
+    return _specialChars.sub(_entity, value)
+
+def quoteAttrib(value):
+    """
+    Escape and quote C{value} for use as an attribute value, like the
+    C{quote_attrib} function of the generated modules.
+    """
+    value = quoteXml(value)
+    if '"' in value:
+        if "'" in value:
+            return '"%s"' % value.replace('"', '&quot;')
+        return "'%s'" % value
+    return '"%s"' % value
+
+def _quoteText(value):
+    # Text content (valueOf_); CDATA sections are kept as markers by the
+    # generated build methods
+    if value.find('![CDATA') > -1:
+        value = quoteXml('%s' % value)
+        value = value.replace('![CDATA', '<![CDATA')
+        value = value.replace(']]', ']]>')
+        return value.encode(ExternalEncoding)
+    return quoteXml('%s' % value.encode(ExternalEncoding))
+
+_indents = [ '    ' * x for x in range(16) ]
+
+def _indent(level):
+    if level < len(_indents):
+        return _indents[level]
+    return '    ' * level
+
+
+class _Buffer(list):
+    """
+    List of output strings, usable as the output file of a generated
+    export method.
+    """
+    __slots__ = []
+    write = list.append
+
+
+# Attribute writers: format string for the name, function for the value
+def _stringAttribute(name):
+    fmt = ' %s=%%s' % name
+    return lambda value: fmt % (
+        quoteAttrib(value).encode(ExternalEncoding), )
+
+def _simpleTypeAttribute(name):
+    # Simple types defined by the schema are not encoded
+    fmt = ' %s=%%s' % name
+    return lambda value: fmt % (quoteAttrib(value), )
+
+def _booleanAttribute(name):
+    fmt = ' %s="%%s"' % name
+    return lambda value: fmt % str(value).lower()
+
+def _integerAttribute(name):
+    fmt = ' %s="%%d"' % name
+    return lambda value: fmt % value
+
+_attributeTypes = {
+    'xsd:string' : _stringAttribute,
+    'xsd:boolean' : _booleanAttribute,
+    'xsd:integer' : _integerAttribute,
+    'xsd:nonNegativeInteger' : _integerAttribute,
+    'xsd:positiveInteger' : _integerAttribute,
+}
+
+# Element text formatters, for elements that have no class of their own
+_textFormatters = {
+    'xsd:string' : lambda value: quoteXml(value).encode(ExternalEncoding),
+    'xsd:boolean' : lambda value: str(value).lower(),
+}
+
+
+def _exportChild(child, parts, level, namespace_, name_):
+    # Same as child.export(parts, level, namespace_, name_ = name_), as
+    # called by the generated exportChildren methods
+    key = (level, (namespace_, ), (('name_', name_), ))
+    fragment = getattr(child, '_fragment_', None)
+    if fragment is not None and fragment[0] == key:
+        parts.append(fragment[1])
+        return
+    writer = getWriter(child.__class__)
+    if writer is None:
+        child.export(parts, level, namespace_, name_ = name_)
+        return
+    start = len(parts)
+    writer.write(child, parts, level, namespace_, name_, '')
+    if child.cachesExport_():
+        text = ''.join(parts[start:])
+        parts[start:] = [ text ]
+        child._fragment_ = (key, text)
+
+
+def _argBinder(defNamespace, defName, defNamespacedef):
+    # Arguments of the generated export method, after outfile and level
+    def bindArgs(namespace_ = defNamespace, name_ = defName,
+            namespacedef_ = defNamespacedef):
+        return namespace_, name_, namespacedef_
+    return bindArgs
+
+
+class _ElementSpec(object):
+    """
+    Child element of a compiled class.
+    """
+    __slots__ = [ 'name', 'tag', 'container', 'formatter' ]
+
+    def __init__(self, name, tag, container, formatter):
+        self.name = name
+        self.tag = tag
+        self.container = container
+        # None for elements exported by their own class
+        self.formatter = formatter
+
+
+class _ClassWriter(object):
+    """
+    Writer for the objects of one generated class.
+    """
+    def __init__(self, defaults, attributes, elements, hasText):
+        self.bindArgs = _argBinder(*defaults)
+        # [ (member name, optional, value formatter) ]
+        self.attributes = attributes
+        # [ _ElementSpec ]
+        self.elements = elements
+        self.hasText = hasText
+        # namespace prefix -> [ (spec, open tag, close tag) ]
+        self._tags = {}
+
+    def __call__(self, obj, level, *args, **kwargs):
+        namespace_, name_, namespacedef_ = self.bindArgs(*args, **kwargs)
+        parts = _Buffer()
+        self.write(obj, parts, level, namespace_, name_, namespacedef_)
+        return ''.join(parts)
+
+    def _getTags(self, namespace_):
+        tags = self._tags.get(namespace_)
+        if tags is None:
+            tags = self._tags[namespace_] = [ (x,
+                    '<%s%s>' % (namespace_, x.tag),
+                    '</%s%s>\n' % (namespace_, x.tag))
+                for x in self.elements ]
+        return tags
+
+    def write(self, obj, parts, level, namespace_, name_, namespacedef_):
+        append = parts.append
+        indent = _indent(level)
+        append(indent)
+        append('<%s%s%s' % (namespace_, name_,
+            namespacedef_ and ' ' + namespacedef_ or '', ))
+        for name, optional, formatter in self.attributes:
+            value = getattr(obj, name)
+            if value is not None or not optional:
+                append(formatter(value))
+        if self.hasText:
+            if obj.valueOf_:
+                append('>')
+                append(_quoteText(obj.valueOf_))
+                append('</%s%s>\n' % (namespace_, name_))
+            else:
+                append('/>\n')
+            return
+
+        children = []
+        hasContent = False
+        for item in self._getTags(namespace_):
+            value = getattr(obj, item[0].name)
+            if item[0].container:
+                hasContent = hasContent or bool(value)
+            else:
+                hasContent = hasContent or value is not None
+            children.append((item, value))
+        if not hasContent:
+            append('/>\n')
+            return
+        append('>\n')
+        childLevel = level + 1
+        childIndent = _indent(childLevel)
+        for (spec, openTag, closeTag), value in children:
+            if spec.formatter is not None:
+                if spec.container:
+                    values = value
+                elif value is not None:
+                    values = (value, )
+                else:
+                    continue
+                for value in values:
+                    append(childIndent)
+                    append(openTag)
+                    append(spec.formatter(value))
+                    append(closeTag)
+            elif spec.container:
+                for value in value:
+                    _exportChild(value, parts, childLevel, namespace_,
+                        spec.tag)
+            elif value:
+                _exportChild(value, parts, childLevel, namespace_, spec.tag)
+        append(indent)
+        append('</%s%s>\n' % (namespace_, name_))
+
+
+_exportArgs = ['self', 'outfile', 'level', 'namespace_', 'name_',
+    'namespacedef_']
+
+def _owner(cls, attr):
+    for base in cls.__mro__:
+        if attr in base.__dict__:
+            return base
+    return None
+
+def _compile(cls):
+    """
+    @return: a writer for the objects of C{cls}, or C{None} if their
+    generated export method has to be used
+    @rtype: C{_ClassWriter}
+    """
+    genClass = _owner(cls, 'export')
+    if genClass is None:
+        return None
+    export = getattr(genClass.__dict__['export'], '__wrapped__', None)
+    if export is None:
+        return None
+    argSpec = inspect.getargspec(export)
+    if argSpec.args != _exportArgs or len(argSpec.defaults or ()) != 3:
+        return None
+    for method in ('exportAttributes', 'exportChildren', 'hasContent_'):
+        if _owner(cls, method) is not genClass:
+            return None
+    # Only the formatting methods of GeneratedsSuper are known to be
+    # no-ops
+    overriders = cls.__mro__[:cls.__mro__.index(genClass) + 1]
+    for method in ('format_string', 'format_integer', 'format_boolean'):
+        if _owner(cls, method) in overriders:
+            return None
+    table = genClass.getMemberTable_()
+    if table is None:
+        return None
+
+    # Attributes required by the schema are written whatever their value
+    required = dict(table[0])
+    elementKinds = dict(table[1])
+    attributes = []
+    elements = []
+    hasText = False
+    for spec in genClass.member_data_items_:
+        name = spec.name
+        dataType = spec.get_data_type()
+        if name == 'valueOf_':
+            hasText = True
+            continue
+        # Members named after python keywords or generated methods get an
+        # underscore appended
+        tag = name.endswith('_') and name[:-1] or name
+        if tag in required:
+            if dataType.startswith('xsd:'):
+                factory = _attributeTypes.get(dataType)
+                if factory is None:
+                    return None
+            else:
+                factory = _simpleTypeAttribute
+            attributes.append((name, not required[tag], factory(name)))
+            continue
+        kind = elementKinds.get(tag)
+        if kind is None:
+            return None
+        if kind == 'complex':
+            formatter = None
+        else:
+            formatter = _textFormatters.get(dataType)
+            if formatter is None:
+                return None
+        elements.append(_ElementSpec(name, tag, spec.container, formatter))
+    if hasText and elements:
+        # Mixed content
+        return None
+    return _ClassWriter(export.func_defaults, attributes, elements, hasText)
+
+
+_writers = {}
+_writersLock = threading.Lock()
+
+def getWriter(cls):
+    """
+    @return: the writer compiled for the generated class C{cls}, or
+    C{None} if its objects have to be exported by their generated export
+    method. The writer is called with the arguments of export, less the
+    output file, and returns the exported XML.
+    """
+    if not enabled:
+        return None
+    try:
+        return _writers[cls]
+    except KeyError:
+        pass
+    writer = _compile(cls)
+    with _writersLock:
+        return _writers.setdefault(cls, writer)
@@ -0,0 +1,420 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+In-process stand-in for a Conary repository and client.
+
+L{FakeConaryClient} and L{FakeRepository} implement the subset of the
+Conary client and repository interfaces used by C{rpath_proddef}, so
+definitions can be saved, loaded, rebased and snapshotted without a
+repository server. Every repository call is counted, and can be delayed
+to simulate a slow link::
+
+    repos = FakeRepository(latency = 0.05)
+    client = FakeConaryClient(repos)
+    prd.saveToRepository(client)
+    print repos.calls['findTroves']
+
+The fake keeps everything in memory. It does not enforce permissions, does
+not verify signatures, and only understands labels, C{label/revision}
+and full version strings in trove specs.
+"""
+
+import collections
+import threading
+import time
+
+from conary import conarycfg
+from conary import versions
+from conary.deps import deps
+from conary.lib import digestlib
+from conary.repository import changeset
+from conary.repository import errors
+from conary.repository import filecontents
+
+
+class FakeTroveChangeSet(object):
+    """
+    Absolute trove changeset, as returned by
+    C{FakeChangeSet.iterNewTroveList}.
+    """
+    def __init__(self, name, version, flavor, fileList, changeLog = None):
+        self.name = name
+        self.version = version
+        self.flavor = flavor
+        self.fileList = fileList
+        self.changeLog = changeLog
+
+    def getName(self):
+        return self.name
+
+    def getNewVersion(self):
+        return self.version
+
+    def getNewFlavor(self):
+        return self.flavor
+
+    def getNewNameVersionFlavor(self):
+        return (self.name, self.version, self.flavor)
+
+    def getNewFileList(self):
+        return list(self.fileList)
+
+    def getChangeLog(self):
+        return self.changeLog
+
+
+class FakeChangeSet(object):
+    """
+    Changeset holding absolute trove changesets, the frozen file streams
+    and, optionally, the file contents.
+    """
+    def __init__(self):
+        self._troves = collections.OrderedDict()
+        self._fileStreams = {}
+        self._fileContents = {}
+
+    def _key(self, trvCs):
+        return (trvCs.getName(), str(trvCs.getNewVersion()),
+            str(trvCs.getNewFlavor()))
+
+    def newTrove(self, trvCs):
+        self._troves[self._key(trvCs)] = trvCs
+
+    def iterNewTroveList(self):
+        return iter(self._troves.values())
+
+    def addFile(self, fileId, fileStream, contents = None):
+        self._fileStreams[fileId] = fileStream
+        if contents is not None:
+            self._fileContents[fileId] = contents
+
+    def getFileChange(self, oldFileId, newFileId):
+        return self._fileStreams[newFileId]
+
+    def getFileContents(self, pathId, fileId, compressed = False):
+        if fileId not in self._fileContents:
+            raise KeyError('file contents for %s not in changeset' %
+                digestlib.sha1(fileId).hexdigest())
+        return (changeset.ChangedFileTypes.file,
+            filecontents.FromString(self._fileContents[fileId]))
+
+    def merge(self, other):
+        self._troves.update(other._troves)
+        self._fileStreams.update(other._fileStreams)
+        self._fileContents.update(other._fileContents)
+
+    def getSize(self):
+        """
+        @return: the size of the file contents in this changeset
+        @rtype: C{int}
+        """
+        return sum(len(x) for x in self._fileContents.values())
+
+
+class FakeRepository(object):
+    """
+    In-memory repository.
+    @ivar calls: Number of calls, keyed by method name
+    @type calls: C{dict}
+    @ivar bytesDownloaded: Size of the file contents returned
+    @type bytesDownloaded: C{int}
+    @ivar latency: Delay added to every call, in seconds
+    @type latency: C{float}
+    @ivar methodLatency: Per-method delays, overriding C{latency}
+    @type methodLatency: C{dict}
+    """
+    def __init__(self, latency = 0, methodLatency = None):
+        self.latency = latency
+        self.methodLatency = dict(methodLatency or {})
+        self._lock = threading.RLock()
+        self._troves = {}
+        self._fileStreams = {}
+        self._fileContents = {}
+        self._lastTimeStamp = 0
+        self.resetCounters()
+
+    def resetCounters(self):
+        """
+        Reset the call counters.
+        """
+        with self._lock:
+            self.calls = collections.defaultdict(int)
+            self.bytesDownloaded = 0
+
+    def getCallCount(self, method = None):
+        """
+        @param method: The method name. If not specified, return the
+        total number of calls (round trips).
+        @return: the number of calls
+        @rtype: C{int}
+        """
+        with self._lock:
+            if method is None:
+                return sum(self.calls.values())
+            return self.calls.get(method, 0)
+
+    def _call(self, method):
+        with self._lock:
+            self.calls[method] += 1
+        delay = self.methodLatency.get(method, self.latency)
+        if delay:
+            time.sleep(delay)
+
+    def _newTimeStamp(self):
+        with self._lock:
+            timeStamp = max(time.time(), self._lastTimeStamp + 0.001)
+            self._lastTimeStamp = timeStamp
+            return timeStamp
+
+    def _newVersion(self, label, revision):
+        return versions.ThawVersion('/%s/%.3f:%s' % (label,
+            self._newTimeStamp(), revision))
+
+    @classmethod
+    def _pathId(cls, troveName, path):
+        # Keep path ids stable across versions of a trove
+        return digestlib.md5('%s\0%s' % (troveName, path)).digest()
+
+    @classmethod
+    def _readContents(cls, fileHelper):
+        fobj = fileHelper.getContents().get()
+        if hasattr(fobj, 'seek'):
+            fobj.seek(0)
+        contents = fobj.read()
+        if hasattr(fobj, 'seek'):
+            fobj.seek(0)
+        return contents
+
+    def _buildTroveChangeSet(self, cs, name, version, flavor, pathDict,
+            changeLog = None):
+        """
+        Add a trove with the files in C{pathDict} to C{cs}. Files that did
+        not change since the previous version of the trove on the same
+        branch keep their file version.
+        """
+        prevFiles = {}
+        prev = self._getLatest(name, version.branch())
+        if prev is not None:
+            prevFiles = dict((x[1], x) for x in prev.fileList)
+        fileList = []
+        for path, fileHelper in sorted(pathDict.items()):
+            pathId = self._pathId(name, path)
+            contents = self._readContents(fileHelper)
+            fileObj = fileHelper.get(pathId)
+            fileId = fileObj.fileId()
+            fileVersion = version
+            if path in prevFiles and prevFiles[path][2] == fileId:
+                fileVersion = prevFiles[path][3]
+            fileList.append((pathId, path, fileId, fileVersion))
+            cs.addFile(fileId, fileObj.freeze(), contents)
+        cs.newTrove(FakeTroveChangeSet(name, version, flavor, fileList,
+            changeLog = changeLog))
+
+    def addTrove(self, name, label, revision, pathDict = None, flavor = None):
+        """
+        Add a trove directly to the repository, without counting a call.
+        @param pathDict: Dictionary mapping paths to
+        C{conary.conaryclient.filetypes} objects
+        @type pathDict: C{dict}
+        @return: the trove tuple
+        @rtype: C{tuple}
+        """
+        if flavor is None:
+            flavor = deps.Flavor()
+        elif isinstance(flavor, basestring):
+            flavor = deps.parseFlavor(flavor)
+        version = self._newVersion(label, revision)
+        cs = FakeChangeSet()
+        with self._lock:
+            self._buildTroveChangeSet(cs, name, version, flavor,
+                pathDict or {})
+            self._commit(cs)
+        return (name, version, flavor)
+
+    def _commit(self, cs):
+        for trvCs in cs.iterNewTroveList():
+            key = cs._key(trvCs)
+            if key in self._troves:
+                raise errors.CommitError("version %s of %s already exists" %
+                    (key[1], key[0]))
+            self._troves[key] = trvCs
+        self._fileStreams.update(cs._fileStreams)
+        self._fileContents.update(cs._fileContents)
+
+    def _iterTroves(self, name):
+        for (n, _, _), trvCs in self._troves.iteritems():
+            if n == name:
+                yield trvCs
+
+    def _getLatest(self, name, branch):
+        troves = [ x for x in self._iterTroves(name)
+            if x.version.branch() == branch ]
+        if not troves:
+            return None
+        return max(troves,
+            key = lambda x: x.version.trailingRevision().timeStamp)
+
+    def _matchVersion(self, version, versionSpec):
+        if versionSpec.startswith('/'):
+            return version.asString() == versionSpec
+        if '/' in versionSpec:
+            label, revision = versionSpec.split('/', 1)
+            trailing = version.trailingRevision()
+            if revision not in (trailing.asString(), trailing.getVersion()):
+                return False
+        else:
+            label = versionSpec
+        return str(version.trailingLabel()) == label
+
+    def _findTrove(self, troveSpec):
+        name, versionSpec, flavorSpec = troveSpec
+        troves = [ x for x in self._iterTroves(name)
+            if versionSpec is None or self._matchVersion(x.version,
+                                                         versionSpec) ]
+        if flavorSpec is not None:
+            if isinstance(flavorSpec, basestring):
+                flavorSpec = deps.parseFlavor(flavorSpec)
+            troves = [ x for x in troves if x.flavor.satisfies(flavorSpec) ]
+        if not troves:
+            return []
+        latest = max(troves,
+            key = lambda x: x.version.trailingRevision().timeStamp).version
+        return [ x.getNewNameVersionFlavor() for x in troves
+            if x.version == latest ]
+
+    def findTroves(self, labelPath, troveSpecs, defaultFlavor = None,
+            allowMissing = False, **kwargs):
+        self._call('findTroves')
+        ret = {}
+        with self._lock:
+            for troveSpec in troveSpecs:
+                found = self._findTrove(troveSpec)
+                if found:
+                    ret[troveSpec] = found
+                elif not allowMissing:
+                    raise errors.TroveNotFound("%s=%s was not found" %
+                        troveSpec[:2])
+        return ret
+
+    def findTrove(self, labelPath, troveSpec, defaultFlavor = None,
+            **kwargs):
+        ret = self.findTroves(labelPath, [ troveSpec ],
+            defaultFlavor = defaultFlavor, **kwargs)
+        return ret[troveSpec]
+
+    def _getTrove(self, name, version, flavor):
+        key = (name, str(version), str(flavor))
+        if key not in self._troves:
+            raise errors.TroveMissing(name, version)
+        return self._troves[key]
+
+    def getFileContentsFromTrove(self, n, v, f, pathList, **kwargs):
+        self._call('getFileContentsFromTrove')
+        with self._lock:
+            trvCs = self._getTrove(n, v, f)
+            fileIds = dict((x[1], x[2]) for x in trvCs.fileList)
+            missing = [ x for x in pathList if x not in fileIds ]
+            if missing:
+                raise errors.PathsNotFound(missing)
+            contents = [ self._fileContents[fileIds[x]] for x in pathList ]
+            self.bytesDownloaded += sum(len(x) for x in contents)
+        return [ filecontents.FromString(x) for x in contents ]
+
+    def getFileContents(self, fileList, **kwargs):
+        self._call('getFileContents')
+        with self._lock:
+            contents = [ self._fileContents[fileId]
+                for (fileId, fileVersion) in fileList ]
+            self.bytesDownloaded += sum(len(x) for x in contents)
+        return [ filecontents.FromString(x) for x in contents ]
+
+    def createChangeSet(self, jobList, withFiles = True,
+            withFileContents = True, recurse = True, **kwargs):
+        self._call('createChangeSet')
+        cs = FakeChangeSet()
+        with self._lock:
+            for name, (oldVersion, oldFlavor), (newVersion, newFlavor), \
+                    absolute in jobList:
+                trvCs = self._getTrove(name, newVersion, newFlavor)
+                cs.newTrove(trvCs)
+                if not withFiles:
+                    continue
+                for pathId, path, fileId, fileVersion in trvCs.fileList:
+                    contents = None
+                    if withFileContents:
+                        contents = self._fileContents[fileId]
+                    cs.addFile(fileId, self._fileStreams[fileId], contents)
+            self.bytesDownloaded += cs.getSize()
+        return cs
+
+    def commitChangeSet(self, cs, **kwargs):
+        self._call('commitChangeSet')
+        with self._lock:
+            self._commit(cs)
+
+
+class FakeConaryClient(object):
+    """
+    Conary client using a L{FakeRepository}.
+    @ivar cfg: The Conary configuration; it does not read any
+    configuration files
+    @type cfg: C{conarycfg.ConaryConfiguration}
+    """
+    def __init__(self, repos = None, cfg = None):
+        if repos is None:
+            repos = FakeRepository()
+        if cfg is None:
+            cfg = conarycfg.ConaryConfiguration(False)
+            cfg.name = 'Test User'
+            cfg.contact = 'test@example.com'
+        self.repos = repos
+        self.cfg = cfg
+
+    def getRepos(self):
+        return self.repos
+
+    def createChangeSet(self, jobList, withFiles = True,
+            withFileContents = True, recurse = True, **kwargs):
+        return self.repos.createChangeSet(jobList, withFiles = withFiles,
+            withFileContents = withFileContents, recurse = recurse)
+
+    def createSourceTrove(self, troveName, targetLabel, upstreamVersionStr,
+            pathDict, changeLog, **kwargs):
+        """
+        Create a changeset with a new source trove. Like the real client,
+        this queries the repository for the latest source count.
+        """
+        repos = self.repos
+        repos._call('createSourceTrove')
+        cs = FakeChangeSet()
+        with repos._lock:
+            branch = versions.VersionFromString('/%s' % targetLabel)
+            sourceCount = 0
+            for trvCs in repos._iterTroves(troveName):
+                if trvCs.version.branch() != branch:
+                    continue
+                revision = trvCs.version.trailingRevision()
+                if revision.getVersion() != upstreamVersionStr:
+                    continue
+                sourceCount = max(sourceCount,
+                    int(revision.asString().rsplit('-', 1)[1]))
+            version = repos._newVersion(targetLabel, '%s-%d' % (
+                upstreamVersionStr, sourceCount + 1))
+            repos._buildTroveChangeSet(cs, troveName, version, deps.Flavor(),
+                pathDict, changeLog = changeLog)
+        return cs
@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Write the member tables of the classes generated from a schema.
+
+Run by the generate target of the Makefile next to generateDS, this writes
+the C{members} module of a C{xml_*} package: for every generated class,
+the XML attributes of the class and whether the schema requires them, and
+its child elements and the kind of their values. The compiled writers of
+L{rpath_proddef.exporter} and builders of L{rpath_proddef.builder} are
+made from these tables.
+
+Usage: gends_member_tables.py rpd-X.Y.xsd > xml_X_Y/members.py
+"""
+
+import os
+import sys
+
+from lxml import etree
+
+XSD = '{http://www.w3.org/2001/XMLSchema}'
+
+# Kinds of element values
+COMPLEX = 'complex'
+SIMPLE = 'simple'
+RESTRICTED = 'restricted'
+
+
+def _localName(qname):
+    return qname.split(':')[-1]
+
+
+class SchemaTables(object):
+    def __init__(self, tree):
+        root = tree.getroot()
+        self._globals = {}
+        for tag in ('complexType', 'simpleType', 'element', 'group',
+                'attributeGroup'):
+            self._globals[tag] = dict((x.get('name'), x)
+                for x in root.findall(XSD + tag))
+        # Class name -> complexType node; anonymous types are named after
+        # their element
+        self.classes = {}
+        for node in root.iter(XSD + 'complexType'):
+            name = node.get('name')
+            if name is None:
+                name = node.getparent().get('name')
+            if name in self.classes:
+                raise RuntimeError("Two classes would be named %s" % name)
+            self.classes[name] = node
+
+    def _resolve(self, tag, node):
+        ref = node.get('ref')
+        if ref is None:
+            return node
+        return self._globals[tag][_localName(ref)]
+
+    def _elementKind(self, node):
+        node = self._resolve('element', node)
+        typeName = node.get('type')
+        if typeName is None:
+            if node.find(XSD + 'complexType') is not None:
+                return COMPLEX
+            if node.find(XSD + 'simpleType') is not None:
+                return RESTRICTED
+            return SIMPLE
+        typeName = _localName(typeName)
+        if typeName in self._globals['complexType']:
+            return COMPLEX
+        if typeName in self._globals['simpleType']:
+            return RESTRICTED
+        return SIMPLE
+
+    def _walk(self, node, attributes, elements):
+        for child in node.iterchildren(tag = etree.Element):
+            tag = child.tag
+            if tag == XSD + 'attribute':
+                child = self._resolve('attribute', child)
+                attributes.append((child.get('name'),
+                    child.get('use') == 'required'))
+            elif tag == XSD + 'attributeGroup':
+                self._walk(self._resolve('attributeGroup', child),
+                    attributes, elements)
+            elif tag == XSD + 'group':
+                self._walk(self._resolve('group', child), attributes,
+                    elements)
+            elif tag == XSD + 'element':
+                name = self._resolve('element', child).get('name')
+                elements.append((name, self._elementKind(child)))
+            elif tag in (XSD + 'sequence', XSD + 'choice', XSD + 'all',
+                    XSD + 'simpleContent', XSD + 'extension'):
+                self._walk(child, attributes, elements)
+
+    def members(self, className):
+        """
+        @return: the attributes and elements of the class
+        """
+        attributes = []
+        elements = []
+        self._walk(self.classes[className], attributes, elements)
+        return tuple(attributes), tuple(elements)
+
+
+def write(schemaPath, out):
+    tables = SchemaTables(etree.parse(schemaPath))
+    out.write('# Generated from %s by gends_member_tables.py, do not edit\n'
+        % os.path.basename(schemaPath))
+    out.write('#\n'
+        '# Class name -> (attributes, elements) of the generated class, as\n'
+        '# declared by the schema:\n'
+        '#   attributes: ((name, required), ...)\n'
+        '#   elements: ((name, kind), ...), kind being %r for elements\n'
+        '#   exported by a class of their own, %r for text of a builtin\n'
+        '#   type, and %r for text of a simple type of the schema\n'
+        % (COMPLEX, SIMPLE, RESTRICTED))
+    out.write('classes = {\n')
+    for className in sorted(tables.classes):
+        attributes, elements = tables.members(className)
+        out.write('    %r : (\n' % className)
+        for items in (attributes, elements):
+            out.write('        (\n')
+            for item in items:
+                out.write('            %r,\n' % (item, ))
+            out.write('        ),\n')
+        out.write('    ),\n')
+    out.write('}\n')
+
+
+def main(args = sys.argv[1:]):
+    if len(args) != 1:
+        sys.stderr.write(__doc__.strip().splitlines()[-1] + '\n')
+        return 1
+    write(args[0], sys.stdout)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
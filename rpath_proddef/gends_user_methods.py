@@ -260,6 +260,16 @@ platformClassifierMethods = MethodSpec('platformClassifierMethods',
     class_names = r'platformClassifierType$',
     )
 
+internedAttributesMethods = MethodSpec('internedAttributesMethods',
+    source = '''
+    # Labels, flavors and trove names repeat across many objects; share
+    # one copy of each value (see GeneratedsSuper.__setattr__)
+    internedAttributes_ = ('label', 'flavor', 'troveName')
+''',
+    class_names = (r'^(searchPathType|buildType|nameFlavorType|'
+        r'nameLabelType|promoteMapType)$'),
+    )
+
 
 METHOD_SPECS = (
     getTroveTup,
@@ -273,6 +283,7 @@ METHOD_SPECS = (
     contentProviderTypeMethods,
     platformInformationMethods,
     platformClassifierMethods,
+    internedAttributesMethods,
 )
 
 def test():
@@ -0,0 +1,220 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Sharing of identical data between loaded definitions.
+
+L{SubtreeInterner} keeps one instance of each distinct subtree of generated
+objects (the platform search paths of products rebased onto the same
+platform, for instance). Interned subtrees are shared, so they must be
+treated as read-only: every object of an interned subtree refuses to be
+modified (with L{SharedNodeError}), L{isShared} tells whether an object came
+from an interner, and the definition classes copy such objects before
+modifying them.
+
+L{StringInterner} does the same for the label, flavor and trove name
+strings of the generated objects, which intern them as they are set.
+"""
+
+import hashlib
+import StringIO
+import sys
+import threading
+import weakref
+
+from rpath_proddef import metrics
+
+
+class SharedNodeError(RuntimeError):
+    "Raised when modifying an object of an interned subtree"
+
+
+def isShared(node):
+    """
+    @return: True if C{node} may be referenced from several definitions
+    @rtype: C{bool}
+    """
+    return getattr(node, '_interned', False)
+
+def markShared(node):
+    """
+    Flag C{node} and the generated objects under it as shared, so they
+    refuse to be modified and get copied instead.
+    """
+    stack = [ node ]
+    while stack:
+        obj = stack.pop()
+        if getattr(obj, '_interned', False):
+            continue
+        obj._interned = True
+        for spec in obj.member_data_items_:
+            value = getattr(obj, spec.name, None)
+            if isinstance(value, list):
+                stack.extend(x for x in value
+                    if hasattr(x, 'member_data_items_'))
+            elif hasattr(value, 'member_data_items_'):
+                stack.append(value)
+    return node
+
+def estimateSize(obj, _seen = None):
+    """
+    @return: approximate number of bytes used by C{obj}, including the
+    generated objects, lists and strings it references
+    @rtype: C{int}
+    """
+    if _seen is None:
+        _seen = set()
+    if id(obj) in _seen:
+        return 0
+    _seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, list):
+        size += sum(estimateSize(x, _seen) for x in obj)
+    elif hasattr(obj, 'member_data_items_'):
+        size += sys.getsizeof(obj.__dict__)
+        size += sum(estimateSize(x, _seen) for x in obj.__dict__.itervalues())
+    return size
+
+
+class SubtreeInterner(object):
+    """
+    Table of shared subtrees, keyed by a digest of their XML export.
+    Entries are held through weak references, and go away once no
+    definition uses them.
+    """
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._nodes = weakref.WeakValueDictionary()
+        self.hits = self.misses = self.bytesSaved = 0
+
+    @staticmethod
+    def _key(node):
+        sio = StringIO.StringIO()
+        node.export(sio, 0)
+        nodeClass = node.__class__
+        return (nodeClass.__module__, nodeClass.__name__,
+            hashlib.sha1(sio.getvalue()).digest())
+
+    def intern(self, node):
+        """
+        @return: the shared instance of a subtree equal to C{node}; C{node}
+        itself becomes the shared instance if there is none yet
+        """
+        if node is None or isShared(node):
+            return node
+        key = self._key(node)
+        with self._lock:
+            shared = self._nodes.get(key)
+            if shared is None:
+                self._nodes[key] = markShared(node)
+                self.misses += 1
+            else:
+                self.hits += 1
+        if shared is None:
+            metrics.cacheRequests.inc(cache = self.name, result = 'miss')
+            return node
+        metrics.cacheRequests.inc(cache = self.name, result = 'hit')
+        saved = estimateSize(node)
+        with self._lock:
+            self.bytesSaved += saved
+        metrics.internedBytes.inc(saved, table = self.name)
+        return shared
+
+    def internFields(self, obj, fields):
+        """
+        Replace the C{fields} of the generated object C{obj} with their
+        shared instances.
+        """
+        for field in fields:
+            node = getattr(obj, field, None)
+            if node is None:
+                continue
+            shared = self.intern(node)
+            if shared is not node:
+                setattr(obj, field, shared)
+
+    def report(self):
+        """
+        @return: the number of live entries, lookups that found an entry
+        (C{hits}) or added one (C{misses}), and the estimated number of
+        bytes saved by the hits
+        @rtype: C{dict}
+        """
+        with self._lock:
+            return dict(entries = len(self._nodes), hits = self.hits,
+                misses = self.misses, bytesSaved = self.bytesSaved)
+
+    def clear(self):
+        with self._lock:
+            self._nodes.clear()
+            self.hits = self.misses = self.bytesSaved = 0
+
+
+class StringInterner(object):
+    """
+    Bounded table of shared strings. When the table is full it is emptied
+    and filled again, which keeps the cost of a lookup to a dictionary
+    access. C{str} and C{unicode} values are kept apart, so the type of a
+    value never changes.
+    @ivar maxSize: Maximum number of entries per string type; 0 disables
+    interning
+    @type maxSize: C{int}
+    """
+    def __init__(self, maxSize = 65536):
+        self.maxSize = maxSize
+        self._tables = { str : {}, unicode : {} }
+        self.hits = self.misses = 0
+
+    def intern(self, value):
+        """
+        @return: the shared string equal to C{value}, or C{value} itself if
+        it is not a string
+        """
+        table = self._tables.get(value.__class__)
+        if table is None:
+            return value
+        ret = table.get(value)
+        if ret is not None:
+            self.hits += 1
+            return ret
+        self.misses += 1
+        if len(table) >= self.maxSize:
+            if not self.maxSize:
+                return value
+            table.clear()
+        table[value] = value
+        return value
+
+    def report(self):
+        """
+        @return: the number of entries, and the lookups that found an entry
+        (C{hits}) or added one (C{misses}); the counts are approximate when
+        several threads intern strings at once
+        @rtype: C{dict}
+        """
+        return dict(entries = sum(len(x) for x in self._tables.values()),
+            hits = self.hits, misses = self.misses)
+
+    def clear(self):
+        for table in self._tables.values():
+            table.clear()
+        self.hits = self.misses = 0
+
+
+platformInterner = SubtreeInterner('platformSubtree')
+strings = StringInterner()
@@ -0,0 +1,272 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Counters and histograms updated by C{rpath_proddef}.
+
+The library records its metrics in the module-level L{registry}; a service
+can export them with C{registry.dumpText()} (Prometheus text exposition
+format) or C{registry.snapshot()}. Updates take a lock per metric and are
+safe to make from any thread.
+"""
+
+import bisect
+import functools
+import threading
+import time
+
+
+class _Metric(object):
+    metricType = None
+
+    def __init__(self, name, help, labelNames = ()):
+        self.name = name
+        self.help = help
+        self.labelNames = tuple(labelNames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelNames):
+            raise ValueError("%s: expected labels %s, got %s" % (self.name,
+                ', '.join(self.labelNames), ', '.join(sorted(labels))))
+        return tuple(str(labels[x]) for x in self.labelNames)
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    def _items(self):
+        with self._lock:
+            return sorted(self._copyItems())
+
+    def _formatLabels(self, key, extra = ()):
+        pairs = zip(self.labelNames, key) + list(extra)
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (n, _escape(v))
+            for (n, v) in pairs)
+
+    def _labelDict(self, key):
+        return dict(zip(self.labelNames, key))
+
+
+class Counter(_Metric):
+    """
+    Monotonically increasing value.
+    """
+    metricType = 'counter'
+
+    def inc(self, amount = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        key = self._key(labels)
+        with self._lock:
+            return self._values.get(key, 0)
+
+    def _copyItems(self):
+        return self._values.items()
+
+    def _textLines(self):
+        for key, value in self._items():
+            yield '%s%s %s' % (self.name, self._formatLabels(key),
+                _formatValue(value))
+
+    def _snapshot(self):
+        return [ dict(labels = self._labelDict(key), value = value)
+            for (key, value) in self._items() ]
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values, in cumulative buckets.
+    """
+    metricType = 'histogram'
+    DefaultBuckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5,
+        10)
+
+    def __init__(self, name, help, labelNames = (), buckets = None):
+        _Metric.__init__(self, name, help, labelNames)
+        self.buckets = tuple(sorted(buckets or self.DefaultBuckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # Per-bucket counts, then the sum
+                entry = self._values[key] = [0] * (len(self.buckets) + 1) + \
+                    [0.0]
+            entry[idx] += 1
+            entry[-1] += value
+
+    def time(self, **labels):
+        """
+        Decorator observing the duration of each call of the function.
+        """
+        key = self._key(labels)
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.time()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(time.time() - start,
+                        **dict(zip(self.labelNames, key)))
+            return wrapper
+        return decorator
+
+    def _copyItems(self):
+        return [ (k, list(v)) for (k, v) in self._values.items() ]
+
+    def _cumulative(self, entry):
+        counts = []
+        total = 0
+        for count in entry[:-1]:
+            total += count
+            counts.append(total)
+        return counts
+
+    def _textLines(self):
+        bounds = [ _formatValue(x) for x in self.buckets ] + [ '+Inf' ]
+        for key, entry in self._items():
+            counts = self._cumulative(entry)
+            for bound, count in zip(bounds, counts):
+                yield '%s_bucket%s %d' % (self.name,
+                    self._formatLabels(key, [('le', bound)]), count)
+            labels = self._formatLabels(key)
+            yield '%s_sum%s %s' % (self.name, labels, _formatValue(entry[-1]))
+            yield '%s_count%s %d' % (self.name, labels, counts[-1])
+
+    def _snapshot(self):
+        ret = []
+        for key, entry in self._items():
+            counts = self._cumulative(entry)
+            ret.append(dict(labels = self._labelDict(key),
+                buckets = zip(self.buckets + (float('inf'), ), counts),
+                sum = entry[-1], count = counts[-1]))
+        return ret
+
+
+class MetricsRegistry(object):
+    """
+    Collection of named metrics.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _register(self, metricClass, name, help, labelNames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metricClass(name, help,
+                    labelNames, **kwargs)
+            elif not isinstance(metric, metricClass) or \
+                    metric.labelNames != tuple(labelNames):
+                raise ValueError("Metric %s already registered with a "
+                    "different type or labels" % name)
+            return metric
+
+    def counter(self, name, help, labelNames = ()):
+        """
+        @return: the counter C{name}, creating it if needed
+        @rtype: L{Counter}
+        """
+        return self._register(Counter, name, help, labelNames)
+
+    def histogram(self, name, help, labelNames = (), buckets = None):
+        """
+        @return: the histogram C{name}, creating it if needed
+        @rtype: L{Histogram}
+        """
+        return self._register(Histogram, name, help, labelNames,
+            buckets = buckets)
+
+    def get(self, name):
+        with self._lock:
+            return self._metrics.get(name)
+
+    def _sortedMetrics(self):
+        with self._lock:
+            return [ self._metrics[x] for x in sorted(self._metrics) ]
+
+    def reset(self):
+        """
+        Reset all values. The metrics stay registered.
+        """
+        for metric in self._sortedMetrics():
+            metric.reset()
+
+    def dumpText(self):
+        """
+        @return: all metrics, in the Prometheus text exposition format
+        @rtype: C{str}
+        """
+        lines = []
+        for metric in self._sortedMetrics():
+            lines.append('# HELP %s %s' % (metric.name,
+                metric.help.replace('\\', r'\\').replace('\n', r'\n')))
+            lines.append('# TYPE %s %s' % (metric.name, metric.metricType))
+            lines.extend(metric._textLines())
+        return ''.join(x + '\n' for x in lines)
+
+    def snapshot(self):
+        """
+        @return: dictionary mapping metric names to their type, help and
+        samples
+        @rtype: C{dict}
+        """
+        return dict((x.name, dict(type = x.metricType, help = x.help,
+                samples = x._snapshot()))
+            for x in self._sortedMetrics())
+
+
+def _escape(value):
+    return value.replace('\\', r'\\').replace('"', r'\"').replace(
+        '\n', r'\n')
+
+def _formatValue(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value)
+    return str(value)
+
+
+registry = MetricsRegistry()
+
+documentParses = registry.counter('rpath_proddef_document_parses_total',
+    "Definition documents parsed, by schema version", ['schema_version'])
+migrationHops = registry.counter('rpath_proddef_migration_hops_total',
+    "Schema migration steps applied", ['direction'])
+cacheRequests = registry.counter('rpath_proddef_cache_requests_total',
+    "Cache lookups, by cache and result (hit or miss)", ['cache', 'result'])
+repositoryCalls = registry.counter('rpath_proddef_repository_calls_total',
+    "Conary repository calls, by method", ['method'])
+downloadedBytes = registry.counter('rpath_proddef_downloaded_bytes_total',
+    "Bytes of definition documents downloaded from repositories")
+internedBytes = registry.counter('rpath_proddef_interned_bytes_saved_total',
+    "Estimated bytes saved by sharing identical data, by intern table",
+    ['table'])
+operationSeconds = registry.histogram('rpath_proddef_operation_seconds',
+    "Duration of repository-backed operations", ['operation'])
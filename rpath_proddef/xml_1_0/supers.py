@@ -3305,6 +3305,10 @@ class buildType(GeneratedsSuper):
         return imageType.subclass.factory(**fields)
 
     getBuildName = get_name
+
+    # Labels, flavors and trove names repeat across many objects; share
+    # one copy of each value (see GeneratedsSuper.__setattr__)
+    internedAttributes_ = ('label', 'flavor', 'troveName')
 # end class buildType
 
 
@@ -483,6 +483,10 @@ class searchPathType(GeneratedsSuper):
             if self.version:
                 version += '/' + self.version
             return (self.troveName, version, None)
+
+    # Labels, flavors and trove names repeat across many objects; share
+    # one copy of each value (see GeneratedsSuper.__setattr__)
+    internedAttributes_ = ('label', 'flavor', 'troveName')
 # end class searchPathType
 
 
@@ -3333,6 +3337,10 @@ class buildType(GeneratedsSuper):
         return imageType.subclass.factory(**fields)
 
     getBuildName = get_name
+
+    # Labels, flavors and trove names repeat across many objects; share
+    # one copy of each value (see GeneratedsSuper.__setattr__)
+    internedAttributes_ = ('label', 'flavor', 'troveName')
 # end class buildType
 
 
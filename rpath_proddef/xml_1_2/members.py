@@ -0,0 +1,339 @@
+# Generated from rpd-1.2.xsd by gends_member_tables.py, do not edit
+#
+# Class name -> (attributes, elements) of the generated class, as
+# declared by the schema:
+#   attributes: ((name, required), ...)
+#   elements: ((name, kind), ...), kind being 'complex' for elements
+#   exported by a class of their own, 'simple' for text of a builtin
+#   type, and 'restricted' for text of a simple type of the schema
+classes = {
+    'amiImageType' : (
+        (
+            ('name', False),
+            ('autoResolve', False),
+            ('baseFileName', False),
+            ('installLabelPath', False),
+            ('amiHugeDiskMountpoint', False),
+            ('freespace', False),
+        ),
+        (
+        ),
+    ),
+    'applianceIsoImageType' : (
+        (
+            ('name', False),
+            ('autoResolve', False),
+            ('baseFileName', False),
+            ('installLabelPath', False),
+            ('maxIsoSize', False),
+            ('bugsUrl', False),
+            ('showMediaCheck', False),
+            ('betaNag', False),
+            ('mediaTemplateTrove', False),
+            ('anacondaCustomTrove', False),
+            ('anacondaTemplatesTrove', False),
+        ),
+        (
+        ),
+    ),
+    'architecturesType' : (
+        (
+        ),
+        (
+            ('architecture', 'complex'),
+        ),
+    ),
+    'buildDefinitionType' : (
+        (
+        ),
+        (
+            ('build', 'complex'),
+        ),
+    ),
+    'buildType' : (
+        (
+            ('name', True),
+            ('baseFlavor', False),
+            ('architectureRef', False),
+            ('imageTemplateRef', False),
+            ('flavor', False),
+        ),
+        (
+            ('amiImage', 'complex'),
+            ('applianceIsoImage', 'complex'),
+            ('installableIsoImage', 'complex'),
+            ('liveIsoImage', 'complex'),
+            ('netbootImage', 'complex'),
+            ('rawFsImage', 'complex'),
+            ('rawHdImage', 'complex'),
+            ('tarballImage', 'complex'),
+            ('updateIsoImage', 'complex'),
+            ('vhdImage', 'complex'),
+            ('virtualIronImage', 'complex'),
+            ('vmwareImage', 'complex'),
+            ('vmwareEsxImage', 'complex'),
+            ('xenOvaImage', 'complex'),
+            ('stage', 'complex'),
+            ('imageGroup', 'restricted'),
+        ),
+    ),
+    'factorySourceListType' : (
+        (
+        ),
+        (
+            ('factorySource', 'complex'),
+        ),
+    ),
+    'imageTemplatesType' : (
+        (
+        ),
+        (
+            ('imageTemplate', 'complex'),
+        ),
+    ),
+    'installableIsoImageType' : (
+        (
+            ('name', False),
+            ('autoResolve', False),
+            ('baseFileName', False),
+            ('installLabelPath', False),
+            ('maxIsoSize', False),
+            ('bugsUrl', False),
+            ('showMediaCheck', False),
+            ('betaNag', False),
+            ('mediaTemplateTrove', False),
+            ('anacondaCustomTrove', False),
+            ('anacondaTemplatesTrove', False),
+        ),
+        (
+        ),
+    ),
+    'liveIsoImageType' : (
+        (
+            ('name', False),
+            ('autoResolve', False),
+            ('baseFileName', False),
+            ('installLabelPath', False),
+            ('unionfs', False),
+            ('zisofs', False),
+        ),
+        (
+        ),
+    ),
+    'nameFlavorType' : (
+        (
+            ('name', True),
+            ('flavor', True),
+        ),
+        (
+        ),
+    ),
+    'netbootImageType' : (
+        (
+            ('name', False),
+            ('autoResolve', False),
+            ('baseFileName', False),
+            ('installLabelPath', False),
+        ),
+        (
+        ),
+    ),
+    'platformDefinitionType' : (
+        (
+            ('version', False),
+        ),
+        (
+            ('baseFlavor', 'restricted'),
+            ('searchPaths', 'complex'),
+            ('factorySources', 'complex'),
+            ('architectures', 'complex'),
+            ('imageTemplates', 'complex'),
+        ),
+    ),
+    'platformType' : (
+        (
+            ('sourceTrove', False),
+            ('useLatest', False),
+        ),
+        (
+            ('baseFlavor', 'restricted'),
+            ('searchPaths', 'complex'),
+            ('factorySources', 'complex'),
+            ('architectures', 'complex'),
+            ('imageTemplates', 'complex'),
+        ),
+    ),
+    'productDefinition' : (
+        (
+            ('version', False),
+        ),
+        (
+            ('productName', 'simple'),
+            ('productShortname', 'simple'),
+            ('productDescription', 'simple'),
+            ('productVersion', 'simple'),
+            ('productVersionDescription', 'simple'),
+            ('conaryRepositoryHostname', 'simple'),
+            ('conaryNamespace', 'simple'),
+            ('imageGroup', 'restricted'),
+            ('baseFlavor', 'restricted'),
+            ('stages', 'complex'),
+            ('searchPaths', 'complex'),
+            ('factorySources', 'complex'),
+            ('architectures', 'complex'),
+            ('imageTemplates', 'complex'),
+            ('buildDefinition', 'complex'),
+            ('platform', 'complex'),
+        ),
+    ),
+    'rawFsImageType' : (
+        (
+            ('name', False),
+            ('autoResolve', False),
+            ('baseFileName', False),
+            ('installLabelPath', False),
+            ('swapSize', False),
+            ('freespace', False),
+        ),
+        (
+        ),
+    ),
+    'rawHdImageType' : (
+        (
+            ('name', False),
+            ('autoResolve', False),
+            ('baseFileName', False),
+            ('installLabelPath', False),
+            ('swapSize', False),
+            ('freespace', False),
+        ),
+        (
+        ),
+    ),
+    'searchPathListType' : (
+        (
+        ),
+        (
+            ('searchPath', 'complex'),
+        ),
+    ),
+    'searchPathType' : (
+        (
+            ('troveName', False),
+            ('label', False),
+            ('version', False),
+        ),
+        (
+        ),
+    ),
+    'stage' : (
+        (
+            ('ref', True),
+        ),
+        (
+        ),
+    ),
+    'stageListType' : (
+        (
+        ),
+        (
+            ('stage', 'complex'),
+        ),
+    ),
+    'stageType' : (
+        (
+            ('name', True),
+            ('labelSuffix', True),
+        ),
+        (
+        ),
+    ),
+    'tarballImageType' : (
+        (
+            ('name', False),
+            ('autoResolve', False),
+            ('baseFileName', False),
+            ('installLabelPath', False),
+            ('swapSize', False),
+        ),
+        (
+        ),
+    ),
+    'updateIsoImageType' : (
+        (
+            ('baseFileName', False),
+            ('mediaTemplateTrove', False),
+        ),
+        (
+        ),
+    ),
+    'vhdImageType' : (
+        (
+            ('name', False),
+            ('autoResolve', False),
+            ('baseFileName', False),
+            ('installLabelPath', False),
+            ('swapSize', False),
+            ('freespace', False),
+            ('vhdDiskType', False),
+        ),
+        (
+        ),
+    ),
+    'virtualIronImageType' : (
+        (
+            ('name', False),
+            ('autoResolve', False),
+            ('baseFileName', False),
+            ('installLabelPath', False),
+            ('swapSize', False),
+            ('freespace', False),
+            ('vhdDiskType', False),
+        ),
+        (
+        ),
+    ),
+    'vmwareEsxImageType' : (
+        (
+            ('name', False),
+            ('autoResolve', False),
+            ('baseFileName', False),
+            ('installLabelPath', False),
+            ('swapSize', False),
+            ('freespace', False),
+            ('natNetworking', False),
+            ('vmMemory', False),
+        ),
+        (
+        ),
+    ),
+    'vmwareImageType' : (
+        (
+            ('name', False),
+            ('autoResolve', False),
+            ('baseFileName', False),
+            ('installLabelPath', False),
+            ('swapSize', False),
+            ('freespace', False),
+            ('natNetworking', False),
+            ('diskAdapter', False),
+            ('vmSnapshots', False),
+            ('vmMemory', False),
+        ),
+        (
+        ),
+    ),
+    'xenOvaImageType' : (
+        (
+            ('name', False),
+            ('autoResolve', False),
+            ('baseFileName', False),
+            ('installLabelPath', False),
+            ('swapSize', False),
+            ('freespace', False),
+            ('vmMemory', False),
+        ),
+        (
+        ),
+    ),
+}
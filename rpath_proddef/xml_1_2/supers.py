@@ -483,6 +483,10 @@ class searchPathType(GeneratedsSuper):
             if self.version:
                 version += '/' + self.version
             return (self.troveName, version, None)
+
+    # Labels, flavors and trove names repeat across many objects; share
+    # one copy of each value (see GeneratedsSuper.__setattr__)
+    internedAttributes_ = ('label', 'flavor', 'troveName')
 # end class searchPathType
 
 
@@ -3366,6 +3370,10 @@ class buildType(GeneratedsSuper):
         return imageType.subclass.factory(**fields)
 
     getBuildName = get_name
+
+    # Labels, flavors and trove names repeat across many objects; share
+    # one copy of each value (see GeneratedsSuper.__setattr__)
+    internedAttributes_ = ('label', 'flavor', 'troveName')
 # end class buildType
 
 
@@ -3852,6 +3860,10 @@ class nameFlavorType(GeneratedsSuper):
             self.valueOf_ += child_.nodeValue
         elif child_.nodeType == Node.CDATA_SECTION_NODE:
             self.valueOf_ += '![CDATA['+child_.nodeValue+']]'
+
+    # Labels, flavors and trove names repeat across many objects; share
+    # one copy of each value (see GeneratedsSuper.__setattr__)
+    internedAttributes_ = ('label', 'flavor', 'troveName')
 # end class nameFlavorType
 
 
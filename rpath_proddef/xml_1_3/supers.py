@@ -458,6 +458,10 @@ class nameLabelType(GeneratedsSuper):
 
     getTroveName = get_troveName
     getLabel = get_label
+
+    # Labels, flavors and trove names repeat across many objects; share
+    # one copy of each value (see GeneratedsSuper.__setattr__)
+    internedAttributes_ = ('label', 'flavor', 'troveName')
 # end class nameLabelType
 
 
@@ -575,6 +579,10 @@ class searchPathType(GeneratedsSuper):
             if self.version:
                 version += '/' + self.version
             return (self.troveName, version, None)
+
+    # Labels, flavors and trove names repeat across many objects; share
+    # one copy of each value (see GeneratedsSuper.__setattr__)
+    internedAttributes_ = ('label', 'flavor', 'troveName')
 # end class searchPathType
 
 
@@ -3539,6 +3547,10 @@ class buildType(GeneratedsSuper):
         return imageType.subclass.factory(**fields)
 
     getBuildName = get_name
+
+    # Labels, flavors and trove names repeat across many objects; share
+    # one copy of each value (see GeneratedsSuper.__setattr__)
+    internedAttributes_ = ('label', 'flavor', 'troveName')
 # end class buildType
 
 
@@ -3950,6 +3962,10 @@ class promoteMapType(GeneratedsSuper):
 
     getMapName = get_name
     getMapLabel = get_label
+
+    # Labels, flavors and trove names repeat across many objects; share
+    # one copy of each value (see GeneratedsSuper.__setattr__)
+    internedAttributes_ = ('label', 'flavor', 'troveName')
 # end class promoteMapType
 
 
@@ -4463,6 +4479,10 @@ class nameFlavorType(GeneratedsSuper):
             self.valueOf_ += child_.nodeValue
         elif child_.nodeType == Node.CDATA_SECTION_NODE:
             self.valueOf_ += '![CDATA['+child_.nodeValue+']]'
+
+    # Labels, flavors and trove names repeat across many objects; share
+    # one copy of each value (see GeneratedsSuper.__setattr__)
+    internedAttributes_ = ('label', 'flavor', 'troveName')
 # end class nameFlavorType
 
 
@@ -0,0 +1,266 @@
+# Generated from rpd-2.0.xsd by gends_member_tables.py, do not edit
+#
+# Class name -> (attributes, elements) of the generated class, as
+# declared by the schema:
+#   attributes: ((name, required), ...)
+#   elements: ((name, kind), ...), kind being 'complex' for elements
+#   exported by a class of their own, 'simple' for text of a builtin
+#   type, and 'restricted' for text of a simple type of the schema
+classes = {
+    'architecturesType' : (
+        (
+        ),
+        (
+            ('architecture', 'complex'),
+        ),
+    ),
+    'autoLoadRecipesType' : (
+        (
+        ),
+        (
+            ('autoLoadRecipe', 'complex'),
+        ),
+    ),
+    'buildDefinitionType' : (
+        (
+        ),
+        (
+            ('build', 'complex'),
+        ),
+    ),
+    'buildTemplateType' : (
+        (
+            ('name', False),
+            ('displayName', False),
+            ('architectureRef', False),
+            ('containerTemplateRef', False),
+            ('flavorSetRef', False),
+        ),
+        (
+        ),
+    ),
+    'buildTemplatesType' : (
+        (
+        ),
+        (
+            ('buildTemplate', 'complex'),
+        ),
+    ),
+    'buildType' : (
+        (
+            ('name', True),
+            ('architectureRef', False),
+            ('flavorSetRef', False),
+            ('containerTemplateRef', False),
+            ('flavor', False),
+        ),
+        (
+            ('image', 'complex'),
+            ('stage', 'complex'),
+            ('imageGroup', 'restricted'),
+            ('sourceGroup', 'restricted'),
+        ),
+    ),
+    'containerTemplatesType' : (
+        (
+        ),
+        (
+            ('image', 'complex'),
+        ),
+    ),
+    'factorySourceListType' : (
+        (
+        ),
+        (
+            ('factorySource', 'complex'),
+        ),
+    ),
+    'flavorSetsType' : (
+        (
+        ),
+        (
+            ('flavorSet', 'complex'),
+        ),
+    ),
+    'imageType' : (
+        (
+            ('containerFormat', False),
+            ('diskAdapter', False),
+            ('vhdDiskType', False),
+            ('vhdDisktype', False),
+            ('amiHugeDiskMountPoint', False),
+            ('amiHugeDiskMountpoint', False),
+            ('anacondaCustomTrove', False),
+            ('anacondaTemplatesTrove', False),
+            ('autoResolve', False),
+            ('baseFileName', False),
+            ('betaNag', False),
+            ('bugsUrl', False),
+            ('buildOVF10', False),
+            ('freespace', False),
+            ('installLabelPath', False),
+            ('maxIsoSize', False),
+            ('mediaTemplateTrove', False),
+            ('name', False),
+            ('natNetworking', False),
+            ('showMediaCheck', False),
+            ('swapSize', False),
+            ('unionfs', False),
+            ('vmMemory', False),
+            ('vmSnapshots', False),
+            ('zisofs', False),
+        ),
+        (
+        ),
+    ),
+    'nameFlavorType' : (
+        (
+            ('name', True),
+            ('displayName', True),
+            ('flavor', True),
+        ),
+        (
+        ),
+    ),
+    'nameLabelType' : (
+        (
+            ('troveName', False),
+            ('label', False),
+        ),
+        (
+        ),
+    ),
+    'platformDefinitionType' : (
+        (
+            ('version', False),
+        ),
+        (
+            ('platformName', 'simple'),
+            ('platformVersionTrove', 'simple'),
+            ('baseFlavor', 'restricted'),
+            ('searchPaths', 'complex'),
+            ('factorySources', 'complex'),
+            ('autoLoadRecipes', 'complex'),
+            ('architectures', 'complex'),
+            ('flavorSets', 'complex'),
+            ('containerTemplates', 'complex'),
+            ('buildTemplates', 'complex'),
+        ),
+    ),
+    'platformType' : (
+        (
+            ('sourceTrove', False),
+            ('useLatest', False),
+        ),
+        (
+            ('platformName', 'simple'),
+            ('platformVersionTrove', 'simple'),
+            ('baseFlavor', 'restricted'),
+            ('searchPaths', 'complex'),
+            ('factorySources', 'complex'),
+            ('autoLoadRecipes', 'complex'),
+            ('architectures', 'complex'),
+            ('flavorSets', 'complex'),
+            ('containerTemplates', 'complex'),
+            ('buildTemplates', 'complex'),
+        ),
+    ),
+    'productDefinition' : (
+        (
+            ('version', False),
+        ),
+        (
+            ('productName', 'simple'),
+            ('productShortname', 'simple'),
+            ('productDescription', 'simple'),
+            ('productVersion', 'simple'),
+            ('productVersionDescription', 'simple'),
+            ('conaryRepositoryHostname', 'simple'),
+            ('conaryNamespace', 'simple'),
+            ('imageGroup', 'restricted'),
+            ('sourceGroup', 'restricted'),
+            ('baseLabel', 'simple'),
+            ('baseFlavor', 'restricted'),
+            ('stages', 'complex'),
+            ('searchPaths', 'complex'),
+            ('factorySources', 'complex'),
+            ('secondaryLabels', 'complex'),
+            ('architectures', 'complex'),
+            ('flavorSets', 'complex'),
+            ('containerTemplates', 'complex'),
+            ('buildTemplates', 'complex'),
+            ('buildDefinition', 'complex'),
+            ('platform', 'complex'),
+        ),
+    ),
+    'promoteMapType' : (
+        (
+            ('name', True),
+            ('label', True),
+        ),
+        (
+        ),
+    ),
+    'promoteMapsType' : (
+        (
+        ),
+        (
+            ('promoteMap', 'complex'),
+        ),
+    ),
+    'searchPathListType' : (
+        (
+        ),
+        (
+            ('searchPath', 'complex'),
+        ),
+    ),
+    'searchPathType' : (
+        (
+            ('troveName', False),
+            ('label', False),
+            ('version', False),
+            ('isResolveTrove', False),
+            ('isGroupSearchPathTrove', False),
+        ),
+        (
+        ),
+    ),
+    'secondaryLabel' : (
+        (
+            ('name', True),
+        ),
+        (
+        ),
+    ),
+    'secondaryLabelsType' : (
+        (
+        ),
+        (
+            ('secondaryLabel', 'complex'),
+        ),
+    ),
+    'stage' : (
+        (
+            ('ref', True),
+        ),
+        (
+        ),
+    ),
+    'stageListType' : (
+        (
+        ),
+        (
+            ('stage', 'complex'),
+        ),
+    ),
+    'stageType' : (
+        (
+            ('name', True),
+            ('labelSuffix', True),
+        ),
+        (
+            ('promoteMaps', 'complex'),
+        ),
+    ),
+}
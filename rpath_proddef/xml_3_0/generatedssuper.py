@@ -15,7 +15,208 @@
 #
 
 
+import functools
+import StringIO
+import weakref
+
+from rpath_proddef import builder
+from rpath_proddef import exporter
+from rpath_proddef import interning
+
+# Attributes whose setting makes an object observed (see GeneratedsSuper)
+_observerNames = frozenset([ '_parent_', '_fragment_', '_generation_',
+    '_writeHook_', '_interned' ])
+
+
+class _TrackedList(list):
+    """
+    Value of a list member. Changes are reported to the object holding the
+    list, which also becomes the parent of the generated objects added.
+    """
+    __slots__ = [ '_owner' ]
+
+    def __init__(self, owner, items = ()):
+        list.__init__(self, items)
+        self._owner = weakref.ref(owner)
+        for item in self:
+            if isinstance(item, GeneratedsSuper):
+                item._adopt_(owner)
+
+    def _checkWritable(self):
+        owner = self._owner()
+        if owner is not None and owner._observed_:
+            owner._checkWritable_()
+
+    def _changed(self, items = ()):
+        owner = self._owner()
+        if owner is None:
+            return
+        for item in items:
+            if isinstance(item, GeneratedsSuper):
+                item._adopt_(owner)
+        if owner._observed_:
+            owner._setModified_()
+
+    def __reduce_ex__(self, protocol):
+        # Pickle and copy as a plain list; assigning it to the member
+        # again tracks it
+        return (list, (list(self), ))
+
+    def append(self, item):
+        self._checkWritable()
+        list.append(self, item)
+        self._changed((item, ))
+
+    def extend(self, items):
+        self._checkWritable()
+        items = list(items)
+        list.extend(self, items)
+        self._changed(items)
+
+    def __iadd__(self, items):
+        self.extend(items)
+        return self
+
+    def insert(self, index, item):
+        self._checkWritable()
+        list.insert(self, index, item)
+        self._changed((item, ))
+
+    def __setitem__(self, index, item):
+        self._checkWritable()
+        list.__setitem__(self, index, item)
+        if isinstance(index, slice):
+            self._changed(self[index])
+        else:
+            self._changed((item, ))
+
+    def __setslice__(self, i, j, items):
+        self._checkWritable()
+        items = list(items)
+        list.__setslice__(self, i, j, items)
+        self._changed(items)
+
+    def __delitem__(self, index):
+        self._checkWritable()
+        list.__delitem__(self, index)
+        self._changed()
+
+    def __delslice__(self, i, j):
+        self._checkWritable()
+        list.__delslice__(self, i, j)
+        self._changed()
+
+    def __imul__(self, count):
+        self._checkWritable()
+        list.__imul__(self, count)
+        self._changed()
+        return self
+
+    def remove(self, item):
+        self._checkWritable()
+        list.remove(self, item)
+        self._changed()
+
+    def pop(self, *args):
+        self._checkWritable()
+        ret = list.pop(self, *args)
+        self._changed()
+        return ret
+
+    def sort(self, *args, **kwargs):
+        self._checkWritable()
+        list.sort(self, *args, **kwargs)
+        self._changed()
+
+    def reverse(self):
+        self._checkWritable()
+        list.reverse(self)
+        self._changed()
+
+
+def _cachedExport(export):
+    # The output comes from the writer compiled for the class, if there is
+    # one (see rpath_proddef.exporter), or from the generated method
+    @functools.wraps(export)
+    def wrapper(self, outfile, level, *args, **kwargs):
+        key = (level, args, tuple(sorted(kwargs.items())))
+        fragment = getattr(self, '_fragment_', None)
+        if fragment is not None and fragment[0] == key:
+            outfile.write(fragment[1])
+            return
+        writer = exporter.getWriter(self.__class__)
+        if writer is None:
+            sio = StringIO.StringIO()
+            export(self, sio, level, *args, **kwargs)
+            text = sio.getvalue()
+        else:
+            text = writer(self, level, *args, **kwargs)
+        if self.cachesExport_():
+            self._fragment_ = (key, text)
+        outfile.write(text)
+    wrapper.__wrapped__ = export
+    return wrapper
+
+
+def _dispatchedBuild(build):
+    # Build through the dispatch table of the class, if there is one (see
+    # rpath_proddef.builder), or through the generated method
+    @functools.wraps(build)
+    def wrapper(self, node_):
+        classBuilder = builder.getBuilder(self.__class__)
+        if classBuilder is None:
+            build(self, node_)
+        else:
+            classBuilder(self, node_)
+    wrapper.__wrapped__ = build
+    return wrapper
+
+
+class _TrackingMeta(type):
+    """
+    Derive the names of the tracked attributes from the member specs, look
+    up the interned attributes in a set, cache the output of export, and
+    build through dispatch tables.
+    """
+    def __init__(cls, name, bases, attrs):
+        type.__init__(cls, name, bases, attrs)
+        items = attrs.get('member_data_items_')
+        if items is not None:
+            cls.trackedNames_ = frozenset([ x.name for x in items ] +
+                [ 'valueOf_' ])
+        interned = attrs.get('internedAttributes_')
+        if interned:
+            cls.internedAttributes_ = frozenset(interned)
+        if 'export' in attrs:
+            cls.export = _cachedExport(attrs['export'])
+        if 'build' in attrs:
+            cls.build = _dispatchedBuild(attrs['build'])
+
+
 class GeneratedsSuper(object):
+    # Change tracking: assigning a member, or changing the list held by a
+    # member, drops the cached export output of the object and of all its
+    # parents, and bumps the generation of the tracked objects among them
+    # (see getGeneration_). Only the objects without a parent and their
+    # children cache their output (see cachesExport_). Parents are held
+    # through weak references. A callable set as the _writeHook_ of an
+    # object without parents is called with the object before it or one of
+    # its children is modified, and refuses the change by raising an
+    # exception. Objects of interned subtrees refuse to be modified (see
+    # rpath_proddef.interning).
+    # Until it gets a parent, a generation, cached output, a write hook or
+    # is interned, nothing can observe the changes made to an object, which
+    # are not checked or reported then; this leaves the objects being
+    # initialized and built alone.
+    __metaclass__ = _TrackingMeta
+    __slots__ = [ '_parent_', '_fragment_', '_generation_',
+        '_cleanGeneration_', '_writeHook_', '__weakref__' ]
+    _observed_ = False
+    trackedNames_ = frozenset()
+    # Names of the attributes whose string values are shared through
+    # rpath_proddef.interning.strings (set per class by gends_user_methods)
+    internedAttributes_ = frozenset()
+
     def format_string(self, input_data, input_name=''):
         return input_data
     def format_integer(self, input_data, input_name=''):
@@ -61,7 +262,169 @@ class GeneratedsSuper(object):
                     if hasattr(v, '__copy__'):
                         v = v.__copy__()
                     ret.append(v)
+                val = ret
             elif hasattr(val, '__copy__'):
                 val = val.__copy__()
             setattr(newobj, field, val)
         return newobj
+
+    def __getstate__(self):
+        # Pickle the field values in member order. Other public attributes
+        # (set by api1 on build objects, for instance) are appended as a
+        # dictionary, only if there are any.
+        fields = [ x.name for x in self.member_data_items_ ]
+        state = tuple(getattr(self, x) for x in fields)
+        if len(self.__dict__) > len(fields):
+            fieldSet = set(fields)
+            extras = dict((k, v) for (k, v) in self.__dict__.iteritems()
+                if k not in fieldSet and not k.startswith('_'))
+            if extras:
+                state += (extras, )
+        return state
+
+    def __setstate__(self, state):
+        items = self.member_data_items_
+        for spec, val in zip(items, state):
+            setattr(self, spec.name, val)
+        if len(state) > len(items):
+            self.__dict__.update(state[-1])
+
+    def __setattr__(self, name, value):
+        if value is None:
+            if not self._observed_:
+                # Most members of new objects; nothing to intern or track
+                object.__setattr__(self, name, value)
+                return
+        elif name in self.internedAttributes_:
+            value = interning.strings.intern(value)
+        if name not in self.trackedNames_:
+            object.__setattr__(self, name, value)
+            if name in _observerNames:
+                object.__setattr__(self, '_observed_', True)
+            return
+        observed = self._observed_
+        if observed:
+            self._checkWritable_()
+        if value is None:
+            pass
+        elif isinstance(value, list):
+            value = _TrackedList(self, value)
+        elif isinstance(value, GeneratedsSuper):
+            value._adopt_(self)
+        object.__setattr__(self, name, value)
+        if observed:
+            self._setModified_()
+
+    def _checkWritable_(self):
+        # Called before the object is modified
+        if getattr(self, '_interned', False):
+            raise interning.SharedNodeError("%s is shared between definitions"
+                " and cannot be modified" % self.__class__.__name__)
+        parent = getattr(self, '_parent_', None)
+        if parent is None:
+            hook = getattr(self, '_writeHook_', None)
+            if hook is not None:
+                hook(self)
+        elif isinstance(parent, weakref.ref):
+            parent = parent()
+            if parent is not None:
+                parent._checkWritable_()
+        else:
+            for node in list(parent):
+                node._checkWritable_()
+
+    def _adopt_(self, parent):
+        ref = weakref.ref(parent)
+        current = getattr(self, '_parent_', None)
+        if current is ref:
+            return
+        # Output cached before the object had this parent may no longer
+        # be wanted (see cachesExport_)
+        self._fragment_ = None
+        if current is None:
+            self._parent_ = ref
+        elif isinstance(current, weakref.ref):
+            # Referenced from more than one object (shared defaults, or
+            # items moved to a new container)
+            old = current()
+            if old is None:
+                self._parent_ = ref
+            else:
+                self._parent_ = weakref.WeakSet([ old, parent ])
+        else:
+            current.add(parent)
+
+    def _setModified_(self):
+        self._fragment_ = None
+        generation = getattr(self, '_generation_', None)
+        if generation is not None:
+            self._generation_ = generation + 1
+        parent = getattr(self, '_parent_', None)
+        if parent is None:
+            return
+        if isinstance(parent, weakref.ref):
+            parent = parent()
+            if parent is not None:
+                parent._setModified_()
+        else:
+            for node in list(parent):
+                node._setModified_()
+
+    @classmethod
+    def getMemberTable_(cls):
+        """
+        @return: the attributes and elements of this generated class, from
+        the C{members} module written next to it by gends_member_tables, or
+        C{None} if there is no table for it
+        """
+        package = cls.__module__.rpartition('.')[0]
+        if not package:
+            return None
+        moduleName = package + '.members'
+        try:
+            module = __import__(moduleName, {}, None, [ 'classes' ])
+        except ImportError:
+            return None
+        return module.classes.get(cls.__name__)
+
+    def cachesExport_(self):
+        """
+        @return: True if the output of export is kept for this object. Only
+        the objects without a parent and the objects directly under them
+        keep it, so the cache holds at most about twice the exported text.
+        """
+        parent = getattr(self, '_parent_', None)
+        if parent is None:
+            return True
+        if not isinstance(parent, weakref.ref):
+            # Shared between several parents
+            return False
+        parent = parent()
+        return parent is None or getattr(parent, '_parent_', None) is None
+
+    def getGeneration_(self):
+        """
+        Start tracking the changes made to this object and the objects
+        under it, if not done yet.
+        @return: a number that changes every time one of the objects is
+        modified
+        """
+        generation = getattr(self, '_generation_', None)
+        if generation is None:
+            generation = self._generation_ = 0
+        return generation
+
+    def markUnmodified_(self, generation = None):
+        """
+        Record C{generation} (the current one by default) as the state
+        isModified_ compares with.
+        """
+        if generation is None:
+            generation = self.getGeneration_()
+        self._cleanGeneration_ = generation
+
+    def isModified_(self):
+        return self.getGeneration_() != getattr(self, '_cleanGeneration_', 0)
+
+    def isExportCached_(self):
+        return getattr(self, '_fragment_', None) is not None
@@ -0,0 +1,217 @@
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Input handling for the parser of serialized definitions.
+
+L{openInput} recognizes gzip, bzip2 and xz compressed definitions by their
+magic numbers, and returns a file object that decompresses them in chunks
+as the parser reads it, so that neither the whole compressed nor the whole
+decompressed text has to be held at once when reading from a file.
+Concatenated compressed streams (such as the members of a gzip file) are
+decompressed one after the other. Large plain regular files are memory
+mapped instead of read through the file buffers.
+
+Decompressing xz requires the C{lzma} module (or its C{backports.lzma}
+backport for python 2).
+"""
+
+import bz2
+import mmap
+import os
+import stat
+import StringIO
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+# Size of the reads from compressed files, and of the most data
+# decompressed at once where the decompressor can bound it
+chunkSize = 64 * 1024
+# Plain regular files at least this large are memory mapped
+mmapThreshold = 1024 * 1024
+
+
+def _gzipDecompressor():
+    # Skips the gzip header and checks the trailer
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+def _xzDecompressor():
+    if lzma is None:
+        raise RuntimeError("Decompressing xz input requires the lzma module")
+    return lzma.LZMADecompressor()
+
+# magic number -> decompressor factory
+_magics = [
+    ('\x1f\x8b', _gzipDecompressor),
+    ('BZh', bz2.BZ2Decompressor),
+    ('\xfd7zXZ\x00', _xzDecompressor),
+]
+_magicSize = max(len(x[0]) for x in _magics)
+
+def _getDecompressorFactory(head):
+    for magic, factory in _magics:
+        if head.startswith(magic):
+            return factory
+    return None
+
+def _decompress(decompressor, data):
+    """
+    @return: the data decompressed from C{data}, and the part of C{data}
+    left to decompress
+    """
+    if hasattr(decompressor, 'unconsumed_tail'):
+        # zlib can stop early, so that a small chunk of highly compressed
+        # data does not inflate to a much larger string
+        out = decompressor.decompress(data, chunkSize)
+        return out, decompressor.unconsumed_tail
+    return decompressor.decompress(data), ''
+
+
+class _InputReader(object):
+    """
+    Read-only file object returning the contents of another file object,
+    decompressed with the decompressors made by C{decompressorFactory} if
+    it is given. C{head} was already read from the file object.
+    """
+    def __init__(self, fobj, head, decompressorFactory = None):
+        self._fobj = fobj
+        self._factory = decompressorFactory
+        # Decompressor of the current compressed stream
+        self._decompressor = None
+        if decompressorFactory is not None:
+            self._decompressor = decompressorFactory()
+        # Data read from fobj and not returned or decompressed yet
+        self._input = head
+        self._buffer = ''
+        self._eof = False
+        self._offset = 0
+
+    def _readChunk(self):
+        if not self._input:
+            self._input = self._fobj.read(chunkSize)
+            if not self._input:
+                self._eof = True
+                flush = getattr(self._decompressor, 'flush', None)
+                if flush is not None:
+                    return flush()
+                return ''
+        if self._factory is None:
+            data, self._input = self._input, ''
+            return data
+        if self._decompressor is None:
+            # gzip files may be padded with zeros after their last member
+            self._input = self._input.lstrip('\0')
+            if not self._input:
+                return ''
+            self._decompressor = self._factory()
+        try:
+            data, self._input = _decompress(self._decompressor, self._input)
+        except EOFError:
+            # The stream ended with the previous chunk; bz2 and lzma refuse
+            # data after their end
+            self._decompressor = None
+            return ''
+        unused = getattr(self._decompressor, 'unused_data', '')
+        if unused:
+            # The data after the end of the stream starts another one
+            self._input = unused
+            self._decompressor = None
+        return data
+
+    def read(self, size = -1):
+        chunks = [ self._buffer ]
+        length = len(self._buffer)
+        while not self._eof and (size < 0 or length < size):
+            data = self._readChunk()
+            chunks.append(data)
+            length += len(data)
+        data = ''.join(chunks)
+        if size < 0 or length <= size:
+            self._buffer = ''
+        else:
+            data, self._buffer = data[:size], data[size:]
+        self._offset += len(data)
+        return data
+
+    def tell(self):
+        """
+        @return: the number of (decompressed) bytes read
+        """
+        return self._offset
+
+    def close(self):
+        # The wrapped file object belongs to the caller
+        self._buffer = ''
+        self._eof = True
+
+
+def _mapFile(fobj, head):
+    """
+    @return: a memory map of the rest of the regular file C{fobj},
+    positioned where C{head} started, or C{None} if the file cannot be
+    mapped or is smaller than L{mmapThreshold}
+    """
+    try:
+        fileno = fobj.fileno()
+        offset = fobj.tell() - len(head)
+        st = os.fstat(fileno)
+    except (AttributeError, IOError, OSError, ValueError):
+        return None
+    if not stat.S_ISREG(st.st_mode) or st.st_size - offset < mmapThreshold:
+        return None
+    try:
+        mapped = mmap.mmap(fileno, 0, access = mmap.ACCESS_READ)
+    except (EnvironmentError, ValueError):
+        return None
+    mapped.seek(offset)
+    # Leave the file at the end, as if it had been read
+    fobj.seek(0, os.SEEK_END)
+    return mapped
+
+
+def openInput(fromStream):
+    """
+    Prepare a serialized definition for parsing.
+    @param fromStream: An XML string or file, possibly compressed
+    @type fromStream: C{str} or C{file}
+    @return: the string to parse, or a file object to parse, which the
+    caller closes when done with it; closing it does not close
+    C{fromStream}
+    """
+    if isinstance(fromStream, unicode):
+        return fromStream
+    if isinstance(fromStream, str):
+        factory = _getDecompressorFactory(fromStream[:_magicSize])
+        if factory is None:
+            return fromStream
+        sio = StringIO.StringIO(fromStream)
+        return _InputReader(sio, sio.read(_magicSize), factory)
+    head = fromStream.read(_magicSize)
+    factory = _getDecompressorFactory(head)
+    if factory is not None:
+        return _InputReader(fromStream, head, factory)
+    mapped = _mapFile(fromStream, head)
+    if mapped is not None:
+        return mapped
+    return _InputReader(fromStream, head)
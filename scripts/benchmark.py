@@ -0,0 +1,267 @@
+#!/usr/bin/python
+#
+# Copyright (c) SAS Institute Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+
+"""
+Micro-benchmarks for rpath_proddef, run against the checkout this script
+lives in.
+
+Usage: benchmark.py COMMAND [options] [DEFINITION.xml]
+
+Commands:
+    build   parseStream through the dispatch tables and the generated build
+            methods, for the definition and for a copy of it with many
+            search paths, secondary labels and builds added (-c is the
+            number of each)
+    dict    toDict/fromDict compared to the XML round trip
+    export  export through the generated methods, the compiled writers and
+            the cached output
+    intern  memory used by loaded definitions, with and without interning
+            of label, flavor and trove name strings (-n is the number of
+            definitions)
+    text    parseStream through the dispatch tables and the generated build
+            methods, for a copy of the definition with large texts split
+            into many nodes (-s is their size in MiB)
+"""
+
+import json
+import optparse
+import os
+import resource
+import StringIO
+import sys
+import time
+
+DEFAULT_INPUT = 'proddef_test/archive/migration/product-definition-3.1-1.xml'
+
+def main():
+    rootdir = os.path.realpath(__file__ + '/../..')
+    sys.path.insert(0, rootdir)
+    from rpath_proddef import api1 as proddef
+    proddef.BaseDefinition.schemaDir = os.path.join(rootdir, 'xsd')
+
+    parser = optparse.OptionParser(
+        usage = "%prog COMMAND [options] [DEFINITION.xml]")
+    parser.add_option('-n', '--iterations', type = 'int', default = 200,
+        help = "Calls per measurement (default: %default)")
+    parser.add_option('-c', '--children', type = 'int', default = 500,
+        help = "Children of each kind added by the build benchmark "
+            "(default: %default)")
+    parser.add_option('-s', '--text-size', type = 'int', default = 2,
+        help = "MiB of text added by the text benchmark (default: %default)")
+    parser.add_option('-r', '--repeat', type = 'int', default = 3,
+        help = "Measurements per benchmark; the best one is reported "
+            "(default: %default)")
+    opts, args = parser.parse_args()
+    if not args or args[0] not in COMMANDS:
+        parser.error("Unknown command; use one of: %s" %
+            ', '.join(sorted(COMMANDS)))
+    command = args.pop(0)
+    path = args and args[0] or os.path.join(rootdir, DEFAULT_INPUT)
+    prd = proddef.ProductDefinition(fromStream = file(path))
+    COMMANDS[command](proddef, prd, opts)
+
+def timeCall(func, opts):
+    """
+    @return: the best time per call, in seconds
+    """
+    best = None
+    for _ in range(opts.repeat):
+        start = time.time()
+        for _ in xrange(opts.iterations):
+            func()
+        elapsed = (time.time() - start) / opts.iterations
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def report(title, results):
+    """
+    Print one line per (name, seconds per call), relative to the first
+    """
+    print title
+    base = results[0][1]
+    for name, elapsed in results:
+        print '    %-32s %10.3f ms %8.2fx' % (name, elapsed * 1000,
+            base / elapsed)
+
+def benchBuild(proddef, prd, opts):
+    from rpath_proddef import builder
+    sio = StringIO.StringIO()
+    prd.serialize(sio)
+    xmlData = sio.getvalue()
+
+    large = proddef.ProductDefinition(fromStream = xmlData)
+    for i in range(opts.children):
+        large.addSearchPath(troveName = 'group-bench-%d' % i,
+            label = 'bench.example.com@ns:bench-%d' % i)
+        large.addSecondaryLabel('bench-%d' % i, '-bench-%d' % i)
+        large.addBuildDefinition(name = 'Bench build %d' % i,
+            image = large.imageType('rawFsImage', dict(freespace = 1024)),
+            flavor = 'is: x86_64')
+    sio = StringIO.StringIO()
+    large.serialize(sio)
+    largeData = sio.getvalue()
+
+    def timeParse(data, enabled):
+        builder.enabled = enabled
+        try:
+            return timeCall(
+                lambda: proddef.ProductDefinition(fromStream = data), opts)
+        finally:
+            builder.enabled = True
+
+    for title, data in [ ("Definition", xmlData),
+            ("Definition with %d more children of each kind" %
+                opts.children, largeData) ]:
+        report("%s (%d bytes) to objects" % (title, len(data)), [
+            ('generated build methods', timeParse(data, False)),
+            ('dispatch tables', timeParse(data, True)),
+        ])
+
+def benchText(proddef, prd, opts):
+    from rpath_proddef import builder
+    sio = StringIO.StringIO()
+    prd.serialize(sio)
+    large = proddef.ProductDefinition(fromStream = sio.getvalue())
+    # Half of the text goes to a text element (productDescription), half
+    # to an object with text content (secondaryLabel); comments split it
+    # into nodes of 1 KiB
+    large.setProductDescription('@DESCRIPTION@')
+    large.addSecondaryLabel('bench', '@LABEL@')
+    sio = StringIO.StringIO()
+    large.serialize(sio)
+    chunkCount = opts.text_size * 1024 / 2
+    text = '<!-- -->'.join([ 'x' * 1023 + '\n' ] * chunkCount)
+    data = sio.getvalue().replace('@DESCRIPTION@', text).replace(
+        '@LABEL@', text)
+
+    # Each parse takes long enough to be timed alone
+    parseOpts = optparse.Values(dict(iterations = 1, repeat = opts.repeat))
+    def timeParse(enabled):
+        builder.enabled = enabled
+        try:
+            return timeCall(
+                lambda: proddef.ProductDefinition(fromStream = data),
+                parseOpts)
+        finally:
+            builder.enabled = True
+
+    report("Definition with %d MiB of text in %d nodes to objects" % (
+            opts.text_size, chunkCount * 2), [
+        ('generated build methods', timeParse(False)),
+        ('dispatch tables', timeParse(True)),
+    ])
+
+def benchDict(proddef, prd, opts):
+    def serialize():
+        sio = StringIO.StringIO()
+        prd.serialize(sio)
+        return sio.getvalue()
+    xmlData = serialize()
+    dictData = prd.toDict()
+    jsonData = json.dumps(dictData)
+
+    report("Definition to data", [
+        ('serialize', timeCall(serialize, opts)),
+        ('toDict', timeCall(prd.toDict, opts)),
+        ('json.dumps(toDict)',
+            timeCall(lambda: json.dumps(prd.toDict()), opts)),
+    ])
+    report("Data to definition", [
+        ('parseStream', timeCall(
+            lambda: proddef.ProductDefinition(fromStream = xmlData), opts)),
+        ('fromDict', timeCall(
+            lambda: proddef.ProductDefinition.fromDict(dictData), opts)),
+        ('fromDict(json.loads)', timeCall(
+            lambda: proddef.ProductDefinition.fromDict(
+                json.loads(jsonData)), opts)),
+    ])
+    print "XML: %d bytes, JSON: %d bytes" % (len(xmlData), len(jsonData))
+
+def benchExport(proddef, prd, opts):
+    from rpath_proddef import exporter
+    sio = StringIO.StringIO()
+    prd.serialize(sio)
+    xmlData = sio.getvalue()
+
+    def timeExport(enabled):
+        # Each call exports a tree that has no cached output yet
+        trees = [ proddef.ProductDefinition(fromStream = xmlData)._rootObj
+            for _ in range(opts.iterations * opts.repeat) ]
+        exporter.enabled = enabled
+        try:
+            return timeCall(
+                lambda: trees.pop().export(StringIO.StringIO(), 0), opts)
+        finally:
+            exporter.enabled = True
+
+    rootObj = prd._rootObj
+    report("Export of the definition", [
+        ('generated methods', timeExport(False)),
+        ('compiled writers', timeExport(True)),
+        ('cached output',
+            timeCall(lambda: rootObj.export(StringIO.StringIO(), 0), opts)),
+    ])
+
+def benchIntern(proddef, prd, opts):
+    from rpath_proddef import interning
+    sio = StringIO.StringIO()
+    prd.serialize(sio)
+    corpus = [ sio.getvalue() ] * opts.iterations
+
+    def load(maxSize):
+        interning.strings.maxSize = maxSize
+        interning.strings.clear()
+        start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        defs = [ proddef.ProductDefinition(fromStream = x) for x in corpus ]
+        end = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return end - start, interning.strings.report()
+
+    print "Peak resident memory growth loading %d definitions" % len(corpus)
+    for title, maxSize in [ ('interned', interning.StringInterner().maxSize),
+            ('not interned', 0) ]:
+        # Peak RSS only grows; measure each case in its own process
+        rfd, wfd = os.pipe()
+        pid = os.fork()
+        if not pid:
+            os.close(rfd)
+            os.write(wfd, json.dumps(load(maxSize)))
+            os._exit(0)
+        os.close(wfd)
+        data = ''
+        while True:
+            chunk = os.read(rfd, 4096)
+            if not chunk:
+                break
+            data += chunk
+        os.close(rfd)
+        os.waitpid(pid, 0)
+        growth, report = json.loads(data)
+        print '    %-32s %10d KiB  %s' % (title, growth,
+            ', '.join('%s=%s' % x for x in sorted(report.items())))
+
+COMMANDS = {
+    'build' : benchBuild,
+    'dict' : benchDict,
+    'export' : benchExport,
+    'intern' : benchIntern,
+    'text' : benchText,
+}
+
+if __name__ == '__main__':
+    main()